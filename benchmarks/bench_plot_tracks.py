@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import io
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib as mpl
+import cartopy.crs as ccrs
+import tabulate
+from rug.viz.tracks import plot_tracks
+
+PROJECTIONS = {'platecarree': ccrs.PlateCarree,
+               'mercator': ccrs.Mercator,
+               'robinson': ccrs.Robinson}
+
+
+def random_tracks(num_tracks, num_fixes, extent, seed=0):
+    """
+    Random walk GPS tracks starting inside the extent
+    :param num_tracks: number of tracks
+    :param num_fixes: number of fixes per track
+    :param extent: (west, east, south, north) in decimal degrees
+    :param seed: random number generator seed
+    :return: list of track data frames with columns longitude, latitude
+    """
+    rng = np.random.default_rng(seed)
+    west, east, south, north = extent
+    tracks = []
+    for i in range(num_tracks):
+        start = rng.uniform((west, south), (east, north))
+        xy = start + np.cumsum(rng.normal(0., .01, (num_fixes, 2)), axis=0)
+        tracks.append(pd.DataFrame({'longitude': np.clip(xy[:, 0], west, east),
+                                    'latitude': np.clip(xy[:, 1], south, north)}))
+
+    return tracks
+
+
+def render(tracks, colors, projection, extent, dpi, linewidth, collection):
+    """
+    Draw the tracks on a Cartopy map and save it as a PNG, the way plot_map.py does
+    :param collection: True to draw with rug.viz.tracks.plot_tracks, False to call map_ax.plot once per track
+    :return: PNG image bytes
+    """
+    fig = plt.figure(figsize=(11, 8.5))
+    map_ax = fig.add_subplot(projection=projection)
+    map_ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+    if collection:
+        plot_tracks(map_ax, tracks, colors, linewidth=linewidth, transform=ccrs.PlateCarree(), dpi=dpi)
+    else:
+        for track, color in zip(tracks, colors):
+            map_ax.plot(track.longitude, track.latitude,
+                        marker='None',
+                        linestyle='-',
+                        linewidth=linewidth,
+                        color=color,
+                        transform=ccrs.PlateCarree())
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi)
+    plt.close(fig)
+
+    return buf.getvalue()
+
+
+def main(args):
+    """Benchmark drawing GPS tracks on a Cartopy map with rug.viz.tracks.plot_tracks against one map_ax.plot call per
+    track, as plot_map.py used to do"""
+
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    logging.basicConfig(format=log_format, level=log_level)
+
+    extent = (-80., -60., 30., 45.)
+    projection = PROJECTIONS[args.projection]()
+
+    results = []
+    for num_tracks in args.num_tracks:
+        tracks = random_tracks(num_tracks, args.num_fixes, extent)
+        colors = mpl.colormaps['rainbow'].resampled(num_tracks)(np.arange(num_tracks))
+        logging.info('Drawing {:} tracks of {:} fixes on a {:} map'.format(num_tracks, args.num_fixes,
+                                                                        args.projection))
+
+        def per_track():
+            return render(tracks, colors, projection, extent, args.dpi, args.linewidth, False)
+
+        def collection():
+            return render(tracks, colors, projection, extent, args.dpi, args.linewidth, True)
+
+        t_plot = min(timeit.repeat(per_track, number=1, repeat=args.repeat))
+        t_collection = min(timeit.repeat(collection, number=1, repeat=args.repeat))
+
+        # Fraction of pixels differing by more than half intensity in any channel
+        image_plot = plt.imread(io.BytesIO(per_track()))
+        image_collection = plt.imread(io.BytesIO(collection()))
+        differ = (np.abs(image_plot - image_collection) > .5).any(axis=-1).mean()
+
+        results.append([num_tracks, args.num_fixes, '{:0.3f}'.format(t_plot), '{:0.3f}'.format(t_collection),
+                        '{:0.1f}x'.format(t_plot / t_collection), '{:0.4%}'.format(differ)])
+
+    sys.stdout.write('{:}\n'.format(tabulate.tabulate(results, tablefmt=args.format, disable_numparse=True,
+                                                      headers=['tracks', 'fixes', 'plot_s', 'plot_tracks_s',
+                                                               'speedup', 'pixels_differ'])))
+
+    return 0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=main.__doc__,
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    arg_parser.add_argument('-t', '--num_tracks',
+                            help='Numbers of tracks to draw',
+                            type=int,
+                            nargs='+',
+                            default=[30, 300])
+
+    arg_parser.add_argument('-n', '--num_fixes',
+                            help='Number of GPS fixes per track',
+                            type=int,
+                            default=5000)
+
+    arg_parser.add_argument('-p', '--projection',
+                            help='Map projection',
+                            choices=sorted(PROJECTIONS),
+                            default='mercator')
+
+    arg_parser.add_argument('--dpi',
+                            help='Image resolution',
+                            type=int,
+                            default=300)
+
+    arg_parser.add_argument('--linewidth',
+                            help='Track line width',
+                            type=float,
+                            default=2.)
+
+    arg_parser.add_argument('-r', '--repeat',
+                            help='Number of timed runs. The fastest is reported',
+                            type=int,
+                            default=3)
+
+    arg_parser.add_argument('-f', '--format',
+                            help='Pretty print the results using a tabulate format',
+                            type=str,
+                            choices=tabulate.tabulate_formats,
+                            default='psql')
+
+    arg_parser.add_argument('-l', '--loglevel',
+                            help='Verbosity level',
+                            type=str,
+                            choices=['debug', 'info', 'warning', 'error', 'critical'],
+                            default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
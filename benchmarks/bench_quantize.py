@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import sys
+import timeit
+from decimal import Decimal, ROUND_HALF_DOWN
+import numpy as np
+import tabulate
+from rug.geo import quantize
+
+
+def decimal_quantize(values, precision):
+    return np.array([float(Decimal(v).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)) for v in values])
+
+
+def main(args):
+    """Benchmark the vectorized rug.geo.quantize against per-value Decimal quantization of GPS positions"""
+
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    logging.basicConfig(format=log_format, level=log_level)
+
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-180., 180., args.num_values)
+
+    results = []
+    for precision in args.precisions:
+        logging.info('Quantizing {:} values to {:}'.format(values.size, precision))
+        if not np.array_equal(quantize(values, precision), decimal_quantize(values, precision), equal_nan=True):
+            logging.error('quantize and Decimal results differ for precision {:}'.format(precision))
+            return 1
+
+        t_decimal = min(timeit.repeat(lambda: decimal_quantize(values, precision), number=1, repeat=args.repeat))
+        t_vector = min(timeit.repeat(lambda: quantize(values, precision), number=1, repeat=args.repeat))
+        results.append([precision, values.size, '{:0.4f}'.format(t_decimal), '{:0.4f}'.format(t_vector),
+                        '{:0.1f}x'.format(t_decimal / t_vector)])
+
+    sys.stdout.write('{:}\n'.format(tabulate.tabulate(results, tablefmt=args.format, disable_numparse=True,
+                                                      headers=['precision', 'values', 'decimal_s', 'quantize_s',
+                                                               'speedup'])))
+
+    return 0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=main.__doc__,
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    arg_parser.add_argument('-n', '--num_values',
+                            help='Number of random longitudes',
+                            type=int,
+                            default=100000)
+
+    arg_parser.add_argument('-p', '--precisions',
+                            help='Quantization precisions',
+                            nargs='+',
+                            default=['0.001', '0.0001', '1E-9', '1'])
+
+    arg_parser.add_argument('-r', '--repeat',
+                            help='Number of timed runs. The fastest is reported',
+                            type=int,
+                            default=3)
+
+    arg_parser.add_argument('-f', '--format',
+                            help='Pretty print the results using a tabulate format',
+                            type=str,
+                            choices=tabulate.tabulate_formats,
+                            default='psql')
+
+    arg_parser.add_argument('-l', '--loglevel',
+                            help='Verbosity level',
+                            type=str,
+                            choices=['debug', 'info', 'warning', 'error', 'critical'],
+                            default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -1,156 +1,454 @@
 import logging
 import requests
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from shapely.geometry import Polygon
 from geopandas import GeoDataFrame
-from rug.api.urls import end_points
+from rug.api.client import RugApiClient
+from rug.api.cache import ResponseCache, DEFAULT_CACHE_DIR
+from rug.api.throttle import RateLimiter
+from rug.api.decoders import decode_json
 
 logging.getLogger(__file__)
 
+DeploymentLookup = namedtuple('DeploymentLookup', ['found', 'missing', 'duplicated', 'failed'])
 
-def get_deployments_by_name(deployment_names: list):
+# Compact dtypes of the deployments data frame columns
+DEPLOYMENT_SCHEMA = {'deployment_id': 'int32',
+                     'glider_id': 'int32',
+                     'project_id': 'int32',
+                     'coolops_did': 'int32',
+                     'glider': 'category',
+                     'project_name': 'category',
+                     'os': 'category',
+                     'distance_flown_km': 'float32',
+                     'latitude': 'float32',
+                     'longitude': 'float32',
+                     'lat': 'float32',
+                     'lon': 'float32'}
+
+_default_client = None
+
+
+def get_client():
+    """
+    Return the shared RugApiClient instance used by the module level fetch functions, creating it on first use
+    :return: RugApiClient
+    """
+    global _default_client
+
+    if _default_client is None:
+        _default_client = RugApiClient()
+
+    return _default_client
+
+
+def set_client(client):
+    """
+    Replace the shared RugApiClient instance used by the module level fetch functions
+    :param client: RugApiClient instance
+    :return: the previous RugApiClient instance or None
+    """
+    global _default_client
+
+    if not isinstance(client, RugApiClient):
+        raise TypeError('client must be a RugApiClient instance')
+
+    previous_client = _default_client
+    _default_client = client
+
+    return previous_client
+
+
+def add_client_arguments(arg_parser, workers_help='Maximum number of concurrent track requests'):
+    """
+    Add the --workers, --max_rate and --cache command line arguments read by client_from_args to an argument parser
+    :param arg_parser: argparse.ArgumentParser
+    :param workers_help: help message of the --workers argument
+    :return: the argument parser
+    """
+    arg_parser.add_argument('--workers',
+                            help=workers_help,
+                            type=int,
+                            default=8)
+
+    arg_parser.add_argument('--max_rate',
+                            help='Maximum number of API requests per second',
+                            type=float)
+
+    arg_parser.add_argument('--cache',
+                            dest='cache_dir',
+                            help='Cache API responses in the specified directory',
+                            nargs='?',
+                            const=DEFAULT_CACHE_DIR)
+
+    return arg_parser
+
+
+def client_from_args(args):
+    """
+    Create a RugApiClient from the command line arguments added by add_client_arguments and make it the shared client
+    used by the module level fetch functions
+    :param args: argparse.Namespace with cache_dir and max_rate attributes
+    :return: RugApiClient
+    """
+    cache = None
+    if args.cache_dir:
+        logging.info('Caching API responses in {:}'.format(args.cache_dir))
+        cache = ResponseCache(args.cache_dir)
+    rate_limiter = None
+    if args.max_rate:
+        logging.info('Limiting API requests to {:} per second'.format(args.max_rate))
+        rate_limiter = RateLimiter(args.max_rate)
+
+    client = RugApiClient(cache=cache, rate_limiter=rate_limiter)
+    set_client(client)
+
+    return client
+
+
+def get_deployments_by_name(deployment_names: list, client=None):
     """
     Fetch one or more metadata records for the specified deployment name(s)
     :param deployment_names: list of registered deployment names
+    :param client: RugApiClient instance. Defaults to the shared client
     :return: DataFrame containing deployment metadata records
     """
 
-    deployments = pd.DataFrame()
+    deployments, lookup = lookup_deployments(deployment_names, client=client, max_workers=1)
+
+    return deployments
+
+
+def lookup_deployments(deployment_names: list, deployments=None, client=None, max_workers=8):
+    """
+    Fetch the metadata records for many deployment names concurrently. Names found in the (optional) already fetched
+    deployments data frame are taken from it and only the remaining names are requested from the API.
+    :param deployment_names: list of registered deployment names
+    :param deployments: optional deployments data frame, as returned by get_all_deployments, indexed by deployment_name
+    :param client: RugApiClient instance. Defaults to the shared client
+    :param max_workers: maximum number of deployment requests in flight at once. Use 1 to fetch sequentially
+    :return: tuple of the DataFrame containing the deployment metadata records, in the order requested, and a
+        DeploymentLookup report listing the names that were found, missing, duplicated or failed
+    """
+
+    client = client or get_client()
+
+    # Drop repeated names but preserve the requested order
+    deployment_names = list(dict.fromkeys(deployment_names))
+
+    lookup = DeploymentLookup([], [], [], [])
+
+    local_names = []
+    remote_names = deployment_names
+    if deployments is not None and not deployments.empty:
+        local_names = [n for n in deployment_names if n in deployments.index]
+        remote_names = [n for n in deployment_names if n not in deployments.index]
+        logging.debug('{:} deployment(s) found in the specified deployments data frame'.format(len(local_names)))
+
+    if max_workers > 1 and len(remote_names) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(remote_names))) as executor:
+            responses = list(executor.map(lambda d: fetch_deployment_record(d, client=client), remote_names))
+    else:
+        responses = [fetch_deployment_record(deployment_name, client=client) for deployment_name in remote_names]
 
-    base_url = end_points['DEPLOYMENTS'].url
     results = {'data': [],
                'count': 0}
-    for deployment_name in deployment_names:
-        deployment_url = '{:}?deployment={:}'.format(base_url, deployment_name)
-        try:
-            r = requests.get(deployment_url, timeout=10)
-            if r.status_code != 200:
-                logging.warning('Failed to fetch deployment {:} ({:})'.format(deployment_name, e))
-                continue
-            response = r.json()
-            if response['count'] == 0:
-                logging.warning('No deployment found for deployment_name {:}'.format(deployment_name))
-                continue
-            elif response['count'] > 1:
-                logging.warning('Multiple deployments found for deployment name {:}'.format(deployment_name))
-                continue
-            results['data'].append(response['data'][0])
+    for deployment_name, (status, record) in zip(remote_names, responses):
+        getattr(lookup, status).append(deployment_name)
+        if status == 'found':
+            results['data'].append(record)
             results['count'] += 1
-        except (requests.exceptions.RequestException, ValueError) as e:
-            logging.error('{:}: {:}'.format(deployment_name, e))
 
+    frames = []
+    if local_names:
+        frames.append(deployments.loc[local_names])
     if results['count'] > 0:
-        deployments = deployments_json_to_df(results)
-    else:
+        frames.append(deployments_json_to_df(results))
+
+    if not frames:
         logging.warning('No deployments found for specified deployment name(s)')
+        return pd.DataFrame(), lookup
 
-    return deployments
+    found_deployments = pd.concat(frames) if len(frames) > 1 else frames[0]
+
+    # Return the deployments in the order requested
+    found_names = [n for n in deployment_names if n in found_deployments.index]
+    lookup.found[:] = found_names
+
+    return found_deployments.loc[found_names], lookup
 
 
-def get_active_deployments():
+def fetch_deployment_record(deployment_name: str, client=None):
+    """
+    Fetch the single metadata record for the specified deployment name
+    :param deployment_name: registered deployment name
+    :param client: RugApiClient instance. Defaults to the shared client
+    :return: tuple of the lookup status (found, missing, duplicated or failed) and the record (None if not found)
+    """
+    client = client or get_client()
+
+    deployment_url = '{:}?deployment={:}'.format(client.url('DEPLOYMENTS'), deployment_name)
+    try:
+        r = client.get(deployment_url, timeout=10)
+        if r.status_code != 200:
+            logging.warning('Failed to fetch deployment {:} ({:})'.format(deployment_name, r.status_code))
+            return 'failed', None
+        response = decode_json(r)
+        if response['count'] == 0:
+            logging.warning('No deployment found for deployment_name {:}'.format(deployment_name))
+            return 'missing', None
+        elif response['count'] > 1:
+            logging.warning('Multiple deployments found for deployment name {:}'.format(deployment_name))
+            return 'duplicated', None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error('{:}: {:}'.format(deployment_name, e))
+        return 'failed', None
+
+    return 'found', response['data'][0]
+
+
+def get_active_deployments(client=None):
     """
     Fetch all active deployments
+    :param client: RugApiClient instance. Defaults to the shared client
     :return: data frame
     """
 
+    client = client or get_client()
+
     deployments = pd.DataFrame()
 
-    r = requests.get(end_points['ACTIVE_DEPLOYMENTS'].url, timeout=30)
+    r = client.get('ACTIVE_DEPLOYMENTS', timeout=30)
     response = None
     if r.status_code == 200:
-        response = r.json()
+        response = decode_json(r)
         deployments = deployments_json_to_df(response)
 
     return deployments
 
 
-def get_all_deployments():
+def get_all_deployments(client=None):
     """
     Fetch all registered deployments (active and recovered)
+    :param client: RugApiClient instance. Defaults to the shared client
     :return: data frame
     """
 
+    client = client or get_client()
+
     deployments = pd.DataFrame()
 
-    r = requests.get(end_points['DEPLOYMENTS'].url, timeout=30)
+    r = client.get('DEPLOYMENTS', timeout=30)
     response = None
     if r.status_code == 200:
-        response = r.json()
+        response = decode_json(r)
         deployments = deployments_json_to_df(response)
 
     return deployments
 
 
-def df2geodf(deployments, crs='EPSG:4326'):
+def search_deployments(query, client=None, max_workers=4, pushdown=False):
+    """
+    Search the deployments API. The full deployments list (or the active deployments) is downloaded and filtered
+    locally unless pushdown is True, in which case the query predicates are pushed to the API when possible to limit
+    the download to the matching deployments. The pushed down query parameters (i.e.: type=gliders&glider=) are not part
+    of the documented API, so pushdown is off by default. The query filter is always applied to the downloaded
+    deployments and only a failed pushed down query falls back to filtering all deployments.
+    :param query: rug.api.query.DeploymentQuery instance
+    :param client: RugApiClient instance. Defaults to the shared client
+    :param max_workers: maximum number of pushed down requests in flight at once
+    :param pushdown: True to push the query predicates down to the API
+    :return: data frame
+    """
+    client = client or get_client()
+
+    params = query.pushdown() if pushdown else None
+    if params:
+        logging.debug('Pushing {:} down to the API as {:} request(s)'.format(query, len(params)))
+        base_url = '{:}/'.format(client.url('DEPLOYMENTS'))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(params)))) as executor:
+            responses = list(executor.map(lambda p: _fetch_json(base_url, client, params=p), params))
+
+        if all([response is not None for response in responses]):
+            records = {}
+            for response in responses:
+                records.update({record['deployment_name']: record for record in response['data']})
+            if not records:
+                return pd.DataFrame()
+            return query.filter(deployments_json_to_df({'data': list(records.values())}))
+
+        logging.warning('Query pushdown failed. Filtering all deployments locally')
+
+    if query.active:
+        deployments = get_active_deployments(client=client)
+    else:
+        deployments = get_all_deployments(client=client)
+
+    return query.filter(deployments)
+
+
+def _fetch_json(url, client, params=None, timeout=30):
+    """
+    Fetch and decode an API response
+    :param url: request url
+    :param client: RugApiClient instance
+    :param params: optional dictionary of query parameters
+    :param timeout: request timeout
+    :return: decoded response or None if the request failed
+    """
+    try:
+        r = client.get(url, params=params, timeout=timeout)
+        if r.status_code != 200:
+            logging.error('Request failed: {:} ({:})'.format(r.url, r.status_code))
+            return None
+        return decode_json(r)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logging.error('{:}: {:}'.format(url, e))
+        return None
+
+
+def df2geodf(deployments, crs='EPSG:4326', client=None, max_workers=1):
     """
     Convert a deployments API data frame to a GeoPandas data frame
     :param deployments: deployments API data frame
     :param crs: coordinate reference system of the GeoPandas geometries
+    :param client: RugApiClient instance. Defaults to the shared client
+    :param max_workers: maximum number of track bounding box requests in flight at once. Use 1 to fetch sequentially
     :return: GeoPandas data frame
     """
-    geo_df = GeoDataFrame()
-    bboxes = []
-    for deployment_name, row in deployments.iterrows():
-
-        track_url = '{:}/?deployment={:}'.format(end_points['TRACKS'].url, deployment_name)
-
-        bbox = Polygon()
-
-        try:
-            r = requests.get(track_url, timeout=10)
-            if r.status_code == 200:
-                response = r.json()
-                if not response['bbox']:
-                    logging.debug('No track (bounding box) for for {:}'.format(deployment_name))
-                else:
-                    # Create the shapely.Polygon
-                    # polygon = [nw, ne, se, sw, nw]
-                    bbox = Polygon(((response['bbox'][3], response['bbox'][0]),
-                                    (response['bbox'][3], response['bbox'][2]),
-                                    (response['bbox'][1], response['bbox'][2]),
-                                    (response['bbox'][1], response['bbox'][0]),
-                                    (response['bbox'][3], response['bbox'][0])))
-        except Exception as e:
-            logging.error('{:}: {:}'.format(deployment_name, e))
-
-        bboxes.append(bbox)
+    client = client or get_client()
+
+    deployment_names = deployments.index.tolist()
+
+    # Tracks of recovered deployments never change and may be cached indefinitely
+    if 'end_date' in deployments:
+        recovered = deployments.end_date.notna().tolist()
+    else:
+        recovered = [False] * len(deployment_names)
+
+    if max_workers > 1 and len(deployment_names) > 1:
+        if max_workers > client.pool_maxsize:
+            logging.warning('max_workers ({:}) exceeds the client connection pool size ({:})'.format(max_workers,
+                                                                                                   client.pool_maxsize))
+        logging.debug('Fetching {:} track bounding boxes using {:} workers'.format(len(deployment_names),
+                                                                                 max_workers))
+        # executor.map returns the results in the order of deployment_names
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(deployment_names))) as executor:
+            bboxes = list(executor.map(lambda d, r: fetch_track_bbox(d, client=client, recovered=r),
+                                       deployment_names, recovered))
+    else:
+        bboxes = [fetch_track_bbox(d, client=client, recovered=r) for d, r in zip(deployment_names, recovered)]
 
     geo_df = GeoDataFrame(deployments, geometry=bboxes, crs=crs)
 
     return geo_df
 
 
+def fetch_track_bbox(deployment_name: str, client=None, recovered=False, failed=Polygon()):
+    """
+    Fetch the track bounding box for the specified deployment and convert it to a shapely Polygon
+    :param deployment_name: registered deployment name
+    :param client: RugApiClient instance. Defaults to the shared client
+    :param recovered: True if the deployment has been recovered, allowing a cached track to be kept longer
+    :param failed: value returned if the request failed. Defaults to an empty Polygon, the same as a deployment with
+        no track. Use None to tell the two apart
+    :return: shapely Polygon, which is empty if the deployment has no track, or failed if the request failed
+    """
+    client = client or get_client()
+
+    track_url = '{:}/?deployment={:}'.format(client.url('TRACKS'), deployment_name)
+
+    bbox = failed
+
+    try:
+        r = client.get(track_url, timeout=10, ttl_key='RECOVERED_TRACKS' if recovered else None)
+        if r.status_code == 200:
+            response = decode_json(r)
+            if not response['bbox']:
+                logging.debug('No track (bounding box) for for {:}'.format(deployment_name))
+                bbox = Polygon()
+            else:
+                bbox = bbox_to_polygon(response['bbox'])
+        else:
+            logging.error('Failed to fetch {:} track bounding box ({:})'.format(deployment_name, r.status_code))
+    except Exception as e:
+        logging.error('{:}: {:}'.format(deployment_name, e))
+
+    return bbox
+
+
+def bbox_to_polygon(bbox):
+    """
+    Convert a tracks API bounding box to the shapely Polygon used as the deployment geometry
+    :param bbox: tracks API bounding box [west, south, east, north]
+    :return: shapely Polygon
+    """
+    # Create the shapely.Polygon
+    # polygon = [nw, ne, se, sw, nw]
+    return Polygon(((bbox[3], bbox[0]),
+                    (bbox[3], bbox[2]),
+                    (bbox[1], bbox[2]),
+                    (bbox[1], bbox[0]),
+                    (bbox[3], bbox[0])))
+
+
 def deployments_json_to_df(response_json):
     """
-    Convert an deployments API response to a pandas data frame
+    Convert an deployments API response to a pandas data frame. The last_surfacing record of each deployment is
+    flattened into the deployment columns and the columns listed in DEPLOYMENT_SCHEMA are converted to compact dtypes.
+    The response is not modified.
     :param response_json: deployments API response
     :return: data frame
     """
-    deployments = []
-    for response_item in response_json['data']:
-
-        if 'last_surfacing' in response_item:
-            srf = response_item.pop('last_surfacing')
+    records = response_json['data']
 
-            response_item.update(srf)
+    deployments_df = pd.DataFrame.from_records(records)
 
-        deployments.append(response_item)
-
-    deployments_df = pd.DataFrame(deployments)
+    # Flatten the last_surfacing records in bulk. last_surfacing values replace deployment values of the same name.
+    if 'last_surfacing' in deployments_df:
+        surfacings = [srf if isinstance(srf, dict) else {} for srf in deployments_df.pop('last_surfacing')]
+        surfacings_df = pd.DataFrame.from_records(surfacings, index=deployments_df.index)
+        overlap = surfacings_df.columns.intersection(deployments_df.columns)
+        for column in overlap:
+            deployments_df[column] = surfacings_df.pop(column).combine_first(deployments_df[column])
+        if not surfacings_df.empty:
+            deployments_df = pd.concat([deployments_df, surfacings_df], axis=1, copy=False)
 
     # Convert None in end_date_epoch to NaN
-#    deployments_df.end_date_epoch.fillna(pd.NaT, inplace=True)
-    deployments_df['end_date_epoch'] = deployments_df.end_date_epoch.fillna(pd.NaT)
+    deployments_df['end_date_epoch'] = pd.to_numeric(deployments_df.end_date_epoch, errors='coerce')
 
     # Convert start_date_epoch and end_date_epoch to datetimes
     deployments_df['start_date'] = pd.to_datetime(deployments_df.start_date_epoch, unit='s')
     deployments_df['end_date'] = pd.to_datetime(deployments_df.end_date_epoch, unit='s')
 
     # update column names
-    deployments_df['glider'] = deployments_df.glider_name
+    deployments_df = deployments_df.rename(columns={'glider_name': 'glider'})
+    columns = [c for c in deployments_df.columns if c != 'glider'] + ['glider']
+
+    return _apply_schema(deployments_df[columns], DEPLOYMENT_SCHEMA).set_index('deployment_name')
 
-    # Drop columns
-    drop_columns = ['glider_name']
 
-    return deployments_df.drop(columns=drop_columns).set_index('deployment_name')
+def _apply_schema(df, schema):
+    """
+    Convert the data frame columns to the dtypes in schema. Integer columns containing missing values are converted
+    to the equivalent nullable integer dtype. Columns not in the data frame are ignored.
+    :param df: data frame
+    :param schema: dictionary of column name: dtype
+    :return: data frame
+    """
+    for column, dtype in schema.items():
+        if column not in df:
+            continue
+        values = df[column]
+        if dtype.startswith('int'):
+            values = pd.to_numeric(values, errors='coerce')
+            if values.isna().any():
+                dtype = dtype.capitalize()
+        elif dtype.startswith('float'):
+            values = pd.to_numeric(values, errors='coerce')
+        df[column] = values.astype(dtype)
+
+    return df
@@ -0,0 +1,319 @@
+import logging
+import os
+import json
+import time
+import sqlite3
+import threading
+import pandas as pd
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from rug.api.urls import end_points
+
+logging.getLogger(__file__)
+
+# Default time to live, in seconds, of a cached response by end point name. RECOVERED_TRACKS is not an end point but
+# is used for the tracks of recovered deployments, which never change.
+DEFAULT_TTLS = {'ACTIVE_DEPLOYMENTS': 5 * 60,
+                'DEPLOYMENTS': 60 * 60,
+                'GLIDERS': 24 * 60 * 60,
+                'PROJECTS': 24 * 60 * 60,
+                'INSTRUMENTS': 24 * 60 * 60,
+                'PAYLOAD_BAYS': 24 * 60 * 60,
+                'TRACKS': 10 * 60,
+                'RECOVERED_TRACKS': 30 * 24 * 60 * 60,
+                'SURFACINGS': 10 * 60}
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rugapitools')
+
+# Response headers that no longer apply once the body has been decoded and stored
+_DROP_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive']
+
+
+class ResponseCache(object):
+    """
+    Persistent on-disk cache of successful API responses with per end point time to live (TTL), ETag/Last-Modified
+    revalidation and least recently used (LRU) eviction once the cache exceeds its size cap. Entries are stored in a
+    SQLite database in the cache directory.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 ** 2, ttls=None, urls=None):
+        """
+        :param cache_dir: directory containing the cache database. Created if it does not exist
+        :param max_bytes: maximum total size, in bytes, of the cached response bodies
+        :param ttls: dictionary of end point name: TTL (seconds) overriding DEFAULT_TTLS
+        :param urls: dictionary of end points. Defaults to rug.api.urls.end_points
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self._ttls.update(ttls)
+
+        # Match urls to end points using the longest end point url first (ACTIVE_DEPLOYMENTS before DEPLOYMENTS)
+        urls = urls or end_points
+        self._prefixes = sorted([(e.url, name) for name, e in urls.items()], key=lambda x: len(x[0]), reverse=True)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db_file = os.path.join(cache_dir, 'responses.sqlite')
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self._db_file, check_same_thread=False)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('CREATE TABLE IF NOT EXISTS responses '
+                          '(url TEXT PRIMARY KEY, '
+                          'end_point TEXT, '
+                          'ttl_key TEXT, '
+                          'status_code INTEGER, '
+                          'headers TEXT, '
+                          'body BLOB, '
+                          'etag TEXT, '
+                          'last_modified TEXT, '
+                          'fetched REAL, '
+                          'accessed REAL, '
+                          'size INTEGER)')
+        self._con.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._con.commit()
+
+        self._hits = 0
+        self._revalidated = 0
+        self._misses = 0
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def ttls(self):
+        return self._ttls
+
+    @property
+    def stats(self):
+        return {'hits': self._hits, 'revalidated': self._revalidated, 'misses': self._misses}
+
+    def end_point_for(self, url):
+        """
+        Return the name of the end point the url belongs to
+        :param url: request url
+        :return: end point name or None
+        """
+        for prefix, name in self._prefixes:
+            if url.startswith(prefix):
+                return name
+
+        return None
+
+    def ttl_for(self, url, ttl_key=None):
+        """
+        Return the time to live, in seconds, of a cached response
+        :param url: request url
+        :param ttl_key: TTL name overriding the end point name of the url (i.e.: RECOVERED_TRACKS)
+        :return: TTL in seconds
+        """
+        key = ttl_key or self.end_point_for(url)
+
+        return self._ttls.get(key, 0)
+
+    def get(self, url, fetch, ttl_key=None):
+        """
+        Return the cached response for the url if it is within its TTL. Otherwise, call fetch, conditionally if the
+        cached entry has an ETag or Last-Modified validator, and cache the successful response.
+        :param url: full request url, including the query string
+        :param fetch: callable taking a dictionary of additional request headers and returning a requests.Response
+        :param ttl_key: TTL name overriding the end point name of the url (i.e.: RECOVERED_TRACKS)
+        :return: requests.Response
+        """
+        entry = self.lookup(url)
+        if entry and self.is_fresh(entry, ttl_key=ttl_key):
+            logging.debug('Cache hit: {:}'.format(url))
+            self._hits += 1
+            return self.to_response(entry)
+
+        headers = self.validators(entry) if entry else {}
+        response = fetch(headers)
+
+        if entry and response.status_code == 304:
+            logging.debug('Cache revalidated: {:}'.format(url))
+            self.revalidated(entry, ttl_key=ttl_key)
+            return self.to_response(entry)
+
+        self._misses += 1
+        if response.status_code == 200:
+            self.store(url, response, ttl_key=ttl_key)
+
+        return response
+
+    def lookup(self, url):
+        """
+        Return the cached entry for the specified url
+        :param url: request url
+        :return: dictionary containing the cached response and validators or None if not cached
+        """
+        with self._lock:
+            row = self._con.execute('SELECT status_code, headers, body, etag, last_modified, fetched, ttl_key '
+                                    'FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+
+            self._con.execute('UPDATE responses SET accessed = ? WHERE url = ?', (time.time(), url))
+            self._con.commit()
+
+        return {'url': url,
+                'status_code': row[0],
+                'headers': json.loads(row[1]),
+                'body': row[2],
+                'etag': row[3],
+                'last_modified': row[4],
+                'fetched': row[5],
+                'ttl_key': row[6]}
+
+    def is_fresh(self, entry, ttl_key=None):
+        """
+        Check whether a cached entry is within its TTL
+        :param entry: cached entry returned by lookup
+        :param ttl_key: TTL name overriding the end point name of the url
+        :return: True if the entry can be used without contacting the server
+        """
+        return time.time() - entry['fetched'] < self.ttl_for(entry['url'], ttl_key=ttl_key or entry['ttl_key'])
+
+    def validators(self, entry):
+        """
+        Create the conditional request headers for revalidating a cached entry
+        :param entry: cached entry returned by lookup
+        :return: dictionary of request headers
+        """
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def store(self, url, response, ttl_key=None):
+        """
+        Add or replace the cached entry for the specified url and evict the least recently used entries if the cache
+        exceeds max_bytes
+        :param url: request url
+        :param response: requests.Response
+        :param ttl_key: TTL name overriding the end point name of the url
+        """
+        body = response.content
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in _DROP_HEADERS}
+        now = time.time()
+
+        with self._lock:
+            self._con.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (url,
+                               self.end_point_for(url),
+                               ttl_key,
+                               response.status_code,
+                               json.dumps(headers),
+                               sqlite3.Binary(body),
+                               response.headers.get('ETag'),
+                               response.headers.get('Last-Modified'),
+                               now,
+                               now,
+                               len(body)))
+            self._con.commit()
+            self._evict()
+
+    def revalidated(self, entry, ttl_key=None):
+        """
+        Reset the TTL of an entry the server reported as not modified (304)
+        :param entry: cached entry returned by lookup
+        :param ttl_key: TTL name overriding the end point name of the url
+        """
+        with self._lock:
+            self._con.execute('UPDATE responses SET fetched = ?, ttl_key = COALESCE(?, ttl_key) WHERE url = ?',
+                              (time.time(), ttl_key, entry['url']))
+            self._con.commit()
+
+        self._revalidated += 1
+
+    def to_response(self, entry):
+        """
+        Create a requests.Response from a cached entry
+        :param entry: cached entry returned by lookup
+        :return: requests.Response
+        """
+        response = Response()
+        response.status_code = entry['status_code']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = entry['url']
+        response.encoding = 'utf-8'
+        response._content = entry['body']
+        response._content_consumed = True
+
+        return response
+
+    def size(self):
+        """
+        Total size, in bytes, of the cached response bodies
+        :return: size in bytes
+        """
+        with self._lock:
+            return self._con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def info(self):
+        """
+        Describe the cached entries
+        :return: data frame containing url, end_point, size, fetched, accessed and expires for each cached entry
+        """
+        with self._lock:
+            rows = self._con.execute('SELECT url, end_point, ttl_key, size, etag, last_modified, fetched, accessed '
+                                     'FROM responses ORDER BY accessed DESC').fetchall()
+
+        info = pd.DataFrame(rows, columns=['url', 'end_point', 'ttl_key', 'size', 'etag', 'last_modified', 'fetched',
+                                           'accessed'])
+        info['expires'] = info.fetched + [self.ttl_for(url, ttl_key=key) for url, key in zip(info.url, info.ttl_key)]
+        for column in ['fetched', 'accessed', 'expires']:
+            info[column] = pd.to_datetime(info[column], unit='s')
+
+        return info.drop(columns=['ttl_key'])
+
+    def clear(self, end_point=None):
+        """
+        Remove cached entries
+        :param end_point: only remove the entries for this end point name. All entries are removed if not specified
+        :return: number of removed entries
+        """
+        with self._lock:
+            if end_point:
+                cursor = self._con.execute('DELETE FROM responses WHERE end_point = ?', (end_point,))
+            else:
+                cursor = self._con.execute('DELETE FROM responses')
+            self._con.commit()
+            self._con.execute('VACUUM')
+
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache is at or below max_bytes. Must be called with the lock
+        held.
+        """
+        total = self._con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        evicted = 0
+        for url, size in self._con.execute('SELECT url, size FROM responses ORDER BY accessed ASC').fetchall():
+            if total <= self._max_bytes:
+                break
+            self._con.execute('DELETE FROM responses WHERE url = ?', (url,))
+            total -= size
+            evicted += 1
+
+        self._con.commit()
+        logging.debug('Evicted {:} cached responses'.format(evicted))
+
+    def __repr__(self):
+        return '<ResponseCache(cache_dir={:}, max_bytes={:})>'.format(self._cache_dir, self._max_bytes)
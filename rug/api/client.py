@@ -0,0 +1,203 @@
+import logging
+import time
+from importlib.util import find_spec
+import requests
+from requests.adapters import HTTPAdapter
+from rug.api.urls import end_points
+from rug.api.throttle import RetryPolicy, CircuitBreaker
+
+logging.getLogger(__file__)
+
+
+def _accept_encoding():
+    """
+    Build the Accept-Encoding header value from the content decoders available to urllib3
+    :return: comma separated list of content encodings
+    """
+    encodings = ['gzip', 'deflate']
+    if find_spec('brotli') or find_spec('brotlicffi'):
+        encodings.append('br')
+
+    return ', '.join(encodings)
+
+
+class RugApiClient(object):
+    """
+    RU-COOL Gliders API client. All requests are sent through a single requests.Session whose connection pool keeps
+    the TCP+TLS connections to the API host alive between calls.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=16, timeout=30, compress=True, urls=None, cache=None,
+                 retry=None, rate_limiter=None, circuit_breaker=None):
+        """
+        :param pool_connections: number of per-host connection pools to cache
+        :param pool_maxsize: maximum number of connections kept alive in each pool
+        :param timeout: default request timeout, in seconds, or a (connect, read) tuple
+        :param compress: True to negotiate compressed (gzip, deflate and, if available, brotli) responses
+        :param urls: dictionary of end points. Defaults to rug.api.urls.end_points
+        :param cache: optional rug.api.cache.ResponseCache all GET requests go through
+        :param retry: rug.api.throttle.RetryPolicy. Defaults to RetryPolicy(). Use RetryPolicy(total=0) to disable
+        :param rate_limiter: optional rug.api.throttle.RateLimiter limiting the request rate
+        :param circuit_breaker: rug.api.throttle.CircuitBreaker. Defaults to CircuitBreaker()
+        """
+        self._end_points = urls or end_points
+        self._cache = cache
+        self._retry = retry or RetryPolicy()
+        self._rate_limiter = rate_limiter
+        self._circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._timeout = timeout
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._compress = compress
+
+        self._session = self._create_session()
+
+    @property
+    def end_points(self):
+        return self._end_points
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._timeout = timeout
+
+    @property
+    def pool_maxsize(self):
+        return self._pool_maxsize
+
+    @property
+    def session(self):
+        return self._session
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def retry(self):
+        return self._retry
+
+    @property
+    def rate_limiter(self):
+        return self._rate_limiter
+
+    @property
+    def circuit_breaker(self):
+        return self._circuit_breaker
+
+    def url(self, end_point):
+        """
+        Return the base url for the specified end point name
+        :param end_point: end point name (i.e.: DEPLOYMENTS, TRACKS)
+        :return: end point url
+        """
+        if end_point not in self._end_points:
+            raise KeyError('Invalid end point: {:}'.format(end_point))
+
+        return self._end_points[end_point].url
+
+    def get(self, url, params=None, timeout=None, ttl_key=None, **kwargs):
+        """
+        Send a GET request through the pooled session and, if configured, the response cache. Failed requests are
+        retried according to the retry policy.
+        :param url: full request url or a registered end point name
+        :param params: optional dictionary of query parameters
+        :param timeout: request timeout. Defaults to the client timeout
+        :param ttl_key: cache TTL name overriding the end point name of the url (i.e.: RECOVERED_TRACKS)
+        :param kwargs: additional keyword arguments passed to requests.Session.get
+        :return: requests.Response
+        """
+        if url in self._end_points:
+            url = self._end_points[url].url
+
+        timeout = timeout or self._timeout
+
+        if self._cache is None:
+            return self._send(url, params=params, timeout=timeout, **kwargs)
+
+        # Cache entries are keyed by the full url, including the query string
+        request_url = requests.Request('GET', url, params=params).prepare().url
+        request_headers = kwargs.pop('headers', None) or {}
+
+        def fetch(validators):
+            return self._send(request_url, timeout=timeout, headers=dict(request_headers, **validators), **kwargs)
+
+        return self._cache.get(request_url, fetch, ttl_key=ttl_key)
+
+    def _send(self, url, **kwargs):
+        """
+        Send the GET request, retrying connection errors, timeouts and retryable status codes with backoff. The circuit
+        breaker sees one outcome per request, after the retries are exhausted.
+        :param url: request url
+        :param kwargs: keyword arguments passed to requests.Session.get
+        :return: requests.Response
+        """
+        self._circuit_breaker.check()
+
+        attempt = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire()
+
+            logging.debug('GET {:}'.format(url))
+            try:
+                r = self._session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self._retry.total:
+                    self._circuit_breaker.record_failure(url)
+                    raise
+                backoff = self._retry.backoff(attempt)
+                logging.warning('{:} ({:}). Retrying in {:0.1f} seconds'.format(url, e, backoff))
+            except Exception:
+                self._circuit_breaker.record_failure(url)
+                raise
+            else:
+                if not self._retry.is_retryable(r.status_code):
+                    self._circuit_breaker.record_success()
+                    return r
+                if attempt >= self._retry.total:
+                    self._circuit_breaker.record_failure(url)
+                    return r
+                backoff = self._retry.backoff(attempt, response=r)
+                logging.warning('{:} ({:}). Retrying in {:0.1f} seconds'.format(url, r.status_code, backoff))
+                r.close()
+
+            time.sleep(backoff)
+            attempt += 1
+
+    def close(self):
+        """
+        Close the session, all pooled connections and the response cache
+        """
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    def _create_session(self):
+
+        session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=self._pool_connections, pool_maxsize=self._pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        session.headers.update({'Connection': 'keep-alive'})
+        if self._compress:
+            session.headers.update({'Accept-Encoding': _accept_encoding()})
+        else:
+            session.headers.update({'Accept-Encoding': 'identity'})
+
+        return session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<RugApiClient(pool_maxsize={:}, timeout={:}, cache={:})>'.format(self._pool_maxsize, self._timeout,
+                                                                                self._cache)
@@ -0,0 +1,67 @@
+import logging
+from importlib import import_module
+
+logging.getLogger(__file__)
+
+# JSON backends in order of preference
+JSON_BACKENDS = ['orjson', 'ujson', 'json']
+
+_backend = None
+_loads = None
+
+
+def set_json_backend(name=None):
+    """
+    Select the module used to decode API responses. All backends raise a ValueError subclass on invalid JSON.
+    :param name: orjson, ujson or json. Defaults to the fastest installed backend
+    :return: name of the previous backend
+    """
+    global _backend, _loads
+
+    previous = _backend
+
+    if name is None:
+        for backend in JSON_BACKENDS:
+            try:
+                module = import_module(backend)
+                break
+            except ImportError:
+                continue
+    elif name in JSON_BACKENDS:
+        module = import_module(name)
+    else:
+        raise ValueError('Invalid JSON backend {:}. Valid backends are: {:}'.format(name, JSON_BACKENDS))
+
+    _backend = module.__name__
+    _loads = module.loads
+    logging.debug('Decoding JSON with {:}'.format(_backend))
+
+    return previous
+
+
+def json_backend():
+    """
+    Name of the module currently used to decode API responses
+    """
+    return _backend
+
+
+def loads(data):
+    """
+    Decode a JSON document with the selected backend
+    :param data: utf-8 encoded bytes or str
+    :return: decoded object
+    """
+    return _loads(data)
+
+
+def decode_json(response):
+    """
+    Decode the JSON body of an API response with the selected backend. Use this in place of requests.Response.json()
+    :param response: requests.Response
+    :return: decoded object
+    """
+    return _loads(response.content)
+
+
+set_json_backend()
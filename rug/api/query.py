@@ -0,0 +1,143 @@
+import logging
+import pandas as pd
+
+logging.getLogger(__file__)
+
+# Regular expression characters glider and project name patterns may contain
+_PATTERN_CHARS = set('.^$*+?{}[]\\|()')
+
+
+class DeploymentQuery(object):
+    """
+    Deployment search predicates. Predicates the deployments API can evaluate (DEPLOYMENTS args in urls.yml) are
+    pushed to the server with pushdown() and all predicates are then applied locally with filter(), so the results are
+    the same whether or not the server evaluated them.
+    """
+
+    def __init__(self, glider=None, project_name=None, start_date=None, end_date=None, active=False, exact=False,
+                 max_years=5):
+        """
+        :param glider: glider name. Matches glider names starting with this string unless exact is True
+        :param project_name: project name. Case-insensitive substring match unless exact is True
+        :param start_date: deployments starting on or after this datetime
+        :param end_date: deployments starting on or before this datetime
+        :param active: True to search active deployments only
+        :param exact: True if glider and project_name are complete names, which allows them to be pushed to the API
+        :param max_years: maximum number of per-year requests to push the date range down as. Larger ranges download
+            all deployments
+        """
+        self._glider = glider
+        self._project_name = project_name
+        self._start_date = pd.Timestamp(start_date) if start_date else None
+        self._end_date = pd.Timestamp(end_date) if end_date else None
+        self._active = active
+        self._exact = exact
+        self._max_years = max_years
+
+    @property
+    def glider(self):
+        return self._glider
+
+    @property
+    def project_name(self):
+        return self._project_name
+
+    @property
+    def start_date(self):
+        return self._start_date
+
+    @property
+    def end_date(self):
+        return self._end_date
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def exact(self):
+        return self._exact
+
+    def pushdown(self):
+        """
+        Build the deployments API query parameters for the most selective predicate the server can evaluate. The API
+        accepts a single type per request, so a date range becomes one request per start year.
+        :return: list of query parameter dictionaries, or None if the query cannot be pushed to the API
+        """
+        if self._active:
+            return None
+
+        if self._exact and self._glider:
+            return [{'type': 'gliders', 'glider': self._glider}]
+
+        if self._exact and self._project_name:
+            return [{'type': 'projects', 'project': self._project_name}]
+
+        if self._start_date or self._end_date:
+            year0 = self._start_date.year if self._start_date else None
+            year1 = self._end_date.year if self._end_date else pd.Timestamp.now().year
+            if year0 is None or year1 - year0 + 1 > self._max_years:
+                return None
+            return [{'type': 'years', 'year': year} for year in range(year0, year1 + 1)]
+
+        return None
+
+    def catalog_predicates(self):
+        """
+        Build the rug.db.DeploymentCatalog.deployments keyword arguments for the predicates the catalog can evaluate
+        with its indexes. Glider and project names containing regular expression characters are left to filter(), which
+        must still be applied to the catalog results.
+        :return: dictionary of DeploymentCatalog.deployments keyword arguments
+        """
+        predicates = {'start_date': self._start_date,
+                      'end_date': self._end_date,
+                      'active': True if self._active else None}
+
+        if self._glider and (self._exact or not _PATTERN_CHARS.intersection(self._glider)):
+            predicates['glider'] = self._glider
+
+        if self._project_name and (self._exact or not _PATTERN_CHARS.intersection(self._project_name)):
+            predicates['project_name'] = self._project_name
+
+        return predicates
+
+    def filter(self, deployments):
+        """
+        Apply all predicates to a deployments data frame
+        :param deployments: deployments data frame
+        :return: filtered deployments data frame
+        """
+        if deployments.empty:
+            return deployments
+
+        if self._active:
+            deployments = deployments[deployments.end_date.isna()]
+
+        if self._glider:
+            logging.debug('Finding deployments matching glider: {:}'.format(self._glider))
+            if self._exact:
+                deployments = deployments[deployments.glider == self._glider]
+            else:
+                deployments = deployments[deployments.glider.str.match(self._glider)]
+
+        if self._project_name:
+            logging.debug('Finding deployments with project name: {:}'.format(self._project_name))
+            if self._exact:
+                deployments = deployments[deployments.project_name == self._project_name]
+            else:
+                deployments = deployments[deployments.project_name.str.contains(self._project_name, case=False)]
+
+        if self._start_date:
+            logging.debug('Finding deployments starting on or after {:}'.format(self._start_date))
+            deployments = deployments[deployments.start_date >= self._start_date]
+
+        if self._end_date:
+            logging.debug('Finding deployments starting on or before {:}'.format(self._end_date))
+            deployments = deployments[deployments.start_date <= self._end_date]
+
+        return deployments
+
+    def __repr__(self):
+        return ('<DeploymentQuery(glider={:}, project_name={:}, start_date={:}, end_date={:}, active={:}, '
+                'exact={:})>'.format(self._glider, self._project_name, self._start_date, self._end_date, self._active,
+                                     self._exact))
@@ -0,0 +1,195 @@
+import logging
+import time
+import random
+import threading
+import requests
+
+logging.getLogger(__file__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised, instead of sending the request, while the circuit breaker is open
+    """
+    pass
+
+
+class RetryPolicy(object):
+    """
+    Retry failed requests with capped exponential backoff and full jitter. Connection errors, timeouts and the
+    responses with a status code in status_forcelist are retried.
+    """
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=30., jitter=True,
+                 status_forcelist=(429, 500, 502, 503, 504)):
+        """
+        :param total: maximum number of retries. Use 0 to disable retries
+        :param backoff_factor: backoff, in seconds, before the first retry. Doubles with each retry
+        :param max_backoff: maximum backoff, in seconds
+        :param jitter: True to draw each backoff uniformly between 0 and the exponential backoff
+        :param status_forcelist: response status codes that are retried
+        """
+        self._total = total
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._jitter = jitter
+        self._status_forcelist = frozenset(status_forcelist)
+
+    @property
+    def total(self):
+        return self._total
+
+    def is_retryable(self, status_code):
+        return status_code in self._status_forcelist
+
+    def backoff(self, attempt, response=None):
+        """
+        Seconds to wait before the next retry. A numeric Retry-After response header takes precedence.
+        :param attempt: number of retries already made
+        :param response: optional requests.Response of the failed attempt
+        :return: seconds
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self._max_backoff)
+
+        backoff = min(self._max_backoff, self._backoff_factor * 2 ** attempt)
+        if self._jitter:
+            backoff = random.uniform(0, backoff)
+
+        return backoff
+
+    def __repr__(self):
+        return '<RetryPolicy(total={:}, backoff_factor={:})>'.format(self._total, self._backoff_factor)
+
+
+class RateLimiter(object):
+    """
+    Thread-safe token bucket limiting the request rate. Tokens are added at rate per second up to burst and each
+    request takes one token, waiting for it if the bucket is empty.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: sustained number of requests per second
+        :param burst: maximum number of requests sent back to back. Defaults to rate (minimum 1)
+        """
+        if rate <= 0:
+            raise ValueError('rate must be > 0')
+
+        self._rate = float(rate)
+        self._burst = float(burst or max(1., rate))
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        """
+        Take a token, blocking until one is available
+        :return: seconds spent waiting
+        """
+        waited = 0.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1.:
+                    self._tokens -= 1.
+                    return waited
+                wait = (1. - self._tokens) / self._rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def __repr__(self):
+        return '<RateLimiter(rate={:}, burst={:})>'.format(self._rate, self._burst)
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker. After consecutive failures of failure_threshold different resources (request urls)
+    the circuit opens and requests fail fast with CircuitOpenError. Repeated failures of the same resource (i.e.: one
+    deployment track returning 500) only count once, and any success resets the count, so a few broken resources never
+    open the circuit while other requests to the host succeed. After reset_timeout seconds a single trial request is let
+    through: the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.):
+        """
+        :param failure_threshold: consecutive failures of different resources that open the circuit
+        :param reset_timeout: seconds the circuit stays open before a trial request is allowed
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._failed = set()
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            if time.monotonic() - self._opened >= self._reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def check(self):
+        """
+        Raise CircuitOpenError if requests are not currently allowed
+        """
+        with self._lock:
+            if self._opened is None:
+                return
+            if time.monotonic() - self._opened < self._reset_timeout or self._trial:
+                raise CircuitOpenError('Circuit open after {:} consecutive failures'.format(self._failures))
+            # Half-open: let a single trial request through
+            self._trial = True
+
+    @property
+    def failures(self):
+        """
+        Number of different resources that failed since the last success
+        """
+        return self._failures
+
+    def record_success(self):
+        """
+        Record a successful request, closing the circuit
+        """
+        with self._lock:
+            if self._opened is not None:
+                logging.info('Circuit closed')
+            self._failures = 0
+            self._failed.clear()
+            self._opened = None
+            self._trial = False
+
+    def record_failure(self, resource=None):
+        """
+        Record a failed request, once its retries are exhausted
+        :param resource: failed resource (i.e.: request url). Consecutive failures of the same resource count once.
+            None counts as a different resource each time
+        """
+        with self._lock:
+            if resource is None or resource not in self._failed:
+                self._failures += 1
+                if resource is not None:
+                    self._failed.add(resource)
+            if self._trial or (self._opened is None and self._failures >= self._failure_threshold):
+                logging.warning('Circuit opened for {:} seconds after {:} consecutive failures'.format(
+                    self._reset_timeout, self._failures))
+                self._opened = time.monotonic()
+            self._trial = False
+
+    def __repr__(self):
+        return '<CircuitBreaker(failure_threshold={:}, reset_timeout={:})>'.format(self._failure_threshold,
+                                                                                 self._reset_timeout)
@@ -0,0 +1,3 @@
+from rug.db.catalog import DeploymentCatalog, DEFAULT_CATALOG_FILE
+from rug.db.tracks import TrackStore, DEFAULT_TRACK_DIR, add_track_store_argument, track_store_from_args
+from rug.db.coverage import CoverageRaster
@@ -0,0 +1,380 @@
+import logging
+import os
+import json
+import time
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from shapely.geometry import Polygon
+from geopandas import GeoDataFrame
+from rug.api import get_client, deployments_json_to_df, fetch_deployment_record, fetch_track_bbox, bbox_to_polygon
+from rug.api.cache import DEFAULT_CACHE_DIR
+from rug.api.decoders import loads, decode_json
+
+logging.getLogger(__file__)
+
+DEFAULT_CATALOG_FILE = os.path.join(DEFAULT_CACHE_DIR, 'catalog.sqlite')
+
+_SCHEMA = ['CREATE TABLE IF NOT EXISTS deployments '
+           '(deployment_name TEXT PRIMARY KEY, '
+           'deployment_id INTEGER, '
+           'glider_id INTEGER, '
+           'glider TEXT, '
+           'project_id INTEGER, '
+           'project_name TEXT, '
+           'start_date_epoch INTEGER, '
+           'end_date_epoch INTEGER, '
+           'record TEXT, '
+           'updated REAL)',
+           'CREATE INDEX IF NOT EXISTS deployments_glider ON deployments (glider)',
+           'CREATE INDEX IF NOT EXISTS deployments_project_name ON deployments (project_name)',
+           'CREATE INDEX IF NOT EXISTS deployments_start_date ON deployments (start_date_epoch)',
+           'CREATE INDEX IF NOT EXISTS deployments_end_date ON deployments (end_date_epoch)',
+           'CREATE TABLE IF NOT EXISTS gliders '
+           '(glider_id INTEGER PRIMARY KEY, '
+           'glider TEXT)',
+           'CREATE TABLE IF NOT EXISTS projects '
+           '(project_id INTEGER PRIMARY KEY, '
+           'project_name TEXT)',
+           'CREATE TABLE IF NOT EXISTS bboxes '
+           '(deployment_name TEXT PRIMARY KEY, '
+           'west REAL, '
+           'south REAL, '
+           'east REAL, '
+           'north REAL, '
+           'updated REAL)',
+           'CREATE INDEX IF NOT EXISTS bboxes_lat ON bboxes (south, north)',
+           'CREATE INDEX IF NOT EXISTS bboxes_lon ON bboxes (west, east)',
+           'CREATE TABLE IF NOT EXISTS metadata '
+           '(key TEXT PRIMARY KEY, '
+           'value TEXT)']
+
+
+class DeploymentCatalog(object):
+    """
+    Local SQLite catalog of the RU-COOL deployments, gliders, projects and track bounding boxes. The catalog is
+    populated with sync() and queried with deployments(), which returns the same data frame as the rug.api fetch
+    functions without contacting the API.
+    """
+
+    def __init__(self, db_file=DEFAULT_CATALOG_FILE, client=None):
+        """
+        :param db_file: catalog SQLite database file. Created if it does not exist
+        :param client: RugApiClient instance used to sync the catalog. Defaults to the shared rug.api client
+        """
+        self._db_file = db_file
+        self._client = client
+
+        db_path = os.path.dirname(os.path.abspath(db_file))
+        os.makedirs(db_path, exist_ok=True)
+
+        self._con = sqlite3.connect(db_file)
+        for statement in _SCHEMA:
+            self._con.execute(statement)
+        self._con.commit()
+
+    @property
+    def db_file(self):
+        return self._db_file
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    @property
+    def last_sync(self):
+        """
+        Time of the last successful sync
+        :return: pandas Timestamp or None if the catalog has never been synced
+        """
+        value = self._get_metadata('last_sync')
+        return pd.to_datetime(float(value), unit='s') if value else None
+
+    @property
+    def last_full_sync(self):
+        """
+        Time of the last successful full sync
+        :return: pandas Timestamp or None if the catalog has never been fully synced
+        """
+        value = self._get_metadata('last_full_sync')
+        return pd.to_datetime(float(value), unit='s') if value else None
+
+    def __len__(self):
+        return self._con.execute('SELECT COUNT(*) FROM deployments').fetchone()[0]
+
+    def sync(self, full=False, full_interval=7 * 24 * 60 * 60, bboxes=True, max_workers=8):
+        """
+        Update the catalog from the API. A full sync fetches all registered deployments. An incremental sync only
+        fetches the active deployments and the deployments that were active at the last sync, to pick up their end
+        dates. Track bounding boxes are fetched for the active, new and recently recovered deployments and any
+        deployment without one. A full sync also fetches the bounding boxes again for the deployments stored without a
+        track.
+        :param full: True to force a full sync
+        :param full_interval: seconds after which an incremental sync is promoted to a full sync
+        :param bboxes: True to update the track bounding boxes
+        :param max_workers: maximum number of requests in flight at once
+        :return: dictionary summarizing the sync
+        """
+        client = self.client
+        now = time.time()
+
+        last_full_sync = self._get_metadata('last_full_sync')
+        if not last_full_sync or now - float(last_full_sync) > full_interval:
+            full = True
+
+        summary = {'mode': 'full' if full else 'incremental',
+                   'deployments': 0,
+                   'bboxes': 0}
+
+        if full:
+            logging.info('Fetching all deployments')
+            records = self._fetch_records('DEPLOYMENTS')
+            if records is None:
+                return summary
+        else:
+            logging.info('Fetching active deployments')
+            records = self._fetch_records('ACTIVE_DEPLOYMENTS')
+            if records is None:
+                return summary
+            active = set([r['deployment_name'] for r in records])
+
+            # Deployments active at the last sync but no longer in the active list have since been recovered
+            recovered = [r[0] for r in self._con.execute('SELECT deployment_name FROM deployments '
+                                                         'WHERE end_date_epoch IS NULL').fetchall()
+                         if r[0] not in active]
+            if recovered:
+                logging.info('Fetching {:} recently recovered deployments'.format(len(recovered)))
+                with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                    responses = list(executor.map(lambda d: fetch_deployment_record(d, client=client), recovered))
+                records += [record for (status, record) in responses if status == 'found']
+
+        # Active, new and recently recovered deployments may have new GPS fixes
+        end_dates = dict(self._con.execute('SELECT deployment_name, end_date_epoch FROM deployments').fetchall())
+        changed = [r['deployment_name'] for r in records if r.get('end_date_epoch') is None or
+                   r['deployment_name'] not in end_dates or
+                   end_dates[r['deployment_name']] != r.get('end_date_epoch')]
+
+        self._upsert_records(records, now)
+        summary['deployments'] = len(records)
+
+        if bboxes:
+            # Deployments without a stored bounding box, after a failed fetch, and, on full syncs, those stored without a
+            # track in case their track has since been loaded
+            sql = ('SELECT d.deployment_name FROM deployments d LEFT JOIN bboxes b USING (deployment_name) '
+                   'WHERE b.deployment_name IS NULL')
+            if full:
+                sql = '{:} OR b.south IS NULL'.format(sql)
+            missing = [r[0] for r in self._con.execute(sql).fetchall()]
+            summary['bboxes'] = self.sync_bboxes(list(dict.fromkeys(changed + missing)), max_workers=max_workers)
+
+        self._set_metadata('last_sync', now)
+        if full:
+            self._set_metadata('last_full_sync', now)
+
+        logging.info('Catalog {:} sync: {:} deployments, {:} bounding boxes'.format(summary['mode'],
+                                                                                  summary['deployments'],
+                                                                                  summary['bboxes']))
+
+        return summary
+
+    def sync_bboxes(self, deployment_names, max_workers=8):
+        """
+        Fetch and store the track bounding boxes for the specified deployments. Deployments without a track are stored
+        with a NULL bounding box. Nothing is stored for the deployments whose request failed, so the next sync fetches
+        them again.
+        :param deployment_names: list of deployment names
+        :param max_workers: maximum number of requests in flight at once
+        :return: number of bounding boxes stored
+        """
+        if not deployment_names:
+            return 0
+
+        client = self.client
+        recovered = {r[0]: r[1] is not None for r in self._con.execute('SELECT deployment_name, end_date_epoch '
+                                                                        'FROM deployments').fetchall()}
+
+        logging.info('Fetching {:} track bounding boxes'.format(len(deployment_names)))
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            polygons = list(executor.map(lambda d: fetch_track_bbox(d, client=client,
+                                                                    recovered=recovered.get(d, False), failed=None),
+                                         deployment_names))
+
+        now = time.time()
+        rows = []
+        failed = []
+        for deployment_name, polygon in zip(deployment_names, polygons):
+            if polygon is None:
+                failed.append(deployment_name)
+                continue
+            if polygon.is_empty:
+                rows.append((deployment_name, None, None, None, None, now))
+                continue
+            # Deployment polygons are (latitude, longitude) pairs
+            south, west, north, east = polygon.bounds
+            rows.append((deployment_name, west, south, east, north, now))
+
+        if failed:
+            logging.warning('Failed to fetch {:} track bounding boxes. They will be fetched again on the next '
+                            'sync'.format(len(failed)))
+
+        self._con.executemany('INSERT OR REPLACE INTO bboxes VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self._con.commit()
+
+        return len(rows)
+
+    def deployments(self, glider=None, project_name=None, start_date=None, end_date=None, active=None, north=None,
+                    south=None, east=None, west=None, has_track=None, geometry=False, crs='EPSG:4326'):
+        """
+        Query the catalog. The date filters use the deployment start date, as the search scripts do.
+        :param glider: glider name or glider name prefix
+        :param project_name: case-insensitive substring of the project name
+        :param start_date: deployments starting on or after this datetime
+        :param end_date: deployments starting on or before this datetime
+        :param active: True for active deployments only, False for recovered deployments only
+        :param north: northernmost latitude of the search bounding box
+        :param south: southernmost latitude of the search bounding box
+        :param east: easternmost longitude of the search bounding box
+        :param west: westernmost longitude of the search bounding box
+        :param has_track: True for deployments with a track bounding box only, False for those without
+        :param geometry: True to return a GeoPandas data frame with the track bounding box geometries, as created by
+            rug.api.df2geodf. Always True for bounding box searches.
+        :param crs: coordinate reference system of the GeoPandas geometries
+        :return: deployments data frame
+        """
+        where = []
+        params = []
+
+        if glider:
+            where.append("d.glider GLOB ?")
+            params.append('{:}*'.format(glider.replace('[', '[[]').replace('*', '[*]').replace('?', '[?]')))
+        if project_name:
+            where.append("d.project_name LIKE ?")
+            params.append('%{:}%'.format(project_name))
+        if start_date is not None:
+            where.append('d.start_date_epoch >= ?')
+            params.append(int(pd.Timestamp(start_date).timestamp()))
+        if end_date is not None:
+            where.append('d.start_date_epoch <= ?')
+            params.append(int(pd.Timestamp(end_date).timestamp()))
+        if active is not None:
+            where.append('d.end_date_epoch IS NULL' if active else 'd.end_date_epoch IS NOT NULL')
+
+        bbox_search = any([v is not None for v in [north, south, east, west]])
+        if bbox_search:
+            geometry = True
+            # Same membership as rug.geo.locate_datasets: the bounding boxes intersect
+            where.append('b.south <= ? AND b.north >= ? AND b.west <= ? AND b.east >= ?')
+            params += [90. if north is None else north,
+                       -90. if south is None else south,
+                       180. if east is None else east,
+                       -180. if west is None else west]
+        if has_track is not None:
+            where.append('b.south IS NOT NULL' if has_track else 'b.south IS NULL')
+
+        sql = ('SELECT d.record, b.west, b.south, b.east, b.north FROM deployments d '
+               'LEFT JOIN bboxes b USING (deployment_name)')
+        if where:
+            sql = '{:} WHERE {:}'.format(sql, ' AND '.join(where))
+        sql = '{:} ORDER BY d.rowid'.format(sql)
+
+        rows = self._con.execute(sql, params).fetchall()
+        if not rows:
+            return GeoDataFrame() if geometry else pd.DataFrame()
+
+        deployments = deployments_json_to_df({'data': [loads(r[0]) for r in rows]})
+        if not geometry:
+            return deployments
+
+        polygons = [Polygon() if r[1] is None else bbox_to_polygon(r[1:]) for r in rows]
+
+        return GeoDataFrame(deployments, geometry=polygons, crs=crs)
+
+    def gliders(self):
+        """
+        All gliders in the catalog
+        :return: data frame indexed by glider_id
+        """
+        return pd.read_sql_query('SELECT glider_id, glider FROM gliders ORDER BY glider', self._con,
+                                 index_col='glider_id')
+
+    def projects(self):
+        """
+        All projects in the catalog
+        :return: data frame indexed by project_id
+        """
+        return pd.read_sql_query('SELECT project_id, project_name FROM projects ORDER BY project_name', self._con,
+                                 index_col='project_id')
+
+    def close(self):
+        self._con.close()
+
+    def _fetch_records(self, end_point):
+        """
+        Fetch the deployment records from the specified deployments end point
+        :param end_point: DEPLOYMENTS or ACTIVE_DEPLOYMENTS
+        :return: list of deployment records or None if the request failed
+        """
+        try:
+            r = self.client.get(end_point, timeout=30)
+            if r.status_code != 200:
+                logging.error('Failed to fetch {:} ({:})'.format(end_point, r.status_code))
+                return None
+            return decode_json(r)['data']
+        except Exception as e:
+            logging.error('{:}: {:}'.format(end_point, e))
+            return None
+
+    def _upsert_records(self, records, updated):
+
+        deployment_rows = []
+        gliders = {}
+        projects = {}
+        for record in records:
+            deployment_rows.append((record['deployment_name'],
+                                    record.get('deployment_id'),
+                                    record.get('glider_id'),
+                                    record.get('glider_name'),
+                                    record.get('project_id'),
+                                    record.get('project_name'),
+                                    record.get('start_date_epoch'),
+                                    record.get('end_date_epoch'),
+                                    json.dumps(record),
+                                    updated))
+            if record.get('glider_id') is not None:
+                gliders[record['glider_id']] = record.get('glider_name')
+            if record.get('project_id') is not None:
+                projects[record['project_id']] = record.get('project_name')
+
+        # Upsert, rather than replace, to keep the original (API) row order
+        self._con.executemany('INSERT INTO deployments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                              'ON CONFLICT (deployment_name) DO UPDATE SET '
+                              'deployment_id = excluded.deployment_id, '
+                              'glider_id = excluded.glider_id, '
+                              'glider = excluded.glider, '
+                              'project_id = excluded.project_id, '
+                              'project_name = excluded.project_name, '
+                              'start_date_epoch = excluded.start_date_epoch, '
+                              'end_date_epoch = excluded.end_date_epoch, '
+                              'record = excluded.record, '
+                              'updated = excluded.updated',
+                              deployment_rows)
+        self._con.executemany('INSERT OR REPLACE INTO gliders VALUES (?, ?)', list(gliders.items()))
+        self._con.executemany('INSERT OR REPLACE INTO projects VALUES (?, ?)', list(projects.items()))
+        self._con.commit()
+
+    def _get_metadata(self, key):
+        row = self._con.execute('SELECT value FROM metadata WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_metadata(self, key, value):
+        self._con.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?)', (key, str(value)))
+        self._con.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return '<DeploymentCatalog(db_file={:}, deployments={:})>'.format(self._db_file, len(self))
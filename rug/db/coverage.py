@@ -0,0 +1,262 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from rug.geo import CoverageGrid, fetch_track_to_df
+
+logging.getLogger(__file__)
+
+
+class CoverageRaster(object):
+    """
+    Persistent, mergeable coverage grid. The summed counts are kept with the sparse contribution (cell ids and counts)
+    of each deployment, so deployments can be added, updated or subtracted without binning any other track, and rasters
+    accumulated by separate processes can be merged. For each deployment the raster records whether it was recovered
+    and the time of its last GPS fix: recovered deployments are never fetched again and active deployments are only
+    re-binned when their track has new fixes, so a nightly update costs only the delta. Rasters are saved as .npz files
+    that CoverageGrid.load() also reads.
+    """
+
+    def __init__(self, extent=(-180., -90., 180., 90.), resolution=1., kind='hex', metric='fixes'):
+        """
+        :param extent: grid extent in decimal degrees: (west, south, east, north)
+        :param resolution: cell width in decimal degrees
+        :param kind: hex or rect
+        :param metric: coverage metric: fixes, glider_days or deployments
+        """
+        self._grid = CoverageGrid(extent=extent, resolution=resolution, kind=kind, metric=metric)
+        # deployment name -> (cells, counts, last GPS epoch, number of fixes, recovered)
+        self._contributions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def grid(self):
+        """
+        CoverageGrid holding the summed counts of all deployments
+        """
+        return self._grid
+
+    def deployments(self):
+        """
+        Names of the contributing deployments
+        :return: sorted list of deployment names
+        """
+        return sorted(self._contributions)
+
+    def __contains__(self, deployment_name):
+        return deployment_name in self._contributions
+
+    def __len__(self):
+        return len(self._contributions)
+
+    def last_epoch(self, deployment_name):
+        """
+        GPS epoch of the last binned fix of the deployment or None if it does not contribute
+        """
+        contribution = self._contributions.get(deployment_name)
+        return contribution[2] if contribution else None
+
+    def is_complete(self, deployment_name):
+        """
+        True if the deployment was recovered when it was binned, so no new fixes are expected
+        """
+        contribution = self._contributions.get(deployment_name)
+        return bool(contribution and contribution[4])
+
+    def add(self, deployment_name, track_df, recovered=False):
+        """
+        Bin the track of a deployment and add it to the counts, replacing its previous contribution
+        :param deployment_name: deployment name
+        :param track_df: track data frame with columns time, latitude, longitude
+        :param recovered: True if the deployment has been recovered, marking its contribution complete
+        :return: number of cells the deployment contributes to
+        """
+        cells, counts = self._grid.track_counts(track_df)
+        last_epoch = int(track_df.time.max().timestamp()) if not track_df.empty else -1
+
+        self._set(deployment_name, (cells, counts, last_epoch, track_df.shape[0], bool(recovered)))
+
+        return cells.size
+
+    def subtract(self, deployment_name):
+        """
+        Remove the contribution of a deployment from the counts
+        :param deployment_name: deployment name
+        :return: True if the deployment was contributing
+        """
+        with self._lock:
+            contribution = self._contributions.pop(deployment_name, None)
+            if contribution is None:
+                return False
+            self._grid.add_counts(contribution[0], -contribution[1])
+
+        return True
+
+    def update(self, deployment_name, recovered=False, client=None, store=None):
+        """
+        Fetch the deployment track and re-bin it if it has fixes newer than the last binned fix. Complete deployments
+        are not fetched.
+        :param deployment_name: deployment name
+        :param recovered: True if the deployment has been recovered
+        :param client: RugApiClient instance. Defaults to the shared rug.api client
+        :param store: optional rug.db.TrackStore used to fetch the track
+        :return: True if the contribution of the deployment changed, None if the track could not be fetched
+        """
+        if self.is_complete(deployment_name):
+            return False
+
+        track_df = fetch_track_to_df(deployment_name, client=client, recovered=recovered, store=store)
+        if track_df.empty:
+            return None
+
+        last_epoch = self.last_epoch(deployment_name)
+        if last_epoch is not None and int(track_df.time.max().timestamp()) <= last_epoch:
+            if recovered:
+                with self._lock:
+                    self._contributions[deployment_name] = self._contributions[deployment_name][:4] + (True,)
+            return False
+
+        self.add(deployment_name, track_df, recovered=recovered)
+
+        return True
+
+    def sync(self, deployments, max_workers=8, client=None, store=None):
+        """
+        Update the contributions of the deployments: new deployments are binned, active deployments are re-binned
+        if they have new fixes and complete (recovered) deployments are skipped
+        :param deployments: deployments data frame indexed by deployment name, with an end_date column
+        :param max_workers: maximum number of requests in flight at once
+        :param client: RugApiClient instance. Defaults to the shared rug.api client
+        :param store: optional rug.db.TrackStore used to fetch the tracks
+        :return: dictionary mapping deployment names to True if their contribution changed (None if the fetch failed)
+        """
+        recovered = deployments.end_date.notna().to_dict()
+        deployment_names = [d for d in deployments.index if not self.is_complete(d)]
+
+        logging.info('Updating {:} of {:} deployment coverages'.format(len(deployment_names), deployments.shape[0]))
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            updated = list(executor.map(lambda d: self.update(d, recovered=recovered[d], client=client, store=store),
+                                        deployment_names))
+
+        return dict(zip(deployment_names, updated))
+
+    def compatible(self, other):
+        """
+        True if the other raster has the same grid definition, so they can be merged
+        """
+        return isinstance(other, CoverageRaster) and self._grid.compatible(other.grid)
+
+    def merge(self, other):
+        """
+        Merge the contributions of a raster with the same grid definition. Deployments in both rasters keep the
+        contribution binned with the latest GPS fix, so merging the same raster twice changes nothing.
+        :param other: CoverageRaster
+        :return: number of contributions added or replaced
+        """
+        if not self.compatible(other):
+            raise ValueError('Cannot merge {:} into {:}'.format(other, self))
+
+        count = 0
+        for deployment_name, contribution in other.contributions():
+            current = self._contributions.get(deployment_name)
+            if current is None or (contribution[2], contribution[4]) > (current[2], current[4]):
+                self._set(deployment_name, contribution)
+                count += 1
+
+        return count
+
+    def contributions(self):
+        """
+        Iterate over the contributions of the deployments
+        :return: generator of (deployment name, (cells, counts, last GPS epoch, number of fixes, recovered)) tuples
+        """
+        for deployment_name in self.deployments():
+            yield deployment_name, self._contributions[deployment_name]
+
+    def to_frame(self):
+        """
+        Summary of the contributing deployments
+        :return: data frame of deployment, recovered, fixes, cells, count and last_fix, indexed by deployment name
+        """
+        names = self.deployments()
+        contributions = [self._contributions[d] for d in names]
+
+        return pd.DataFrame({'recovered': [c[4] for c in contributions],
+                             'fixes': np.array([c[3] for c in contributions], dtype='int64'),
+                             'cells': np.array([c[0].size for c in contributions], dtype='int64'),
+                             'count': np.array([c[1].sum() for c in contributions], dtype='int64'),
+                             'last_fix': pd.to_datetime(np.array([c[2] for c in contributions], dtype='int64'),
+                                                        unit='s')},
+                            index=pd.Index(names, name='deployment'))
+
+    def save(self, npz_file):
+        """
+        Write the raster to a compressed NumPy .npz file. The file is replaced atomically, so readers never see a
+        partial raster.
+        :param npz_file: file name
+        """
+        grid = self._grid
+        with self._lock:
+            names = self.deployments()
+            contributions = [self._contributions[d] for d in names]
+
+        sizes = np.array([c[0].size for c in contributions], dtype='int64')
+        tmp_file = '{:}.tmp'.format(npz_file)
+        with open(tmp_file, 'wb') as fid:
+            np.savez_compressed(fid,
+                                kind=grid.kind,
+                                extent=np.array(grid.extent),
+                                resolution=grid.resolution,
+                                metric=grid.metric,
+                                counts=grid.counts,
+                                deployments=np.array(names, dtype=str),
+                                offsets=np.concatenate(([0], np.cumsum(sizes))),
+                                cells=np.concatenate([c[0] for c in contributions] + [np.zeros(0, dtype='int64')]),
+                                cell_counts=np.concatenate([c[1] for c in contributions] + [np.zeros(0, dtype='int64')]),
+                                last_epochs=np.array([c[2] for c in contributions], dtype='int64'),
+                                fixes=np.array([c[3] for c in contributions], dtype='int64'),
+                                recovered=np.array([c[4] for c in contributions], dtype=bool))
+        os.replace(tmp_file, npz_file)
+
+    @classmethod
+    def load(cls, npz_file):
+        """
+        Read a raster written with save()
+        :param npz_file: file name
+        :return: CoverageRaster
+        """
+        with np.load(npz_file) as npz:
+            if 'deployments' not in npz:
+                raise ValueError('{:} is a coverage grid without deployment contributions'.format(npz_file))
+
+            raster = cls(extent=tuple(npz['extent'].tolist()), resolution=float(npz['resolution']),
+                         kind=str(npz['kind']), metric=str(npz['metric']))
+
+            offsets = npz['offsets']
+            cells = npz['cells']
+            cell_counts = npz['cell_counts']
+            for i, (deployment_name, last_epoch, fixes, recovered) in enumerate(zip(npz['deployments'].tolist(),
+                                                                                     npz['last_epochs'].tolist(),
+                                                                                     npz['fixes'].tolist(),
+                                                                                     npz['recovered'].tolist())):
+                i0, i1 = offsets[i], offsets[i + 1]
+                raster._contributions[deployment_name] = (cells[i0:i1], cell_counts[i0:i1], last_epoch, fixes,
+                                                          recovered)
+                raster._grid.add_counts(cells[i0:i1], cell_counts[i0:i1])
+
+        return raster
+
+    def _set(self, deployment_name, contribution):
+        with self._lock:
+            previous = self._contributions.get(deployment_name)
+            if previous is not None:
+                self._grid.add_counts(previous[0], -previous[1])
+            self._grid.add_counts(contribution[0], contribution[1])
+            self._contributions[deployment_name] = contribution
+
+    def __repr__(self):
+        return '<CoverageRaster(kind={:}, metric={:}, extent={:}, resolution={:}, deployments={:}, total={:})>'.format(
+            self._grid.kind, self._grid.metric, self._grid.extent, self._grid.resolution, len(self._contributions),
+            self._grid.total)
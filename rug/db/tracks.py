@@ -0,0 +1,299 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from rug.api import get_client
+from rug.api.cache import DEFAULT_CACHE_DIR
+from rug.geo import fetch_track_to_df
+
+logging.getLogger(__file__)
+
+DEFAULT_TRACK_DIR = os.path.join(DEFAULT_CACHE_DIR, 'tracks')
+
+# Track parts are named by the range of the GPS epochs they contain
+_PART_FILE = re.compile(r'^part-(\d+)-(\d+)\.parquet$')
+_RECOVERED_FILE = '_RECOVERED'
+
+
+class TrackStore(object):
+    """
+    Local columnar store of deployment GPS tracks. Each deployment is a directory, deployment=<deployment_name>,
+    of append-only Parquet parts holding the gps_epoch, latitude and longitude of the fixes, named by the range of
+    the GPS epochs they contain. update() only appends the fixes newer than the last stored GPS epoch and recovered
+    deployments are marked complete so they are never fetched again. Requires a Parquet engine (pyarrow or
+    fastparquet).
+    """
+
+    def __init__(self, store_dir=DEFAULT_TRACK_DIR, client=None):
+        """
+        :param store_dir: track store directory. Created if it does not exist
+        :param client: RugApiClient instance used to fetch tracks. Defaults to the shared rug.api client
+        """
+        self._store_dir = store_dir
+        self._client = client
+        self._lock = threading.Lock()
+
+        os.makedirs(store_dir, exist_ok=True)
+
+    @property
+    def store_dir(self):
+        return self._store_dir
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def deployments(self):
+        """
+        Names of the stored deployments
+        :return: sorted list of deployment names
+        """
+        return sorted([d.split('=', 1)[1] for d in os.listdir(self._store_dir) if d.startswith('deployment=')])
+
+    def parts(self, deployment_name):
+        """
+        Track part files of the deployment, in GPS epoch order
+        :param deployment_name: deployment name
+        :return: list of (first epoch, last epoch, file) tuples
+        """
+        deployment_dir = self._deployment_dir(deployment_name)
+        if not os.path.isdir(deployment_dir):
+            return []
+
+        parts = []
+        for part_file in os.listdir(deployment_dir):
+            match = _PART_FILE.match(part_file)
+            if match:
+                parts.append((int(match.group(1)), int(match.group(2)), os.path.join(deployment_dir, part_file)))
+
+        return sorted(parts)
+
+    def last_epoch(self, deployment_name):
+        """
+        Last stored GPS epoch, from the part file names
+        :param deployment_name: deployment name
+        :return: GPS epoch or None if no fixes are stored
+        """
+        parts = self.parts(deployment_name)
+        return max([p[1] for p in parts]) if parts else None
+
+    def is_complete(self, deployment_name):
+        """
+        True if the deployment was recovered when its track was last updated, so no new fixes are expected
+        """
+        return os.path.isfile(os.path.join(self._deployment_dir(deployment_name), _RECOVERED_FILE))
+
+    def __contains__(self, deployment_name):
+        return bool(self.parts(deployment_name)) or self.is_complete(deployment_name)
+
+    def __len__(self):
+        return len(self.deployments())
+
+    def append(self, deployment_name, track_df, recovered=False):
+        """
+        Append the fixes newer than the last stored GPS epoch
+        :param deployment_name: deployment name
+        :param track_df: track data frame with columns time, latitude, longitude
+        :param recovered: True if the deployment has been recovered, marking its track complete
+        :return: number of fixes appended
+        """
+        deployment_dir = self._deployment_dir(deployment_name)
+
+        with self._lock:
+            os.makedirs(deployment_dir, exist_ok=True)
+
+            count = 0
+            if not track_df.empty:
+                part = pd.DataFrame({'gps_epoch': track_df.time.to_numpy(dtype='datetime64[s]').astype('int64'),
+                                     'latitude': track_df.latitude.to_numpy(dtype='f8'),
+                                     'longitude': track_df.longitude.to_numpy(dtype='f8')})
+
+                last_epoch = self.last_epoch(deployment_name)
+                if last_epoch is not None:
+                    part = part[part.gps_epoch > last_epoch]
+
+                if not part.empty:
+                    part = part.sort_values('gps_epoch', kind='stable').reset_index(drop=True)
+                    self._write_part(deployment_dir, part)
+                    count = part.shape[0]
+
+            if recovered:
+                open(os.path.join(deployment_dir, _RECOVERED_FILE), 'w').close()
+
+        logging.debug('Stored {:} new GPS fixes for {:}'.format(count, deployment_name))
+
+        return count
+
+    def update(self, deployment_name, recovered=False, client=None):
+        """
+        Fetch the deployment track from the API and append the fixes newer than the last stored GPS epoch. Complete
+        tracks are not fetched. The tracks API has no time filter, so the whole track is downloaded (or revalidated
+        through the client response cache) but only the new fixes are written.
+        :param deployment_name: deployment name
+        :param recovered: True if the deployment has been recovered
+        :param client: RugApiClient instance. Defaults to the store client
+        :return: number of fixes appended or None if the track could not be fetched
+        """
+        if self.is_complete(deployment_name):
+            return 0
+
+        track_df = fetch_track_to_df(deployment_name, client=client or self.client, recovered=recovered)
+        if track_df.empty:
+            return None
+
+        return self.append(deployment_name, track_df, recovered=recovered)
+
+    def sync(self, deployments, max_workers=8):
+        """
+        Update the tracks of the deployments: new deployments are fetched, active deployments are appended to and
+        complete (recovered) deployments are skipped
+        :param deployments: deployments data frame indexed by deployment name, with an end_date column
+        :param max_workers: maximum number of requests in flight at once
+        :return: dictionary mapping deployment names to the number of fixes appended (None if the fetch failed)
+        """
+        recovered = deployments.end_date.notna().to_dict()
+        deployment_names = [d for d in deployments.index if not self.is_complete(d)]
+
+        logging.info('Updating {:} of {:} deployment tracks'.format(len(deployment_names), deployments.shape[0]))
+        client = self.client
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            counts = list(executor.map(lambda d: self.update(d, recovered=recovered[d], client=client),
+                                       deployment_names))
+
+        return dict(zip(deployment_names, counts))
+
+    def read(self, deployment_name):
+        """
+        Read the stored track
+        :param deployment_name: deployment name
+        :return: data frame containing time,latitude,longitude GPS positions, as returned by fetch_track_to_df. Empty
+            if the deployment has no stored fixes
+        """
+        parts = self.parts(deployment_name)
+        if not parts:
+            return pd.DataFrame()
+
+        track = pd.concat([pd.read_parquet(p[2]) for p in parts], ignore_index=True)
+
+        return _to_track_df(track)
+
+    def read_many(self, deployment_names):
+        """
+        Read the stored tracks of many deployments without any API requests
+        :param deployment_names: list of deployment names
+        :return: single data frame containing deployment_name,time,latitude,longitude. Deployments without stored
+            fixes are omitted
+        """
+        frames = []
+        names = []
+        for deployment_name in deployment_names:
+            for p in self.parts(deployment_name):
+                frames.append(pd.read_parquet(p[2]))
+                names.append(deployment_name)
+
+        if not frames:
+            return pd.DataFrame(columns=['deployment_name', 'time', 'latitude', 'longitude'])
+
+        sizes = np.array([f.shape[0] for f in frames])
+        tracks = _to_track_df(pd.concat(frames, ignore_index=True))
+        tracks.insert(0, 'deployment_name', pd.Categorical(np.repeat(names, sizes),
+                                                           categories=list(dict.fromkeys(names))))
+
+        return tracks
+
+    def get(self, deployment_name, recovered=False, client=None):
+        """
+        Read the track, updating it from the API first unless it is complete
+        :param deployment_name: deployment name
+        :param recovered: True if the deployment has been recovered
+        :param client: RugApiClient instance. Defaults to the store client
+        :return: data frame containing time,latitude,longitude GPS positions
+        """
+        self.update(deployment_name, recovered=recovered, client=client)
+
+        return self.read(deployment_name)
+
+    def compact(self, deployment_name):
+        """
+        Merge the track parts of the deployment into a single part
+        :param deployment_name: deployment name
+        :return: number of parts merged
+        """
+        with self._lock:
+            parts = self.parts(deployment_name)
+            if len(parts) < 2:
+                return 0
+
+            track = pd.concat([pd.read_parquet(p[2]) for p in parts], ignore_index=True)
+            self._write_part(self._deployment_dir(deployment_name), track)
+            for p in parts:
+                os.remove(p[2])
+
+        return len(parts)
+
+    def remove(self, deployment_name):
+        """
+        Remove the stored track of the deployment
+        :param deployment_name: deployment name
+        """
+        with self._lock:
+            deployment_dir = self._deployment_dir(deployment_name)
+            if not os.path.isdir(deployment_dir):
+                return
+            for f in os.listdir(deployment_dir):
+                os.remove(os.path.join(deployment_dir, f))
+            os.rmdir(deployment_dir)
+
+    def _deployment_dir(self, deployment_name):
+        return os.path.join(self._store_dir, 'deployment={:}'.format(deployment_name))
+
+    @staticmethod
+    def _write_part(deployment_dir, part):
+        part_file = os.path.join(deployment_dir, 'part-{:010d}-{:010d}.parquet'.format(part.gps_epoch.iloc[0],
+                                                                                      part.gps_epoch.iloc[-1]))
+        # Write to a temporary file so readers never see a partial part
+        tmp_file = '{:}.tmp'.format(part_file)
+        part.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, part_file)
+
+    def __repr__(self):
+        return '<TrackStore(store_dir={:})>'.format(self._store_dir)
+
+
+def add_track_store_argument(arg_parser):
+    """
+    Add the --tracks command line argument read by track_store_from_args to an argument parser
+    :param arg_parser: argparse.ArgumentParser
+    :return: the argument parser
+    """
+    arg_parser.add_argument('--tracks',
+                            dest='track_dir',
+                            help='Keep the GPS tracks in a local track store in the specified directory, fetching only '
+                                 'new tracks and the fixes of active deployments',
+                            nargs='?',
+                            const=DEFAULT_TRACK_DIR)
+
+    return arg_parser
+
+
+def track_store_from_args(args):
+    """
+    Open the TrackStore selected by the --tracks command line argument added by add_track_store_argument
+    :param args: argparse.Namespace with a track_dir attribute
+    :return: TrackStore or None if no track store was requested
+    """
+    if not args.track_dir:
+        return None
+
+    logging.info('Storing GPS tracks in {:}'.format(args.track_dir))
+
+    return TrackStore(args.track_dir)
+
+
+def _to_track_df(track):
+    return pd.DataFrame({'time': pd.to_datetime(track.gps_epoch.to_numpy(), unit='s'),
+                         'latitude': track.latitude.to_numpy(),
+                         'longitude': track.longitude.to_numpy()})
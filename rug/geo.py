@@ -1,64 +1,234 @@
 import logging
-from shapely import Polygon
+import json
+import codecs
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+import shapely
+from shapely import Polygon, Point, STRtree
+import numpy as np
 import pandas as pd
-from rug.api.urls import end_points
-import requests
+from rug.api import get_client
+from rug.api.decoders import decode_json
 from decimal import *
 
 logging.getLogger(__file__)
 
+# Mean earth radius, in meters
+EARTH_RADIUS = 6371008.8
 
-def locate_datasets(datasets, north=90., south=-90, east=180., west=-180):
+# Size of the response body chunks read while streaming a track
+TRACK_CHUNK_SIZE = 65536
+
+_WHITESPACE = ' \t\n\r,'
+_NUMBER_END = ' \t\n\r,]}'
+
+
+def locate_datasets(datasets, north=90., south=-90, east=180., west=-180, exact=False, tracks=None, client=None,
+                    max_workers=1, store=None):
     """
     Find all data sets in the geopandas data frame that are in the specified bounding box
-    :param datasets: geopandas data frame containing a geometry columm
+    :param datasets: geopandas data frame containing a geometry columm, or a DatasetIndex built from one to answer
+        repeated searches of the same data sets without scanning every geometry
     :param north: northernmost latitude
     :param south: southernmost latitude
     :param east: easternmost longitude
     :param west: westernmost longitude
+    :param exact: True to keep only the data sets whose GPS track, rather than the track bounding box, intersects the
+        bounding box. The tracks of the data sets selected by bounding box are then fetched and tested
+    :param tracks: optional dictionary mapping deployment names to track data frames (i.e.: already fetched tracks)
+        used instead of fetching them when exact is True
+    :param client: RugApiClient instance used to fetch the tracks. Defaults to the shared rug.api client, which
+        returns cached tracks if it was created with a response cache
+    :param max_workers: maximum number of concurrent track requests
+    :param store: optional rug.db.TrackStore used to fetch the tracks when exact is True
     :return: geopandas data frame containing the found data sets
     """
 
-    if not isinstance(datasets, pd.DataFrame):
-        logging.error('datasets arg must be a geopandas data frame')
-        return
+    bounding_box = _bounding_box(north=north, south=south, east=east, west=west)
 
-    if 'geometry' not in datasets:
-        logging.error('datasets arg must be a geopandas data frame with a geometry column')
-        return
+    if isinstance(datasets, DatasetIndex):
+        datasets = datasets.intersects(bounding_box, latlon=True)
+    else:
+        if not isinstance(datasets, pd.DataFrame):
+            logging.error('datasets arg must be a geopandas data frame')
+            return
+
+        if 'geometry' not in datasets:
+            logging.error('datasets arg must be a geopandas data frame with a geometry column')
+            return
 
-    bounding_box = Polygon(((north, west),
-                            (north, east),
-                            (south, east),
-                            (south, west),
-                            (north, west)))
-    logging.debug('Finding deployments inside bounding box: {:}'.format(bounding_box.wkt))
+        logging.debug('Finding deployments inside bounding box: {:}'.format(bounding_box.wkt))
 
-    # Find the data sets that are within the specified bounding box
-    datasets = datasets[datasets.intersects(bounding_box)]
+        # Find the data sets that are within the specified bounding box
+        datasets = datasets[datasets.intersects(bounding_box)]
+
+    if exact and not datasets.empty:
+        datasets = _intersect_tracks(datasets, bounding_box, tracks=tracks, client=client, max_workers=max_workers,
+                                     store=store)
 
     return datasets
 
 
-def fetch_track_to_df(deployment_name: str):
+def _intersect_tracks(datasets, bounding_box, tracks=None, client=None, max_workers=1, store=None):
+    """
+    Keep the data sets whose GPS track intersects the bounding box. Data sets whose track cannot be fetched are kept.
+    Tracks are read from the optional rug.db.TrackStore, so stored tracks are not downloaded again
+    """
+    tracks = tracks or {}
+
+    def fetch(deployment_name):
+        if deployment_name in tracks:
+            return tracks[deployment_name]
+        recovered = 'end_date' in datasets and not pd.isna(datasets.loc[deployment_name, 'end_date'])
+        return fetch_track_to_df(deployment_name, client=client, recovered=recovered, store=store)
+
+    logging.info('Testing {:} deployment tracks against the bounding box'.format(datasets.shape[0]))
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            gps_tracks = list(executor.map(fetch, datasets.index))
+    else:
+        gps_tracks = [fetch(deployment_name) for deployment_name in datasets.index]
+
+    # Track geometries in the (lat, lon) axis order of the bounding box
+    lines = []
+    for deployment_name, gps in zip(datasets.index, gps_tracks):
+        coords = gps[['latitude', 'longitude']].dropna().to_numpy() if not gps.empty else np.empty((0, 2))
+        if not coords.shape[0]:
+            logging.warning('No GPS track found for {:}. Keeping bounding box match'.format(deployment_name))
+            lines.append(None)
+            continue
+        lines.append(shapely.linestrings(coords) if coords.shape[0] > 1 else shapely.points(coords).item())
+
+    shapely.prepare(bounding_box)
+    found = np.array([line is None or bounding_box.intersects(line) for line in lines], dtype=bool)
+    logging.info('{:} of {:} deployment tracks intersect the bounding box'.format(found.sum(), found.size))
+
+    return datasets[found]
+
+
+def _bounding_box(north=90., south=-90, east=180., west=-180):
+    """
+    Bounding box polygon in the (lat, lon) axis order of the df2geodf geometries
+    """
+    return Polygon(((north, west),
+                    (north, east),
+                    (south, east),
+                    (south, west),
+                    (north, west)))
+
+
+class DatasetIndex(object):
+    """
+    STRtree spatial index over the geometries of a geopandas data frame created by rug.api.df2geodf. The index is built
+    once and answers repeated bounding box, point-radius and polygon queries without scanning every geometry. The
+    bounding box query returns the same data sets as locate_datasets, which also accepts a DatasetIndex in place of the
+    data frame. Data sets with empty geometries are never returned.
+    """
+
+    def __init__(self, datasets):
+        """
+        :param datasets: geopandas data frame containing a geometry column
+        """
+        if not isinstance(datasets, pd.DataFrame) or 'geometry' not in datasets:
+            raise TypeError('datasets must be a geopandas data frame with a geometry column')
+
+        self._datasets = datasets
+        self._tree = STRtree(datasets.geometry.values)
+
+    @property
+    def datasets(self):
+        return self._datasets
+
+    def bbox(self, north=90., south=-90, east=180., west=-180):
+        """
+        Find all data sets that intersect the specified bounding box
+        :param north: northernmost latitude
+        :param south: southernmost latitude
+        :param east: easternmost longitude
+        :param west: westernmost longitude
+        :return: geopandas data frame containing the found data sets
+        """
+        return self.intersects(_bounding_box(north=north, south=south, east=east, west=west), latlon=True)
+
+    def point(self, latitude, longitude, radius):
+        """
+        Find all data sets within radius of the specified position. The distance is measured in the lat/lon plane of
+        the df2geodf geometries, so the radius is in degrees, not km, and a degree of longitude spans fewer km away
+        from the equator
+        :param latitude: decimal degrees latitude
+        :param longitude: decimal degrees longitude
+        :param radius: search radius, in decimal degrees
+        :return: geopandas data frame containing the found data sets
+        """
+        return self._query(Point(latitude, longitude), predicate='dwithin', distance=radius)
+
+    def intersects(self, geometry, latlon=False):
+        """
+        Find all data sets that intersect the specified geometry
+        :param geometry: shapely geometry (i.e.: Polygon)
+        :param latlon: True if the geometry coordinates are in the (lat, lon) axis order of the df2geodf geometries.
+            Otherwise the coordinates are (lon, lat) and are swapped
+        :return: geopandas data frame containing the found data sets
+        """
+        if not latlon:
+            geometry = shapely.transform(geometry, lambda coords: coords[:, ::-1])
+
+        return self._query(geometry, predicate='intersects')
+
+    def _query(self, geometry, **kwargs):
+        logging.debug('Querying dataset index: {:}'.format(geometry.wkt))
+        positions = np.sort(self._tree.query(geometry, **kwargs))
+
+        return self._datasets.iloc[positions]
+
+    def __len__(self):
+        return self._datasets.shape[0]
+
+    def __repr__(self):
+        return '<DatasetIndex(datasets={:})>'.format(len(self))
+
+
+def fetch_track_to_df(deployment_name: str, client=None, recovered=False, stream=True, store=None):
     """
     Fetch the geojson track for the specified deployment name and convert to a pandas data frame
     :param deployment_name: deployment_name
+    :param client: RugApiClient instance. Defaults to the shared rug.api client
+    :param recovered: True if the deployment has been recovered, allowing a cached track to be kept longer
+    :param stream: True to parse the features incrementally as the response body is read. False to decode the whole
+        response first with the selected JSON backend, which holds every feature in memory at once
+    :param store: optional rug.db.TrackStore. The track is read from the store, after appending any new fixes from
+        the API unless the stored track is complete
     :return: data frame containing time,latitude,longitude GPS positions
     """
 
+    if store is not None:
+        return store.get(deployment_name, recovered=recovered, client=client)
+
+    client = client or get_client()
+
     track_df = pd.DataFrame()
 
-    track_url = '{:}/?deployment={:}'.format(end_points['TRACKS'].url, deployment_name)
+    track_url = '{:}/?deployment={:}'.format(client.url('TRACKS'), deployment_name)
 
     try:
-        r = requests.get(track_url, timeout=30)
+        r = client.get(track_url, timeout=30, ttl_key='RECOVERED_TRACKS' if recovered else None, stream=stream)
 
         if r.status_code != 200:
             logging.error('Failed to fetch {:} track ({:})'.format(deployment_name, track_url))
+            r.close()
+            return track_df
+
+        if stream:
+            try:
+                track_df = stream_track_to_df(r.iter_content(chunk_size=TRACK_CHUNK_SIZE))
+            finally:
+                r.close()
+            if track_df is None:
+                logging.warning('No track found for {:} ({:})'.format(deployment_name, track_url))
+                return pd.DataFrame()
             return track_df
 
-        track_json = r.json()
+        track_json = decode_json(r)
         if not track_json:
             logging.warning('No track found for {:} ({:})'.format(deployment_name, track_url))
             return track_df
@@ -67,17 +237,185 @@ def fetch_track_to_df(deployment_name: str):
         logging.error('{:}: {:}'.format(deployment_name, e))
         return track_df
 
-    gps_fixes = [
-        {'time': pd.to_datetime(f['properties']['gps_epoch'], unit='s'),
-         'latitude': f['geometry']['coordinates'][1],
-         'longitude': f['geometry']['coordinates'][0]}
-        for f in track_json['features'] if
-        f['geometry']['type'] == 'Point' and 'waypoint' not in f['properties']]
+    return features_to_track_df(track_json['features'])
+
+
+def features_to_track_df(features):
+    """
+    Convert the GeoJSON track features to a data frame. Waypoints and non-Point features are skipped. The GPS epochs
+    and positions of the fixes are collected in the same pass that selects them and converted in a single step. Null
+    GPS epochs become NaT and null positions NaN.
+    :param features: list of GeoJSON Feature dictionaries
+    :return: data frame containing time,latitude,longitude GPS positions. Empty if there are no GPS fixes
+    """
+    fixes = [(f['properties']['gps_epoch'], f['geometry']['coordinates'][:2]) for f in features
+             if f['geometry']['type'] == 'Point' and 'waypoint' not in f['properties']]
+    if not fixes:
+        return pd.DataFrame()
+
+    epochs, coordinates = zip(*fixes)
+    epochs = pd.to_numeric(epochs, errors='coerce').astype('f8')
+    coordinates = np.array(coordinates, dtype='f8')
+
+    return _gps_to_df(epochs, coordinates[:, 1], coordinates[:, 0])
+
+
+def _gps_to_df(epochs, latitudes, longitudes):
+    return pd.DataFrame({'time': pd.to_datetime(epochs, unit='s'),
+                         'latitude': latitudes,
+                         'longitude': longitudes})
 
-    if gps_fixes:
-        track_df = pd.DataFrame(gps_fixes)
 
-    return track_df
+def iter_geojson_features(chunks):
+    """
+    Incrementally decode the features of a GeoJSON FeatureCollection. Only the current, partially read, feature is
+    held in memory. The top level members are parsed in order to find the features array, so a "features" string
+    elsewhere in the document is never mistaken for it. Chunks are queued and only joined to the unparsed text when a
+    value is decoded, and a value split across chunks is only decoded again once its buffered part has doubled, so
+    large features (i.e.: the track LineString) are copied and parsed a number of times logarithmic in their size.
+    :param chunks: iterable of utf-8 encoded bytes (or str) chunks of the FeatureCollection, i.e.:
+        requests.Response.iter_content()
+    :return: generator yielding each feature dictionary, in order
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    # Joined unparsed text, the read position in it and the chunks read since it was last joined
+    state = {'buf': '', 'pos': 0, 'pending': [], 'pending_size': 0}
+
+    def read():
+        """
+        Queue the next chunk. Returns False at the end of the body
+        """
+        for chunk in chunks:
+            text = utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                state['pending'].append(text)
+                state['pending_size'] += len(text)
+                return True
+        return False
+
+    def join():
+        """
+        Append the queued chunks to the unparsed text, dropping the parsed text
+        """
+        if state['pending']:
+            state['buf'] = state['buf'][state['pos']:] + ''.join(state['pending'])
+            state['pos'] = 0
+            state['pending'] = []
+            state['pending_size'] = 0
+
+    def peek(skip=_WHITESPACE):
+        """
+        Next character after any characters in skip, or None at the end of the body
+        """
+        while True:
+            buf, pos = state['buf'], state['pos']
+            while pos < len(buf) and buf[pos] in skip:
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not state['pending'] and not read():
+                return None
+            join()
+
+    def decode():
+        """
+        Decode the next JSON value
+        """
+        peek(' \t\n\r')
+        retry_size = 0
+        eof = False
+        while True:
+            if eof or len(state['buf']) - state['pos'] + state['pending_size'] >= retry_size:
+                join()
+                buf, pos = state['buf'], state['pos']
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # A number is only complete once the character following it has been read
+                    if eof or not isinstance(value, (int, float)) or (end < len(buf) and buf[end] in _NUMBER_END):
+                        state['pos'] = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError('Truncated GeoJSON FeatureCollection')
+                retry_size = 2 * (len(buf) - pos)
+            if not read():
+                eof = True
+
+    if peek() != '{':
+        return
+    state['pos'] += 1
+
+    # Skip the top level members preceding the features array
+    while True:
+        c = peek()
+        if c is None or c == '}':
+            return
+        key = decode()
+        if peek() != ':':
+            raise ValueError('Invalid GeoJSON FeatureCollection')
+        state['pos'] += 1
+        if key == 'features':
+            if peek() != '[':
+                raise ValueError('Invalid GeoJSON FeatureCollection features')
+            state['pos'] += 1
+            break
+        decode()
+
+    while True:
+        c = peek()
+        if c is None:
+            raise ValueError('Truncated GeoJSON FeatureCollection')
+        if c == ']':
+            return
+        yield decode()
+
+
+def stream_track_to_df(chunks, size=4096):
+    """
+    Parse the GPS fixes of a streamed GeoJSON track into a data frame. Waypoints and non-Point features are skipped and
+    the positions are written to preallocated arrays, which are grown as needed, so the data frame is built once.
+    :param chunks: iterable of bytes chunks of the tracks API response body
+    :param size: initial array size
+    :return: data frame containing time,latitude,longitude GPS positions, empty if the track contains no GPS fixes, or
+        None if the response contains no features
+    """
+    epochs = np.empty(size, dtype='f8')
+    lats = np.empty(size, dtype='f8')
+    lons = np.empty(size, dtype='f8')
+
+    n = 0
+    found = False
+    for f in iter_geojson_features(chunks):
+        found = True
+        if f['geometry']['type'] != 'Point' or 'waypoint' in f['properties']:
+            continue
+
+        if n == epochs.size:
+            epochs = np.resize(epochs, 2 * n)
+            lats = np.resize(lats, 2 * n)
+            lons = np.resize(lons, 2 * n)
+
+        gps_epoch = f['properties']['gps_epoch']
+        coordinates = f['geometry']['coordinates']
+        try:
+            epochs[n] = gps_epoch
+            lons[n] = coordinates[0]
+            lats[n] = coordinates[1]
+        except (TypeError, ValueError):
+            # Null values become NaN, as in features_to_track_df
+            epochs[n], lons[n], lats[n] = pd.to_numeric([gps_epoch, coordinates[0], coordinates[1]], errors='coerce')
+        n += 1
+
+    if not found:
+        return None
+
+    if not n:
+        return pd.DataFrame()
+
+    return _gps_to_df(epochs[:n], lats[:n], lons[:n])
 
 
 def latlon_to_geojson_track(latitudes, longitudes, timestamps, include_points=True, precision='0.001'):
@@ -105,6 +443,44 @@ def latlon_to_geojson_track(latitudes, longitudes, timestamps, include_points=Tr
     return geojson
 
 
+def quantize(values, precision='0.001'):
+    """
+    Vectorized equivalent of float(Decimal(value).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)). The values
+    are scaled to integers of the precision in floating point and the few values whose scaled fraction is too close to
+    one half to be decided that way are rounded with Decimal, so the results are identical.
+    :param values: array-like of floats
+    :param precision: precision string (i.e.: '0.001')
+    :return: numpy array of quantized floats. NaNs and infinities are passed through
+    """
+    values = np.asarray(values, dtype='f8')
+
+    digits = -Decimal(precision).as_tuple().exponent
+    if digits < 0 or digits > 15:
+        return np.array([_decimal_quantize(v, precision) for v in values.flat]).reshape(values.shape)
+
+    scale = 10. ** digits
+    scaled = np.abs(values) * scale
+    whole = np.floor(scaled)
+    with np.errstate(invalid='ignore'):
+        fraction = scaled - whole
+
+    # ROUND_HALF_DOWN: only fractions greater than one half are rounded away from zero
+    quantized = np.copysign((whole + (fraction > 0.5)) / scale, values)
+
+    # Fractions within a few ulps of one half depend on the exact binary value
+    ties = np.abs(fraction - 0.5) <= 4 * np.spacing(np.maximum(scaled, 1.))
+    if ties.any():
+        quantized[ties] = [_decimal_quantize(v, precision) for v in values[ties]]
+
+    return quantized
+
+
+def _decimal_quantize(value, precision):
+    if np.isinf(value):
+        return float(value)
+    return float(Decimal(value).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN))
+
+
 def latlon_to_linestring(latitudes, longitudes, timestamps, precision='0.001'):
     """
     Create a valid GeoJSON LineString Feature containing the GPS track
@@ -114,19 +490,12 @@ def latlon_to_linestring(latitudes, longitudes, timestamps, precision='0.001'):
     :param precision: GPS fix precision
     :return: GeoJSON LineString Feature object
     """
-    dataset_gps = pd.DataFrame(index=timestamps)
-    dataset_gps['latitude'] = latitudes.values
-    dataset_gps['longitude'] = longitudes.values
+    coordinates = np.column_stack((quantize(longitudes, precision), quantize(latitudes, precision)))
 
     track = {'type': 'Feature',
              # 'bbox': bbox,
              'geometry': {'type': 'LineString',
-                          'coordinates': [
-                              [float(Decimal(pos.longitude).quantize(Decimal(precision),
-                                                                     rounding=ROUND_HALF_DOWN)),
-                               float(Decimal(pos.latitude).quantize(Decimal(precision),
-                                                                    rounding=ROUND_HALF_DOWN))]
-                              for i, pos in dataset_gps.iterrows()]},
+                          'coordinates': coordinates.tolist()},
              'properties': {}
              }
 
@@ -142,16 +511,12 @@ def latlon_to_points(latitudes, longitudes, timestamps, precision='0.001'):
     :param precision: GPS fix precision
     :return: Array of GeoJSON Point Features
     """
-    dataset_gps = pd.DataFrame(index=timestamps)
-    dataset_gps['latitude'] = latitudes.values
-    dataset_gps['longitude'] = longitudes.values
+    coordinates = np.column_stack((quantize(longitudes, precision), quantize(latitudes, precision)))
+    ts = pd.DatetimeIndex(timestamps).strftime('%Y-%m-%dT%H:%M:%SZ')
 
     return [{'type': 'Feature',
-             'geometry': {'type': 'Point', 'coordinates':
-                 [float(Decimal(pos.longitude).quantize(Decimal(precision),
-                                                        rounding=ROUND_HALF_DOWN)),
-                  float(Decimal(pos.latitude).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN))]},
-             'properties': {'ts': i.strftime('%Y-%m-%dT%H:%M:%SZ')}} for i, pos in dataset_gps.iterrows()]
+             'geometry': {'type': 'Point', 'coordinates': coordinate},
+             'properties': {'ts': t}} for coordinate, t in zip(coordinates.tolist(), ts)]
 
 
 def latlon_to_bbox(latitudes, longitudes, timestamps, precision='0.001'):
@@ -163,14 +528,257 @@ def latlon_to_bbox(latitudes, longitudes, timestamps, precision='0.001'):
     :param precision: GPS fix precision
     :return: Bounding box
     """
-    dataset_gps = pd.DataFrame(index=timestamps)
-    dataset_gps['latitude'] = latitudes.values
-    dataset_gps['longitude'] = longitudes.values
+    latitudes = pd.Series(np.asarray(latitudes, dtype='f8'))
+    longitudes = pd.Series(np.asarray(longitudes, dtype='f8'))
+
+    return quantize([longitudes.min(), latitudes.min(), longitudes.max(), latitudes.max()], precision).tolist()
+
+
+def iter_geojson_tracks(tracks, by='deployment_name', include_points=False, precision='0.001', properties=None):
+    """
+    Build the GeoJSON track FeatureCollections, as created by latlon_to_geojson_track, of many deployments from a
+    single long track table. The fixes of all tracks are sorted, quantized and reduced to bounding boxes in one
+    vectorized pass and the FeatureCollections are then yielded one deployment at a time.
+    :param tracks: track data frame with columns time, latitude, longitude and the by column (i.e.:
+        rug.db.TrackStore.read_many)
+    :param by: column identifying the deployment of each fix
+    :param include_points: True to include each GPS Point feature
+    :param precision: GPS fix precision
+    :param properties: optional dictionary mapping deployment names to the LineString Feature properties (i.e.: the
+        deployment properties displayed by the KML templates)
+    :return: generator yielding (deployment name, GeoJSON FeatureCollection) tuples in order of first appearance
+    """
+    properties = properties or {}
+    if tracks.empty:
+        return
+
+    codes, names = pd.factorize(tracks[by], sort=False)
+    epochs = tracks.time.to_numpy(dtype='datetime64[ns]').astype('int64')
+    order = np.lexsort((epochs, codes))
+
+    codes = codes[order]
+    lons = quantize(tracks.longitude.to_numpy()[order], precision)
+    lats = quantize(tracks.latitude.to_numpy()[order], precision)
+
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    ends = np.append(starts[1:], codes.size)
+
+    # NaN ignoring bounding boxes of all tracks: [W, S, E, N]
+    with np.errstate(invalid='ignore'):
+        bboxes = np.column_stack((np.fmin.reduceat(lons, starts), np.fmin.reduceat(lats, starts),
+                                  np.fmax.reduceat(lons, starts), np.fmax.reduceat(lats, starts))).tolist()
+
+    coordinates = np.column_stack((lons, lats)).tolist()
+    ts = None
+    if include_points:
+        ts = pd.DatetimeIndex(tracks.time.to_numpy()[order]).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    for code, i0, i1, bbox in zip(codes[starts], starts, ends, bboxes):
+        deployment_name = names[code]
+        features = [{'type': 'Feature',
+                     'geometry': {'type': 'LineString',
+                                  'coordinates': coordinates[i0:i1]},
+                     'properties': properties.get(deployment_name, {})}]
+        if include_points:
+            features += [{'type': 'Feature',
+                          'geometry': {'type': 'Point', 'coordinates': coordinate},
+                          'properties': {'ts': t}} for coordinate, t in zip(coordinates[i0:i1], ts[i0:i1])]
+
+        yield deployment_name, {'type': 'FeatureCollection',
+                                'bbox': bbox,
+                                'features': features}
+
+
+class GeoJsonWriter(object):
+    """
+    Write GeoJSON track features incrementally to a file or stream as a single FeatureCollection. Coordinates are
+    quantized as in latlon_to_geojson_track and written with fixed precision, chunk_size fixes at a time, so memory
+    use is bounded regardless of the track length or the number of tracks. The FeatureCollection bbox, spanning all
+    written tracks, is written after the features when the writer is closed. Missing (NaN) or infinite coordinates,
+    which are not valid JSON numbers, are written as null so the features stay aligned with the GPS fixes.
+    """
+
+    def __init__(self, fp, precision='0.001', chunk_size=10000):
+        """
+        :param fp: writable text file object
+        :param precision: GPS fix precision
+        :param chunk_size: number of GPS fixes formatted at a time
+        """
+        self._fp = fp
+        self._precision = precision
+        self._chunk_size = chunk_size
+        digits = -Decimal(precision).as_tuple().exponent
+        self._number_format = '%.{:}f'.format(digits) if digits >= 0 else '%r'
+        self._bbox = [np.nan, np.nan, np.nan, np.nan]
+        self._count = 0
+        self._closed = False
+
+        self._fp.write('{"type": "FeatureCollection", "features": [')
+
+    @property
+    def count(self):
+        return self._count
+
+    def write_track(self, latitudes, longitudes, timestamps, include_points=True, properties=None):
+        """
+        Write the track LineString Feature and, optionally, the GPS fix Point Features
+        :param latitudes: pandas Series containing decimal degrees latitudes
+        :param longitudes: pandas Series containing decimal degrees longitudes
+        :param timestamps: pandas Series containing GPS fix datetime64[ns]
+        :param include_points: True to include each GPS Point feature
+        :param properties: optional LineString Feature properties dictionary
+        :return: number of features written
+        """
+        lons = quantize(longitudes, self._precision)
+        lats = quantize(latitudes, self._precision)
+        self._update_bbox(lons, lats)
+
+        count = self._count
+        for piece in self.iter_track(lons, lats, timestamps, include_points=include_points, properties=properties):
+            self._fp.write(piece)
+
+        return self._count - count
+
+    def write_feature(self, feature):
+        """
+        Write a GeoJSON Feature dictionary
+        :param feature: GeoJSON Feature
+        """
+        self._fp.write('{:}{:}'.format(', ' if self._count else '', json.dumps(feature)))
+        self._count += 1
+
+    def iter_track(self, lons, lats, timestamps, include_points=True, properties=None):
+        """
+        Generate the serialized track features. Each yielded string is a complete feature, with its leading separator,
+        except for the LineString, whose coordinates are yielded in chunks.
+        :param lons: quantized longitudes
+        :param lats: quantized latitudes
+        :param timestamps: GPS fix datetime64[ns]
+        :param include_points: True to include each GPS Point feature
+        :param properties: optional LineString Feature properties dictionary
+        :return: generator of JSON text
+        """
+        n = len(lons)
+
+        yield '{:}{{"type": "Feature", "geometry": {{"type": "LineString", "coordinates": ['.format(
+            ', ' if self._count else '')
+        for i in range(0, n, self._chunk_size):
+            yield '{:}{:}'.format(', ' if i else '', self._format_coordinates(lons[i:i + self._chunk_size],
+                                                                             lats[i:i + self._chunk_size]))
+        yield ']}}, "properties": {:}}}'.format(json.dumps(properties or {}, default=str))
+        self._count += 1
+
+        if not include_points:
+            return
+
+        timestamps = pd.DatetimeIndex(timestamps)
+        for i in range(0, n, self._chunk_size):
+            coordinates = self._format_coordinates(lons[i:i + self._chunk_size], lats[i:i + self._chunk_size],
+                                                   separator='\n')
+            ts = timestamps[i:i + self._chunk_size].strftime('%Y-%m-%dT%H:%M:%SZ')
+            yield ''.join(['{:}{{"type": "Feature", "geometry": {{"type": "Point", "coordinates": {:}}}, '
+                           '"properties": {{"ts": "{:}"}}}}'.format(', ', coordinate, t)
+                           for coordinate, t in zip(coordinates.split('\n'), ts)])
+            self._count += len(ts)
+
+    def close(self):
+        """
+        Write the FeatureCollection bbox and close the FeatureCollection. The file object is not closed
+        """
+        if self._closed:
+            return
+
+        self._fp.write('], "bbox": {:}}}'.format(json.dumps([None if np.isnan(b) else b for b in self._bbox])))
+        self._closed = True
+
+    def _format_coordinates(self, lons, lats, separator=', '):
+        if not len(lons):
+            return ''
+        pair = '[{:}, {:}]'.format(self._number_format, self._number_format)
+        values = np.column_stack((lons, lats)).ravel()
+        finite = np.isfinite(values).all()
+        values = values.tolist()
+        text = (pair + separator) * (len(lons) - 1) % tuple(values[:-2]) + pair % tuple(values[-2:])
+        if finite:
+            return text
+
+        # The formatted text only holds numbers, brackets and separators
+        return text.replace('-inf', 'null').replace('inf', 'null').replace('nan', 'null')
+
+    def _update_bbox(self, lons, lats):
+        lons = np.where(np.isfinite(lons), lons, np.nan)
+        lats = np.where(np.isfinite(lats), lats, np.nan)
+        if not len(lons) or np.isnan(lons).all() or np.isnan(lats).all():
+            return
+        self._bbox = [np.fmin(self._bbox[0], np.nanmin(lons)),
+                      np.fmin(self._bbox[1], np.nanmin(lats)),
+                      np.fmax(self._bbox[2], np.nanmax(lons)),
+                      np.fmax(self._bbox[3], np.nanmax(lats))]
+        self._bbox = [float(b) for b in self._bbox]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return '<GeoJsonWriter(precision={:}, features={:})>'.format(self._precision, self._count)
+
+
+def write_geojson_track(fp, latitudes, longitudes, timestamps, include_points=True, precision='0.001',
+                        properties=None):
+    """
+    Stream the GeoJSON FeatureCollection created by latlon_to_geojson_track to a file or stream without building it in
+    memory
+    :param fp: writable text file object
+    :param latitudes: pandas Series containing decimal degrees latitudes
+    :param longitudes: pandas Series containing decimal degrees longitudes
+    :param timestamps: pandas Series containing GPS fix datetime64[ns]
+    :param include_points: True to include each GPS Point feature
+    :param precision: GPS fix precision
+    :param properties: optional LineString Feature properties dictionary
+    :return: number of features written
+    """
+    with GeoJsonWriter(fp, precision=precision) as writer:
+        writer.write_track(latitudes, longitudes, timestamps, include_points=include_points, properties=properties)
+
+    return writer.count
+
+
+def resample_track(track_df, interval='1D', how='mean'):
+    """
+    Aggregate the track positions in fixed time intervals. GPS epochs are binned to integer multiples of the interval,
+    counted from the unix epoch, and all bins are aggregated in a single grouped pass. The input data frame is not
+    modified.
+    :param track_df: track data frame with columns time, latitude, longitude
+    :param interval: pandas Timedelta string or Timedelta (i.e.: 1h, 6h, 1D, 7D)
+    :param how: aggregation of the positions in each interval: mean, median, first or last. first and last are in time
+        order and skip missing positions
+    :return: resampled track data frame with columns time (start of the interval), latitude, longitude
+    """
+    if how not in ['mean', 'median', 'first', 'last']:
+        raise ValueError('Invalid aggregation {:}. Valid aggregations are: mean, median, first, last'.format(how))
 
-    return [float(Decimal(dataset_gps.longitude.min()).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)),
-            float(Decimal(dataset_gps.latitude.min()).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)),
-            float(Decimal(dataset_gps.longitude.max()).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)),
-            float(Decimal(dataset_gps.latitude.max()).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN))]
+    seconds = int(pd.Timedelta(interval).total_seconds())
+    if seconds <= 0:
+        raise ValueError('Invalid interval {:}: must be at least 1 second'.format(interval))
+
+    if track_df.empty:
+        return pd.DataFrame(columns=['time', 'latitude', 'longitude'])
+
+    epochs = track_df.time.to_numpy(dtype='datetime64[s]').astype('int64')
+    order = np.argsort(epochs, kind='stable')
+
+    positions = pd.DataFrame({'latitude': track_df.latitude.to_numpy()[order],
+                              'longitude': track_df.longitude.to_numpy()[order]})
+    bins = epochs[order] // seconds
+
+    resampled = getattr(positions.groupby(bins, sort=True), how)()
+
+    return pd.DataFrame({'time': pd.to_datetime(resampled.index.to_numpy() * seconds, unit='s'),
+                         'latitude': resampled.latitude.to_numpy(),
+                         'longitude': resampled.longitude.to_numpy()})
 
 
 def average_daily_track_gps(track_df):
@@ -180,7 +788,547 @@ def average_daily_track_gps(track_df):
     :return: daily average track data frame
     """
 
-    track_df.set_index('time', inplace=True)
+    daily_df = resample_track(track_df, interval='1D', how='mean')
+    daily_df['time'] = daily_df.time.dt.date
+
+    return daily_df
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between positions
+    :param lat1: decimal degrees latitude(s) of the first position(s)
+    :param lon1: decimal degrees longitude(s) of the first position(s)
+    :param lat2: decimal degrees latitude(s) of the second position(s)
+    :param lon2: decimal degrees longitude(s) of the second position(s)
+    :return: distance(s) in meters
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(v, dtype='f8')) for v in [lat1, lon1, lat2, lon2]]
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def track_metrics(tracks, by='deployment_name'):
+    """
+    Compute the great-circle segment distance, cumulative distance, time gap and speed over ground of each GPS fix for
+    one or many tracks in a single vectorized pass. Fixes without a position are dropped. The input data frame is not
+    modified.
+    :param tracks: track data frame with columns time, latitude, longitude and, for many tracks, the by column (i.e.:
+        rug.db.TrackStore.read_many)
+    :param by: column identifying the track of each fix. Ignored if not in tracks
+    :return: data frame, sorted by track and time, with the added columns segment_km (from the previous fix of the
+        same track, 0 for the first fix), distance_km (cumulative), time_gap_s and speed_m_s (NaN for the first fix
+        and for fixes with the same time)
+    """
+    tracks = tracks[tracks.latitude.notna() & tracks.longitude.notna()]
+
+    epochs = tracks.time.to_numpy(dtype='datetime64[ns]').astype('int64')
+    if by in tracks:
+        codes = pd.Categorical(tracks[by]).codes
+        order = np.lexsort((epochs, codes))
+        codes = codes[order]
+    else:
+        order = np.argsort(epochs, kind='stable')
+        codes = np.zeros(order.size, dtype='int8')
+
+    metrics = tracks.iloc[order].reset_index(drop=True)
+    epochs = epochs[order]
+    lats = metrics.latitude.to_numpy(dtype='f8')
+    lons = metrics.longitude.to_numpy(dtype='f8')
+
+    # First fix of each track
+    first = np.ones(codes.size, dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+
+    segments = np.zeros(codes.size)
+    segments[1:] = haversine(lats[:-1], lons[:-1], lats[1:], lons[1:]) / 1000.
+    segments[first] = 0.
+
+    gaps = np.full(codes.size, np.nan)
+    gaps[1:] = (epochs[1:] - epochs[:-1]) / 1e9
+    gaps[first] = np.nan
+
+    # Cumulative distance restarting at the first fix of each track
+    cumulative = np.cumsum(segments)
+    starts = np.flatnonzero(first)
+    offsets = np.repeat(cumulative[starts] - segments[starts], np.diff(np.append(starts, codes.size)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speeds = np.where(gaps > 0, segments * 1000. / gaps, np.nan)
+
+    metrics['segment_km'] = segments
+    metrics['distance_km'] = cumulative - offsets
+    metrics['time_gap_s'] = gaps
+    metrics['speed_m_s'] = speeds
+
+    return metrics
+
+
+def summarize_tracks(tracks, by='deployment_name'):
+    """
+    Summarize the GPS tracks of many deployments
+    :param tracks: track data frame with columns time, latitude, longitude and the by column
+    :param by: column identifying the track of each fix
+    :return: data frame indexed by track containing fixes, start_time, end_time, days, distance_km, max_gap_hours,
+        mean_speed_m_s and max_speed_m_s
+    """
+    metrics = track_metrics(tracks, by=by)
+    if by not in metrics:
+        metrics[by] = 0
+
+    summary = metrics.groupby(by, sort=False, observed=True).agg(fixes=('time', 'size'),
+                                                                  start_time=('time', 'min'),
+                                                                  end_time=('time', 'max'),
+                                                                  distance_km=('segment_km', 'sum'),
+                                                                  duration_s=('time_gap_s', 'sum'),
+                                                                  max_gap_s=('time_gap_s', 'max'),
+                                                                  max_speed_m_s=('speed_m_s', 'max'))
+
+    summary['days'] = (summary.end_time - summary.start_time).dt.total_seconds() / 86400.
+    summary['max_gap_hours'] = summary.max_gap_s / 3600.
+    summary['mean_speed_m_s'] = (summary.distance_km * 1000. / summary.duration_s).where(summary.duration_s > 0)
+
+    return summary[['fixes', 'start_time', 'end_time', 'days', 'distance_km', 'max_gap_hours', 'mean_speed_m_s',
+                    'max_speed_m_s']]
+
+
+def simplify_track(track_df, tolerance, units='m', method='douglas-peucker'):
+    """
+    Simplify the track, keeping the GPS fixes needed to stay within tolerance of the original track shape. Positions
+    are projected to a local equirectangular plane, after unwrapping longitudes across the dateline, when the
+    tolerance is in meters.
+    :param track_df: track data frame with columns time, latitude, longitude, sorted by time
+    :param tolerance: maximum distance of the removed fixes from the simplified track (douglas-peucker) or side of
+        the smallest right triangle, with area tolerance ** 2 / 2, kept (visvalingam)
+    :param units: tolerance units: m or degrees
+    :param method: douglas-peucker or visvalingam
+    :return: data frame containing the rows of the kept GPS fixes
+    """
+    if units not in ['m', 'degrees']:
+        raise ValueError('Invalid units {:}. Valid units are: m, degrees'.format(units))
+    if method not in ['douglas-peucker', 'visvalingam']:
+        raise ValueError('Invalid method {:}. Valid methods are: douglas-peucker, visvalingam'.format(method))
+
+    track_df = track_df[track_df.latitude.notna() & track_df.longitude.notna()]
+    if track_df.shape[0] < 3:
+        return track_df
+
+    y = track_df.latitude.to_numpy(dtype='f8')
+    x = np.unwrap(track_df.longitude.to_numpy(dtype='f8'), period=360.)
+    if units == 'm':
+        x = np.radians(x) * EARTH_RADIUS * np.cos(np.radians(y.mean()))
+        y = np.radians(y) * EARTH_RADIUS
+
+    if method == 'douglas-peucker':
+        keep = _douglas_peucker(x, y, tolerance)
+    else:
+        keep = _visvalingam(x, y, tolerance ** 2 / 2)
+
+    logging.debug('Simplified track from {:} to {:} GPS fixes'.format(keep.size, keep.sum()))
+
+    return track_df[keep]
+
+
+def _douglas_peucker(x, y, tolerance):
+    """
+    Douglas-Peucker line simplification. Distances from each span are computed vectorized
+    :return: boolean array of the kept points
+    """
+    keep = np.zeros(x.size, dtype=bool)
+    keep[[0, -1]] = True
+
+    spans = [(0, x.size - 1)]
+    while spans:
+        i, j = spans.pop()
+        if j - i < 2:
+            continue
+
+        # Distance from each intermediate point to the segment from i to j
+        dx = x[j] - x[i]
+        dy = y[j] - y[i]
+        px = x[i + 1:j] - x[i]
+        py = y[i + 1:j] - y[i]
+        length = dx * dx + dy * dy
+        t = np.clip((px * dx + py * dy) / length, 0., 1.) if length else 0.
+        distance = np.hypot(px - t * dx, py - t * dy)
+
+        k = np.argmax(distance)
+        if distance[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            spans.append((i, k))
+            spans.append((k, j))
+
+    return keep
+
+
+def _visvalingam(x, y, min_area):
+    """
+    Visvalingam-Whyatt line simplification: repeatedly remove the point with the smallest effective triangle area
+    until all remaining areas are >= min_area
+    :return: boolean array of the kept points
+    """
+    def area(i, j, k):
+        return np.abs((x[j] - x[i]) * (y[k] - y[i]) - (x[k] - x[i]) * (y[j] - y[i])) / 2
+
+    n = x.size
+    previous = np.arange(-1, n - 1)
+    following = np.arange(1, n + 1)
+    areas = np.full(n, np.inf)
+    areas[1:-1] = area(np.arange(0, n - 2), np.arange(1, n - 1), np.arange(2, n))
+
+    heap = [(a, i) for i, a in enumerate(areas[1:-1].tolist(), start=1)]
+    heapq.heapify(heap)
+
+    keep = np.ones(n, dtype=bool)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if not keep[i] or a != areas[i]:
+            # Stale entry
+            continue
+        if a >= min_area:
+            break
+
+        keep[i] = False
+        p = previous[i]
+        q = following[i]
+        following[p] = q
+        previous[q] = p
+
+        # The effective area of a neighbour is never smaller than that of the point just removed
+        for j in (p, q):
+            if 0 < j < n - 1:
+                areas[j] = max(area(previous[j], j, following[j]), a)
+                heapq.heappush(heap, (areas[j], j))
+
+    return keep
+
+
+COVERAGE_METRICS = ['fixes', 'glider_days', 'deployments']
+
+
+class CoverageGrid(object):
+    """
+    Coverage counts of GPS fixes binned into a hexagonal or regular lat/lon grid covering a fixed extent. Binning is
+    vectorized and independent of any plotting, so the counts of grids with the same definition can be merged (i.e.:
+    across deployments or processes), saved to disk with save() and loaded and rendered later (rug.viz.coverage)
+    without binning the fixes again. The hexagonal grid is built like matplotlib's hexbin, from two interleaved
+    rectangular lattices of pointy-top hexagons, but the lattice rows are sqrt(3) times the cell width apart so the
+    hexagons are regular in degrees. hexbin fits nx / sqrt(3) rows to the latitude range of the data instead, so the
+    shape of its hexagons depends on the data.
+
+    The coverage metric is what each cell counts:
+        fixes: GPS fixes
+        glider_days: unique deployment days with at least one fix in the cell, so gliders that surface often are not
+            over-weighted
+        deployments: unique deployments with at least one fix in the cell
+    """
+
+    def __init__(self, extent=(-180., -90., 180., 90.), resolution=1., kind='hex', counts=None, metric='fixes'):
+        """
+        :param extent: grid extent in decimal degrees: (west, south, east, north)
+        :param resolution: cell width in decimal degrees
+        :param kind: hex or rect
+        :param counts: optional initial counts array of size ncells
+        :param metric: coverage metric: fixes, glider_days or deployments
+        """
+        if kind not in ['hex', 'rect']:
+            raise ValueError('Invalid grid kind {:}. Valid kinds are: hex, rect'.format(kind))
+        if metric not in COVERAGE_METRICS:
+            raise ValueError('Invalid coverage metric {:}. Valid metrics are: {:}'.format(metric, COVERAGE_METRICS))
+        west, south, east, north = [float(e) for e in extent]
+        if east <= west or north <= south:
+            raise ValueError('Invalid extent {:}'.format(extent))
+        if resolution <= 0:
+            raise ValueError('Invalid resolution {:}'.format(resolution))
+
+        self._extent = (west, south, east, north)
+        self._resolution = float(resolution)
+        self._kind = kind
+        self._metric = metric
+
+        # Cell width and height
+        self._sx = self._resolution
+        self._sy = self._resolution * np.sqrt(3.) if kind == 'hex' else self._resolution
+        self._nx = int(np.ceil((east - west) / self._sx))
+        self._ny = int(np.ceil((north - south) / self._sy))
+
+        if kind == 'hex':
+            self._ncells = (self._nx + 1) * (self._ny + 1) + self._nx * self._ny
+        else:
+            self._ncells = self._nx * self._ny
+
+        if counts is None:
+            counts = np.zeros(self._ncells, dtype='int64')
+        counts = np.asarray(counts, dtype='int64')
+        if counts.shape != (self._ncells,):
+            raise ValueError('counts must be an array of size {:}'.format(self._ncells))
+        self._counts = counts
+
+    @property
+    def extent(self):
+        return self._extent
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def metric(self):
+        return self._metric
+
+    @property
+    def ncells(self):
+        return self._ncells
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def total(self):
+        return int(self._counts.sum())
+
+    def compatible(self, other):
+        """
+        True if the other grid has the same definition, so their counts can be merged
+        """
+        return (isinstance(other, CoverageGrid) and self._kind == other.kind and self._extent == other.extent and
+                self._resolution == other.resolution and self._metric == other.metric)
+
+    def copy(self, counts=None):
+        """
+        Copy of the grid, optionally with other counts
+        """
+        return CoverageGrid(extent=self._extent, resolution=self._resolution, kind=self._kind,
+                            counts=self._counts.copy() if counts is None else counts, metric=self._metric)
+
+    def cell_ids(self, latitudes, longitudes):
+        """
+        Integer ids of the cells containing the positions
+        :param latitudes: decimal degrees latitudes
+        :param longitudes: decimal degrees longitudes
+        :return: int64 array of cell ids. -1 for positions outside the extent or missing
+        """
+        lats = np.asarray(latitudes, dtype='f8')
+        lons = np.asarray(longitudes, dtype='f8')
+        west, south, east, north = self._extent
+
+        with np.errstate(invalid='ignore'):
+            inside = (lons >= west) & (lons <= east) & (lats >= south) & (lats <= north)
+        x = (lons[inside] - west) / self._sx
+        y = (lats[inside] - south) / self._sy
+
+        if self._kind == 'hex':
+            # Nearest center of each lattice, as matplotlib's hexbin
+            ix1 = np.round(x).astype('int64')
+            iy1 = np.round(y).astype('int64')
+            ix2 = np.minimum(np.floor(x).astype('int64'), self._nx - 1)
+            iy2 = np.minimum(np.floor(y).astype('int64'), self._ny - 1)
+            d1 = (x - ix1) ** 2 + 3. * (y - iy1) ** 2
+            d2 = (x - ix2 - .5) ** 2 + 3. * (y - iy2 - .5) ** 2
+            ids = np.where(d1 < d2,
+                           iy1 * (self._nx + 1) + ix1,
+                           (self._nx + 1) * (self._ny + 1) + iy2 * self._nx + ix2)
+        else:
+            ix = np.minimum(np.floor(x).astype('int64'), self._nx - 1)
+            iy = np.minimum(np.floor(y).astype('int64'), self._ny - 1)
+            ids = iy * self._nx + ix
+
+        cells = np.full(lats.shape, -1, dtype='int64')
+        cells[inside] = ids
+
+        return cells
+
+    def add(self, latitudes, longitudes):
+        """
+        Bin the positions and add them to the counts
+        :param latitudes: decimal degrees latitudes
+        :param longitudes: decimal degrees longitudes
+        :return: number of positions inside the extent
+        """
+        cells = self.cell_ids(latitudes, longitudes)
+        cells = cells[cells >= 0]
+        self._counts += np.bincount(cells, minlength=self._ncells)
+
+        return cells.size
+
+    def add_unique(self, latitudes, longitudes, keys):
+        """
+        Bin the positions and add the number of unique keys in each cell to the counts. Cell ids and keys are combined
+        into a single int64 key so the de-duplication is one sort pass.
+        :param latitudes: decimal degrees latitudes
+        :param longitudes: decimal degrees longitudes
+        :param keys: integer key of each position (i.e.: deployment day)
+        :return: number of unique (cell, key) pairs inside the extent
+        """
+        cells = self.cell_ids(latitudes, longitudes)
+        inside = cells >= 0
+        cells = self._unique_cells(cells[inside], np.asarray(keys, dtype='int64')[inside])
+        self._counts += np.bincount(cells, minlength=self._ncells)
+
+        return cells.size
+
+    def add_counts(self, cells, counts):
+        """
+        Add sparse counts, as returned by track_counts(). Negative counts subtract.
+        :param cells: unique cell ids
+        :param counts: count of each cell
+        """
+        self._counts[cells] += counts
+
+    def track_counts(self, track_df, by='deployment_name'):
+        """
+        Sparse coverage counts of the GPS fixes of a track data frame with columns time, latitude, longitude, for the
+        grid coverage metric. The grid counts are not changed.
+        :param track_df: track data frame for one or more deployments
+        :param by: column identifying the deployment of each fix. If missing, all fixes are from one deployment
+        :return: tuple of sorted unique cell ids and the count of each cell
+        """
+        cells = self.cell_ids(track_df.latitude.to_numpy(), track_df.longitude.to_numpy())
+        inside = cells >= 0
+
+        if self._metric == 'fixes':
+            cells = np.sort(cells[inside])
+        else:
+            if by in track_df:
+                keys = pd.factorize(track_df[by])[0].astype('int64')
+            else:
+                keys = np.zeros(track_df.shape[0], dtype='int64')
+
+            if self._metric == 'glider_days':
+                days = pd.to_datetime(track_df.time).to_numpy(dtype='datetime64[D]').astype('int64')
+                if days.size:
+                    days -= days.min()
+                    keys = keys * (days.max() + 1) + days
+
+            cells = self._unique_cells(cells[inside], keys[inside])
+
+        if not cells.size:
+            return cells, np.zeros(0, dtype='int64')
+
+        # Run lengths of the sorted cell ids
+        starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+
+        return cells[starts], np.diff(np.append(starts, cells.size))
+
+    def add_track(self, track_df, by='deployment_name'):
+        """
+        Bin the GPS fixes of a track data frame with columns time, latitude, longitude and add them to the counts of
+        the grid coverage metric
+        :param track_df: track data frame for one or more deployments
+        :param by: column identifying the deployment of each fix. If missing, all fixes are from one deployment
+        :return: number of fixes (fixes), unique cell deployment days (glider_days) or unique cell deployments
+            (deployments) added
+        """
+        cells, counts = self.track_counts(track_df, by=by)
+        self.add_counts(cells, counts)
+
+        return int(counts.sum())
+
+    def _unique_cells(self, cells, keys):
+        """
+        Sorted cell ids, once for each unique (cell, key) pair
+        """
+        if not cells.size:
+            return cells
+
+        k0 = keys.min()
+        nkeys = int(keys.max() - k0) + 1
+        if self._ncells * nkeys < 2 ** 62:
+            pairs = np.sort(cells * nkeys + (keys - k0))
+            return pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))] // nkeys
+
+        order = np.lexsort((keys, cells))
+        cells = cells[order]
+        keys = keys[order]
+
+        return cells[np.concatenate(([True], (cells[1:] != cells[:-1]) | (keys[1:] != keys[:-1])))]
+
+    def merge(self, other):
+        """
+        Add the counts of a grid with the same definition
+        :param other: CoverageGrid
+        :return: self
+        """
+        if not self.compatible(other):
+            raise ValueError('Cannot merge {:} into {:}'.format(other, self))
+        self._counts += other.counts
+
+        return self
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def centers(self):
+        """
+        Cell center positions
+        :return: tuple of longitude and latitude arrays of size ncells, in cell id order
+        """
+        west, south = self._extent[:2]
+        if self._kind == 'hex':
+            lon1, lat1 = np.meshgrid(np.arange(self._nx + 1) * self._sx, np.arange(self._ny + 1) * self._sy)
+            lon2, lat2 = np.meshgrid((np.arange(self._nx) + .5) * self._sx, (np.arange(self._ny) + .5) * self._sy)
+            lons = np.concatenate((lon1.ravel(), lon2.ravel()))
+            lats = np.concatenate((lat1.ravel(), lat2.ravel()))
+        else:
+            lons, lats = np.meshgrid((np.arange(self._nx) + .5) * self._sx, (np.arange(self._ny) + .5) * self._sy)
+            lons = lons.ravel()
+            lats = lats.ravel()
+
+        return west + lons, south + lats
+
+    def cell_vertices(self):
+        """
+        Vertex offsets, in decimal degrees, of a cell from its center
+        :return: array of (longitude, latitude) offsets
+        """
+        if self._kind == 'hex':
+            return np.array([self._sx, self._sy / 3.]) * np.array([[.5, -.5], [.5, .5], [0., 1.], [-.5, .5],
+                                                                   [-.5, -.5], [0., -1.]])
+
+        return np.array([self._sx, self._sy]) * np.array([[-.5, -.5], [.5, -.5], [.5, .5], [-.5, .5]])
+
+    def to_frame(self, mincount=1):
+        """
+        Cells with counts
+        :param mincount: minimum count
+        :return: data frame of cell, longitude, latitude and count
+        """
+        cells = np.flatnonzero(self._counts >= max(mincount, 1))
+        lons, lats = self.centers()
+
+        return pd.DataFrame({'cell': cells,
+                             'longitude': lons[cells],
+                             'latitude': lats[cells],
+                             'count': self._counts[cells]})
+
+    def save(self, npz_file):
+        """
+        Write the grid definition and counts to a compressed NumPy .npz file
+        :param npz_file: file name
+        """
+        np.savez_compressed(npz_file, kind=self._kind, extent=np.array(self._extent), resolution=self._resolution,
+                            metric=self._metric, counts=self._counts)
+
+    @classmethod
+    def load(cls, npz_file):
+        """
+        Read a grid written with save()
+        :param npz_file: file name
+        :return: CoverageGrid
+        """
+        with np.load(npz_file) as npz:
+            return cls(extent=tuple(npz['extent'].tolist()), resolution=float(npz['resolution']),
+                       kind=str(npz['kind']), counts=npz['counts'],
+                       metric=str(npz['metric']) if 'metric' in npz else 'fixes')
 
-    return track_df.groupby(lambda x: x.date).agg({'latitude': 'mean', 'longitude': 'mean'}).reset_index().rename(
-        columns={'index': 'time'})
+    def __repr__(self):
+        return '<CoverageGrid(kind={:}, metric={:}, extent={:}, resolution={:}, cells={:}, total={:})>'.format(
+            self._kind, self._metric, self._extent, self._resolution, self._ncells, self.total)
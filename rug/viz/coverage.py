@@ -0,0 +1,40 @@
+import logging
+import numpy as np
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import LogNorm, Normalize
+
+logging.getLogger(__file__)
+
+
+def plot_coverage(ax, grid, mincount=1, log_scale=False, vmin=None, vmax=None, cmap='viridis', alpha=1.,
+                  transform=None):
+    """
+    Draw the cells of a rug.geo.CoverageGrid, colored by count, as a single PolyCollection
+    :param ax: matplotlib (or cartopy GeoAxes) axes
+    :param grid: rug.geo.CoverageGrid
+    :param mincount: minimum count of the cells drawn
+    :param log_scale: True to color the counts on a log scale
+    :param vmin: colormap minimum
+    :param vmax: colormap maximum
+    :param cmap: matplotlib colormap or colormap name
+    :param alpha: cell opacity
+    :param transform: coordinate transform of the cell vertices (i.e.: cartopy.crs.PlateCarree())
+    :return: PolyCollection, for use with colorbar
+    """
+    cells = grid.to_frame(mincount=mincount)
+    logging.debug('Drawing {:} coverage cells'.format(cells.shape[0]))
+
+    centers = cells[['longitude', 'latitude']].to_numpy()
+    polygons = centers[:, np.newaxis, :] + grid.cell_vertices()[np.newaxis, :, :]
+
+    norm = LogNorm(vmin=vmin, vmax=vmax) if log_scale else Normalize(vmin=vmin, vmax=vmax)
+
+    kwargs = {}
+    if transform is not None:
+        kwargs['transform'] = transform
+
+    collection = PolyCollection(polygons, array=cells['count'].to_numpy(), cmap=cmap, norm=norm, alpha=alpha,
+                                edgecolors='face', linewidths=0.5, **kwargs)
+    ax.add_collection(collection)
+
+    return collection
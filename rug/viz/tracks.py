@@ -0,0 +1,83 @@
+import logging
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+
+logging.getLogger(__file__)
+
+
+def plot_tracks(ax, tracks, colors, linewidth=1., linestyle='-', transform=None, decimate=True, dpi=None):
+    """
+    Draw many GPS tracks as a single LineCollection. All tracks are projected to the map coordinates in one
+    transform_points call, consecutive fixes that fall in the same output pixel are dropped and each track is broken
+    where it jumps across the map (i.e.: the dateline) or has missing positions. Set the map extent before calling so
+    the pixel size is known.
+    :param ax: matplotlib (or cartopy GeoAxes) axes
+    :param tracks: list of track data frames with columns longitude, latitude, in plotting order
+    :param colors: single color or one color per track
+    :param linewidth: track line width
+    :param linestyle: track line style
+    :param transform: coordinate system of the GPS positions (i.e.: cartopy.crs.PlateCarree()). Positions are
+        projected to the axes projection of a cartopy GeoAxes
+    :param decimate: False to draw every fix
+    :param dpi: resolution of the rendered output. Defaults to the figure dpi
+    :return: LineCollection
+    """
+    colors = to_rgba_array(colors)
+    if colors.shape[0] == 1:
+        colors = np.repeat(colors, len(tracks), axis=0)
+    elif colors.shape[0] != len(tracks):
+        raise ValueError('colors must be a single color or one color per track')
+
+    sizes = np.array([t.shape[0] for t in tracks], dtype='int64')
+    lons = np.concatenate([t.longitude.to_numpy(dtype='f8') for t in tracks] + [np.zeros(0)])
+    lats = np.concatenate([t.latitude.to_numpy(dtype='f8') for t in tracks] + [np.zeros(0)])
+    track_ids = np.repeat(np.arange(len(tracks)), sizes)
+
+    # Project all positions at once
+    projection = getattr(ax, 'projection', None)
+    max_jump = None
+    if transform is not None and projection is not None:
+        xy = projection.transform_points(transform, lons, lats)[:, :2]
+        # Jumps of more than half the map width wrap around the projection
+        max_jump = .5 * abs(projection.x_limits[1] - projection.x_limits[0])
+    else:
+        xy = np.column_stack((lons, lats))
+
+    # Start a new line at each track, after missing or unprojectable positions and at wrapping jumps
+    finite = np.isfinite(xy).all(axis=1)
+    new_line = np.ones(xy.shape[0], dtype=bool)
+    new_line[1:] = (track_ids[1:] != track_ids[:-1]) | ~finite[:-1]
+    if max_jump is not None:
+        with np.errstate(invalid='ignore'):
+            new_line[1:] |= np.abs(np.diff(xy[:, 0])) > max_jump
+
+    xy = xy[finite]
+    track_ids = track_ids[finite]
+    new_line = new_line[finite]
+
+    if decimate and xy.shape[0]:
+        # Keep the first fix of each output pixel run and the last fix of each line
+        scale = (dpi or ax.figure.dpi) / ax.figure.dpi
+        pixels = np.floor(ax.transData.transform(xy) * scale)
+        keep = np.ones(xy.shape[0], dtype=bool)
+        keep[1:] = (pixels[1:] != pixels[:-1]).any(axis=1) | new_line[1:]
+        keep[:-1] |= new_line[1:]
+        logging.debug('Decimated {:} GPS fixes to {:} pixel positions'.format(xy.shape[0], keep.sum()))
+        xy = xy[keep]
+        track_ids = track_ids[keep]
+        new_line = new_line[keep]
+
+    starts = np.flatnonzero(new_line)
+    lines = np.split(xy, starts[1:]) if starts.size else []
+    line_tracks = track_ids[starts]
+
+    # Single positions draw nothing
+    drawn = np.array([line.shape[0] > 1 for line in lines], dtype=bool)
+    lines = [line for line, d in zip(lines, drawn) if d]
+
+    collection = LineCollection(lines, colors=colors[line_tracks[drawn]] if lines else colors[:0],
+                                linewidths=linewidth, linestyles=linestyle)
+    ax.add_collection(collection, autolim=False)
+
+    return collection
@@ -7,9 +7,11 @@ import os
 import tabulate
 import pandas as pd
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from jinja2 import Template
-from rug.api import get_deployments_by_name
-from rug.geo import fetch_track_to_df, average_daily_track_gps, latlon_to_geojson_track
+from rug.api import lookup_deployments, add_client_arguments, client_from_args
+from rug.db import add_track_store_argument, track_store_from_args
+from rug.geo import fetch_track_to_df, resample_track, simplify_track, iter_geojson_tracks
 
 
 def main(args):
@@ -20,10 +22,17 @@ def main(args):
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
     logging.basicConfig(format=log_format, level=log_level)
 
+    client_from_args(args)
+    store = track_store_from_args(args)
+
     deployment_names = args.deployment_names
     debug = args.debug
+    workers = args.workers
+    tolerance = args.tolerance
+    simplify_units = args.simplify_units
 #    glider = args.glider
-    daily = args.daily
+    interval = args.interval or ('1D' if args.daily else None)
+    aggregation = args.aggregation
     table_format = args.format
 #    start_date = args.start_date
 #    end_date = args.end_date
@@ -63,7 +72,14 @@ def main(args):
 #            logging.error('Error parsing end date: {:}'.format(end_date))
 #            return 1
 
-    deployments = get_deployments_by_name(deployment_names)
+    deployments, lookup = lookup_deployments(deployment_names, max_workers=workers)
+    if lookup.missing:
+        logging.warning('{:} deployment(s) not found: {:}'.format(len(lookup.missing), ', '.join(lookup.missing)))
+    if lookup.duplicated:
+        logging.warning('{:} deployment(s) with multiple records: {:}'.format(len(lookup.duplicated),
+                                                                             ', '.join(lookup.duplicated)))
+    if lookup.failed:
+        logging.error('{:} deployment(s) failed to fetch: {:}'.format(len(lookup.failed), ', '.join(lookup.failed)))
 
 #    if all:
 #        logging.info('Selecting all deployments')
@@ -121,26 +137,36 @@ def main(args):
         return 1
 
     logging.info('Preparing {:} tracks for kml...'.format(deployments.shape[0]))
-    if daily:
-        logging.info('Creating daily averaged GPS positions for all tracks')
+    if interval:
+        logging.info('Resampling all tracks to {:} {:} GPS positions'.format(interval, aggregation))
+    if tolerance:
+        logging.info('Simplifying all tracks to within {:} {:}'.format(tolerance, simplify_units))
 
-    # Create the geojson feature collections and write the kml
-    tracks = []
-    for deployment_name, row in deployments.iterrows():
+    # Fetch the tracks concurrently
+    def fetch(deployment):
+        deployment_name, end_date = deployment
+        return fetch_track_to_df(deployment_name, recovered=not pd.isna(end_date), store=store)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        gps_tracks = list(executor.map(fetch, zip(deployments.index, deployments.end_date)))
+
+    gps_frames = []
+    properties = {}
+    for (deployment_name, row), gps in zip(deployments.iterrows(), gps_tracks):
 
-        gps = fetch_track_to_df(deployment_name)
         if gps.empty:
             logging.warning('No GPS track found for {:}'.format(deployment_name))
+            continue
 
-        gps.sort_values('time', inplace=True, ascending=True)
+        gps = gps.sort_values('time', ascending=True)
 
-        if daily:
-            gps = average_daily_track_gps(gps)
+        if interval:
+            gps = resample_track(gps, interval=interval, how=aggregation)
 
-        track = latlon_to_geojson_track(gps.latitude, gps.longitude, gps.time, include_points=False)
-        if not track:
-            logging.warning('Error creating track FeatureCollection: {:}'.format(deployment_name))
-            continue
+        if tolerance:
+            gps = simplify_track(gps, tolerance, units=simplify_units)
+
+        gps_frames.append(gps.assign(deployment_name=deployment_name))
 
         # Calculate the number of days and deployment status
         t_delta = datetime.datetime.now() - row.start_date
@@ -151,18 +177,20 @@ def main(args):
             status = 'Recovered'
             dt1 = row.end_date
 
-        deployment_props = {'deployment': deployment_name,
-                            'status': status,
-                            'glider': row.glider,
-                            'project': row.project_name,
-                            'start_date': row.start_date,
-                            'end_date': dt1,
-                            'distance': '{:} km'.format(row.distance_flown_km),
-                            'days': t_delta.days}
-
-        track['features'][0]['properties'] = deployment_props
+        properties[deployment_name] = {'deployment': deployment_name,
+                                       'status': status,
+                                       'glider': row.glider,
+                                       'project': row.project_name,
+                                       'start_date': row.start_date,
+                                       'end_date': dt1,
+                                       'distance': '{:} km'.format(row.distance_flown_km),
+                                       'days': t_delta.days}
 
-        tracks.append(track)
+    # Create the geojson feature collections for all tracks at once and write the kml
+    tracks = []
+    if gps_frames:
+        tracks = [track for deployment_name, track in iter_geojson_tracks(pd.concat(gps_frames, ignore_index=True),
+                                                                          properties=properties)]
 
     if not tracks:
         logging.error('There are no tracks for kml creation')
@@ -196,9 +224,18 @@ if __name__ == '__main__':
                             default='RUCOOL Glider Deployments')
 
     arg_parser.add_argument('-d', '--daily',
-                            help='Average fixes for one point per day',
+                            help='Average fixes for one point per day. Same as --interval 1D',
                             action='store_true')
 
+    arg_parser.add_argument('--interval',
+                            help='Resample each track to one point per interval (i.e.: 1h, 6h, 1D, 7D)',
+                            type=str)
+
+    arg_parser.add_argument('--aggregation',
+                            help='Resampled position in each interval',
+                            choices=['mean', 'median', 'first', 'last'],
+                            default='mean')
+
     arg_parser.add_argument('-f', '--format',
                             help='Pretty print the results using a tabulate format',
                             type=str,
@@ -245,10 +282,24 @@ if __name__ == '__main__':
 #                            action='store_true',
 #                            help='Select all deployments regardless of status (active or recovered)')
 
+    arg_parser.add_argument('--simplify',
+                            dest='tolerance',
+                            help='Simplify each track, keeping the GPS fixes needed to stay within this distance of '
+                                 'the original track',
+                            type=float)
+
+    arg_parser.add_argument('--simplify_units',
+                            help='Track simplification tolerance units',
+                            choices=['m', 'degrees'],
+                            default='m')
+
     arg_parser.add_argument('-x', '--debug',
                             help='Debug mode. No operations performed',
                             action='store_true')
 
+    add_client_arguments(arg_parser, workers_help='Maximum number of concurrent deployment requests')
+    add_track_store_argument(arg_parser)
+
     arg_parser.add_argument('-l', '--loglevel',
                             help='Verbosity level',
                             type=str,
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import sys
+import tabulate
+from rug.api.cache import ResponseCache, DEFAULT_CACHE_DIR
+
+
+def main(args):
+    """Inspect or clear the on-disk RU-COOL Gliders API response cache"""
+
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    logging.basicConfig(format=log_format, level=log_level)
+
+    cache_dir = args.cache_dir
+    clear = args.clear
+    end_point = args.end_point
+    table_format = args.format
+
+    cache = ResponseCache(cache_dir)
+
+    if clear:
+        if end_point:
+            logging.info('Clearing cached {:} responses'.format(end_point))
+        else:
+            logging.info('Clearing all cached responses')
+        count = cache.clear(end_point=end_point)
+        logging.info('Removed {:} cached responses'.format(count))
+        return 0
+
+    info = cache.info()
+    if end_point:
+        info = info[info.end_point == end_point]
+
+    sys.stdout.write('{:}\n'.format(tabulate.tabulate(info, tablefmt=table_format, headers='keys', showindex=False)))
+    logging.info('{:} cached responses ({:.1f} MB of {:.1f} MB)'.format(info.shape[0],
+                                                                      info['size'].sum() / 1024 ** 2,
+                                                                      cache.max_bytes / 1024 ** 2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=main.__doc__,
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    arg_parser.add_argument('-d', '--cache_dir',
+                            help='Response cache directory',
+                            default=DEFAULT_CACHE_DIR)
+
+    arg_parser.add_argument('-e', '--end_point',
+                            help='Only show or clear responses for this end point (i.e.: TRACKS)',
+                            type=str)
+
+    arg_parser.add_argument('--clear',
+                            help='Remove the cached responses',
+                            action='store_true')
+
+    arg_parser.add_argument('-f', '--format',
+                            help='Pretty print the results using a tabulate format',
+                            type=str,
+                            choices=tabulate.tabulate_formats,
+                            default='psql')
+
+    arg_parser.add_argument('-l', '--loglevel',
+                            help='Verbosity level',
+                            type=str,
+                            choices=['debug', 'info', 'warning', 'error', 'critical'],
+                            default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import os
+import sys
+import tabulate
+from rug.db import CoverageRaster
+
+
+def main(args):
+    """Inspect, merge or subtract deployments from a persistent RU-COOL glider coverage raster written by
+    map_hexbin_coverage.py --raster"""
+
+    log_level = getattr(logging, args.loglevel.upper())
+    log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
+    logging.basicConfig(format=log_format, level=log_level)
+
+    raster_file = args.raster_file
+    merge_files = args.merge_files
+    deployment_names = args.deployment_names
+    output_file = args.output_file or raster_file
+    table_format = args.format
+
+    if not os.path.isfile(raster_file):
+        logging.error('Coverage raster not found: {:}'.format(raster_file))
+        return 1
+
+    raster = CoverageRaster.load(raster_file)
+    logging.info('Loaded {:}'.format(raster))
+
+    if merge_files or deployment_names:
+
+        for merge_file in merge_files:
+            other = CoverageRaster.load(merge_file)
+            try:
+                count = raster.merge(other)
+            except ValueError as e:
+                logging.error('Error merging {:} ({:})'.format(merge_file, e))
+                return 1
+            logging.info('Merged {:} of {:} deployment coverages from {:}'.format(count, len(other), merge_file))
+
+        for deployment_name in deployment_names:
+            if raster.subtract(deployment_name):
+                logging.info('Subtracted {:}'.format(deployment_name))
+            else:
+                logging.warning('{:} does not contribute to the coverage'.format(deployment_name))
+
+        logging.info('Writing {:} to {:}'.format(raster, output_file))
+        raster.save(output_file)
+
+        return 0
+
+    sys.stdout.write('{:}\n'.format(tabulate.tabulate(raster.to_frame(), tablefmt=table_format, headers='keys')))
+
+    return 0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=main.__doc__,
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    arg_parser.add_argument('raster_file',
+                            help='Coverage raster (.npz) file')
+
+    arg_parser.add_argument('-m', '--merge',
+                            dest='merge_files',
+                            help='Merge the coverage rasters written by other processes. Deployments in more than one '
+                                 'raster keep the coverage binned with the latest GPS fix',
+                            nargs='+',
+                            default=[])
+
+    arg_parser.add_argument('-s', '--subtract',
+                            dest='deployment_names',
+                            help='Subtract the coverage of one or more deployments',
+                            nargs='+',
+                            default=[])
+
+    arg_parser.add_argument('-o', '--output',
+                            dest='output_file',
+                            help='Write the merged or subtracted raster to this file instead of replacing raster_file',
+                            type=str)
+
+    arg_parser.add_argument('-f', '--format',
+                            help='Pretty print the results using a tabulate format',
+                            type=str,
+                            choices=tabulate.tabulate_formats,
+                            default='psql')
+
+    arg_parser.add_argument('-l', '--loglevel',
+                            help='Verbosity level',
+                            type=str,
+                            choices=['debug', 'info', 'warning', 'error', 'critical'],
+                            default='info')
+
+    parsed_args = arg_parser.parse_args()
+
+    sys.exit(main(parsed_args))
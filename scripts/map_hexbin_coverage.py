@@ -4,14 +4,25 @@ import logging
 import argparse
 import sys
 import os
+import time
 import pandas as pd
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 from cartopy.mpl import ticker
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser
-from rug.api import get_all_deployments, df2geodf
-from rug.geo import locate_datasets, fetch_track_to_df
+from rug.api import search_deployments, df2geodf, add_client_arguments, client_from_args
+from rug.api.query import DeploymentQuery
+from rug.db import CoverageRaster, add_track_store_argument, track_store_from_args
+from rug.geo import locate_datasets, fetch_track_to_df, CoverageGrid, COVERAGE_METRICS
+from rug.viz.coverage import plot_coverage
+
+
+# Colorbar labels of the coverage metrics
+METRIC_LABELS = {'fixes': 'Total GPS Fixes',
+                 'glider_days': 'Glider Days',
+                 'deployments': 'Deployments'}
 
 
 def main(args):
@@ -21,8 +32,13 @@ def main(args):
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
     logging.basicConfig(format=log_format, level=log_level)
 
+    client_from_args(args)
+    store = track_store_from_args(args)
+
     glider = args.glider
     project_name = args.project_name
+    exact = args.exact
+    pushdown = args.pushdown
     start_date = args.start_date
     end_date = args.end_date
     add_geometries = False
@@ -37,7 +53,15 @@ def main(args):
                          'pdf',
                          'svg']
     dpi = args.dpi
+    workers = args.workers
+    intersect_tracks = args.intersect_tracks
     gridsize = args.gridsize
+    grid_kind = args.grid
+    metric = args.metric
+    resolution = args.resolution
+    coverage_file = args.coverage_file
+    save_coverage = args.save_coverage
+    raster_file = args.raster_file
     # Cartopy mapping args
     central_longitude = 0.
     projection = args.projection
@@ -103,63 +127,106 @@ def main(args):
             logging.error('Error parsing end date {:} ({:})'.format(end_date, e))
             return 1
 
-    logging.info('Selecting all deployments')
-    deployments = get_all_deployments()
-
-    # Further filter the results
-    if glider:
-        logging.info('Finding deployments matching glider: {:}'.format(glider))
-        deployments = deployments[deployments.glider.str.match(glider)]
-
-    if project_name:
-        logging.info('Finding deployments with project name: {:}'.format(project_name))
-        deployments = deployments[deployments.project_name.str.contains(project_name, case=False)]
-
-    if dt0:
-        logging.info('Finding deployments starting on or after {:}'.format(dt0))
-        deployments = deployments[deployments.start_date >= dt0]
-
-    if dt1:
-        logging.info('Finding deployments ending on or before {:}'.format(dt1))
-        deployments = deployments[deployments.start_date <= dt1]
-
-    # After filtering, add the geometries
-    if add_geometries:
-
-        if north is None:
-            north = 90.
-        if south is None:
-            south = -90.
-        if east is None:
-            east = 180.
-        if west is None:
-            west = -179.9
-
-        logging.info('Adding geometries to filtered deployments for bounding box search...(Patience please)')
-        deployments = df2geodf(deployments)
-
-        logging.info('Searching bounding box {}N, {}S, {}E, {}W'.format(north, south, east, west))
-        # Find the data sets that are within the specified bounding box
-        deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west)
-
-    # Add the tracks for all selected deployments
-    tracks = pd.DataFrame()
-    logging.info('Fetching deployment tracks...')
-    now_dt = pd.to_datetime('now')
-    for deployment, row in deployments.iterrows():
-        logging.info('Adding {:} track'.format(deployment))
-
-        track = fetch_track_to_df(deployment)
-
-        track['deployment'] = deployment
+    if north is None:
+        north = 90.
+    if south is None:
+        south = -90.
+    if east is None:
+        east = 180.
+    if west is None:
+        west = -179.9
+
+    deployments = None
+    if coverage_file:
+        # Render a saved coverage grid without searching or binning
+        logging.info('Loading coverage grid: {:}'.format(coverage_file))
+        grid = CoverageGrid.load(coverage_file)
+        logging.info('Loaded {:}'.format(grid))
+        west, south, east, north = grid.extent
+    else:
+        query = DeploymentQuery(glider=glider,
+                                project_name=project_name,
+                                start_date=dt0,
+                                end_date=dt1,
+                                exact=exact)
+        logging.info('Searching deployments: {:}'.format(query))
+        deployments = search_deployments(query, pushdown=pushdown)
+        if deployments.empty:
+            logging.warning('No deployments found for the specified search criteria')
+            return 1
 
-        tracks = pd.concat([tracks, track])
+        # After filtering, add the geometries
+        if add_geometries:
+
+            logging.info('Adding geometries to filtered deployments for bounding box search...')
+            deployments = df2geodf(deployments, max_workers=workers)
+
+            logging.info('Searching bounding box {}N, {}S, {}E, {}W'.format(north, south, east, west))
+            # Find the data sets that are within the specified bounding box
+            deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west,
+                                          exact=intersect_tracks, max_workers=workers, store=store)
+
+        active = deployments.end_date.isna()
+
+        if raster_file:
+            # Accumulate the coverage in a persistent raster, binning only new deployments and active deployments
+            # with new fixes
+            if os.path.isfile(raster_file):
+                logging.info('Loading coverage raster: {:}'.format(raster_file))
+                raster = CoverageRaster.load(raster_file)
+            else:
+                raster = CoverageRaster(extent=(west, south, east, north),
+                                        resolution=resolution or (east - west) / gridsize,
+                                        kind=grid_kind, metric=metric)
+            logging.info('Updating {:}'.format(raster))
+
+            t0 = time.perf_counter()
+            updated = raster.sync(deployments, max_workers=workers, store=store)
+            logging.info('Updated {:} of {:} deployment coverages in {:0.1f} seconds'.format(
+                sum([bool(u) for u in updated.values()]), deployments.shape[0], time.perf_counter() - t0))
+
+            logging.info('Writing coverage raster: {:}'.format(raster_file))
+            raster.save(raster_file)
+
+            grid = raster.grid
+            west, south, east, north = grid.extent
+        else:
+            # Each worker fetches and bins one track and returns its sparse cell counts, so at most --workers tracks
+            # are held in memory at a time
+            grid = CoverageGrid(extent=(west, south, east, north), resolution=resolution or (east - west) / gridsize,
+                                kind=grid_kind, metric=metric)
+
+            def bin_track(deployment):
+                deployment_name, recovered = deployment
+                track = fetch_track_to_df(deployment_name, recovered=recovered, store=store)
+                if track.empty:
+                    logging.warning('No GPS track found for {:}'.format(deployment_name))
+                    return 0, None
+
+                logging.debug('Binning {:} track ({:} GPS fixes)'.format(deployment_name, track.shape[0]))
+                return track.shape[0], grid.track_counts(track)
+
+            logging.info('Fetching {:} deployment tracks...'.format(deployments.shape[0]))
+            num_fixes = 0
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                for fixes, counts in executor.map(bin_track, zip(deployments.index, ~active.to_numpy())):
+                    if counts is None:
+                        continue
+                    num_fixes += fixes
+                    grid.add_counts(*counts)
+
+            elapsed = time.perf_counter() - t0
+            logging.info('Loaded {:} GPS fixes in {:0.1f} seconds ({:0.0f} fixes/sec)'.format(
+                num_fixes, elapsed, num_fixes / max(elapsed, 1e-9)))
+        logging.info('Binned {:}'.format(grid))
 
         # Update the end_date for all active deployments
-        if pd.isna(row.end_date):
-            deployments.loc[deployment, 'end_date'] = now_dt
+        deployments.loc[active, 'end_date'] = pd.to_datetime('now')
 
-    tracks = tracks.set_index('deployment')
+        if save_coverage:
+            logging.info('Writing coverage grid: {:}'.format(save_coverage))
+            grid.save(save_coverage)
 
     # bbox format: [S, W, N, E]
     bbox = [west - gps_padding,
@@ -201,30 +268,17 @@ def main(args):
     map_ax.add_feature(lakes,
                        zorder=2)
 
-    # Plot the hexbins
-    if log_scale:
-        logging.info('Plotting hexbins using log scaling')
-        # Plot results on log scale
-        c = map_ax.hexbin(tracks.longitude, tracks.latitude,
-                          gridsize=gridsize,
-                          cmap=cmap,
-                          transform=ccrs.PlateCarree(),
-                          alpha=opacity,
-                          bins='log',
-                          mincnt=mincount,
-                          vmin=vmin,
-                          vmax=vmax)
-    else:
-        logging.info('Plotting hexbins using linear scale')
-        # Plot results using vmin, vmax and mincount
-        c = map_ax.hexbin(tracks.longitude, tracks.latitude,
-                          gridsize=gridsize,
-                          cmap=cmap,
-                          transform=ccrs.PlateCarree(),
-                          alpha=opacity,
-                          mincnt=mincount,
-                          vmin=vmin,
-                          vmax=vmax)
+    # Plot the coverage cells
+    logging.info('Plotting {:} {:} coverage using {:} scale'.format(grid.kind, grid.metric,
+                                                                    'log' if log_scale else 'linear'))
+    c = plot_coverage(map_ax, grid,
+                      mincount=mincount,
+                      log_scale=log_scale,
+                      vmin=vmin,
+                      vmax=vmax,
+                      cmap=cmap,
+                      alpha=opacity,
+                      transform=ccrs.PlateCarree())
 
     lat_locator = ticker.LatitudeLocator()
     lon_locator = ticker.LongitudeLocator()
@@ -256,13 +310,16 @@ def main(args):
     cb = map_fig.colorbar(c, ax=map_ax, shrink=0.8, orientation='vertical')
     # Title the colorbar
     if log_scale:
-        cb.set_label('Total GPS Fixes (log scale)')
+        cb.set_label('{:} (log scale)'.format(METRIC_LABELS[grid.metric]))
     else:
-        cb.set_label('Total GPS Fixes (linear scale)')
+        cb.set_label('{:} (linear scale)'.format(METRIC_LABELS[grid.metric]))
 
     # Title the figure
-    dt_string = '{:} - {:}'.format(deployments.end_date.min().strftime('%Y-%m-%d'), deployments.end_date.max().strftime('%Y-%m-%d'))
-    map_ax.set_title('RU-COOL Glider Coverage: {:}'.format(dt_string))
+    if deployments is not None:
+        dt_string = '{:} - {:}'.format(deployments.end_date.min().strftime('%Y-%m-%d'), deployments.end_date.max().strftime('%Y-%m-%d'))
+        map_ax.set_title('RU-COOL Glider Coverage: {:}'.format(dt_string))
+    else:
+        map_ax.set_title('RU-COOL Glider Coverage')
 
     if img_name:
         logging.info('Writing image: {:}'.format(img_name))
@@ -284,6 +341,16 @@ if __name__ == '__main__':
                             help='Search data sets for the specified project name',
                             dest='project_name')
 
+    arg_parser.add_argument('--exact',
+                            help='Glider and project names are complete names',
+                            action='store_true')
+
+    arg_parser.add_argument('--pushdown',
+                            help='Push the search down to the API with the undocumented glider, project and year '
+                                 'query parameters instead of filtering all deployments locally. Glider and project '
+                                 'names are only pushed down with --exact',
+                            action='store_true')
+
     arg_parser.add_argument('-n', '--north',
                             help='Maximum search latitude (-90 to 90)',
                             type=float)
@@ -321,10 +388,45 @@ if __name__ == '__main__':
                             type=str)
 
     arg_parser.add_argument('--gridsize',
-                            help='Number of hexbin grid points',
+                            help='Number of coverage grid cells spanning the longitude range of the bounding box '
+                                 '(-w to -e, global by default). Unlike matplotlib\'s hexbin, the grid does not shrink '
+                                 'to the extent of the GPS fixes, so narrow the bounding box or use --resolution for '
+                                 'finer cells',
                             default=100,
                             type=int)
 
+    arg_parser.add_argument('--grid',
+                            help='Coverage grid cell shape',
+                            choices=['hex', 'rect'],
+                            default='hex')
+
+    arg_parser.add_argument('--metric',
+                            help='Coverage metric of each grid cell: total GPS fixes, unique glider days or unique '
+                                 'deployments',
+                            choices=COVERAGE_METRICS,
+                            default='fixes')
+
+    arg_parser.add_argument('--resolution',
+                            help='Coverage grid cell width, in decimal degrees. Overrides --gridsize',
+                            type=float)
+
+    arg_parser.add_argument('--save_coverage',
+                            help='Write the coverage grid to the specified .npz file',
+                            type=str)
+
+    arg_parser.add_argument('--raster',
+                            dest='raster_file',
+                            help='Accumulate the coverage in the specified persistent coverage raster (.npz), created '
+                                 'if it does not exist. Only new deployments and active deployments with new GPS fixes '
+                                 'are fetched and binned. The grid definition of an existing raster is used',
+                            type=str)
+
+    arg_parser.add_argument('--coverage',
+                            dest='coverage_file',
+                            help='Plot the coverage grid saved in the specified .npz file (--save_coverage) instead of '
+                                 'searching deployments',
+                            type=str)
+
     arg_parser.add_argument('--vmin',
                             help='Colorbar minimum.',
                             type=int,
@@ -369,6 +471,14 @@ if __name__ == '__main__':
                             type=int,
                             default=300)
 
+    arg_parser.add_argument('--intersect_tracks',
+                            help='Select deployments whose GPS track, rather than track bounding box, intersects the '
+                                 'search bounding box. Fetches the track of each deployment in the bounding box',
+                            action='store_true')
+
+    add_client_arguments(arg_parser)
+    add_track_store_argument(arg_parser)
+
     arg_parser.add_argument('-l', '--loglevel',
                             help='Verbosity level',
                             type=str,
@@ -5,12 +5,18 @@ import os
 import argparse
 import logging
 from dateutil import parser
+import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
-from rug.api import get_active_deployments, get_all_deployments, df2geodf
-from rug.geo import locate_datasets, fetch_track_to_df
+from rug.api import get_active_deployments, lookup_deployments, search_deployments, df2geodf
+from rug.api import add_client_arguments, client_from_args
+from rug.api.query import DeploymentQuery
+from rug.db import add_track_store_argument, track_store_from_args
+from rug.geo import locate_datasets, fetch_track_to_df, simplify_track, resample_track
+from rug.viz.tracks import plot_tracks
 
 
 def main(args):
@@ -21,6 +27,9 @@ def main(args):
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
     logging.basicConfig(format=log_format, level=log_level)
 
+    client_from_args(args)
+    store = track_store_from_args(args)
+
     dataset_ids = args.dataset_ids
     exclude_ids = args.exclude or []
     active = args.active
@@ -32,6 +41,14 @@ def main(args):
     east = args.east
     west = args.west
     glider = args.glider
+    exact = args.exact
+    pushdown = args.pushdown
+    workers = args.workers
+    intersect_tracks = args.intersect_tracks
+    tolerance = args.tolerance
+    interval = args.interval
+    aggregation = args.aggregation
+    simplify_units = args.simplify_units
     img_name = args.img_name
     clobber = args.clobber
     valid_image_types = ['png',
@@ -48,10 +65,10 @@ def main(args):
     land_color = "sandybrown"
     ocean_color = cfeature.COLORS['water']  # cfeature.COLORS['water'] is the standard
     track_color = args.track_color
-    marker = 'None'
-    marker_size = 1.0
     linewidth = args.linewidth
     linestyle = '-'
+    decimate = not args.full_resolution
+    dpi = 300
 
     if img_name:
         (img_path, iname) = os.path.split(img_name)
@@ -80,9 +97,6 @@ def main(args):
         logging.info('Selecting active deployments')
         deployments = get_active_deployments()
     else:
-        logging.info('Selecting all deployments')
-        deployments = get_all_deployments()
-
         # Parse start_date if specified
         if start_date:
             try:
@@ -97,35 +111,21 @@ def main(args):
                 logging.error('Error parsing end date{:}: {:}'.format(end_date, e))
 
         if dataset_ids:
-            good_ids = []
-            for dataset_id in dataset_ids:
-                if dataset_id not in deployments.index:
-                    logging.warning('Invalid deployment id: {:}'.format(dataset_id))
-                    continue
-
-                good_ids.append(dataset_id)
-
-            if good_ids:
-                logging.info('Keeping only specified dataset IDs')
-                deployments = deployments.loc[good_ids]
-            else:
+            logging.info('Selecting specified dataset IDs')
+            deployments, lookup = lookup_deployments(dataset_ids, max_workers=workers)
+            for dataset_id in lookup.missing + lookup.duplicated + lookup.failed:
+                logging.warning('Invalid deployment id: {:}'.format(dataset_id))
+
+            if deployments.empty:
                 logging.error('No valid deployment IDs specified')
                 return 1
         else:
-            # Filter by glider
-            if glider:
-                logging.info('Finding deployments matching glider: {:}'.format(glider))
-                deployments = deployments[deployments.glider.str.match(glider)]
-
-            # Filter by start date
-            if dt0:
-                logging.info('Finding deployments starting on or after {:}'.format(dt0))
-                deployments = deployments[deployments.start_date >= dt0]
-
-            # Filter by end date
-            if dt1:
-                logging.info('Finding deployments ending on or before {:}'.format(dt1))
-                deployments = deployments[deployments.start_date <= dt1]
+            query = DeploymentQuery(glider=glider, start_date=dt0, end_date=dt1, exact=exact)
+            logging.info('Searching deployments: {:}'.format(query))
+            deployments = search_deployments(query, pushdown=pushdown)
+            if deployments.empty:
+                logging.warning('No deployments found for the specified search criteria')
+                return 0
 
     if debug:
         logging.info('Debug (-x). Skipping map creation')
@@ -139,8 +139,9 @@ def main(args):
 
     # Add the geometries so that we can do some geometric stuff
     logging.info('Adding geometries to {:} deployments'.format(deployments.shape[0]))
-    deployments = df2geodf(deployments)
-    deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west)
+    deployments = df2geodf(deployments, max_workers=workers)
+    deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west,
+                                  exact=intersect_tracks, max_workers=workers, store=store)
 
     # Remove deployments for which there is no GPS track
     missing_count = deployments.geometry.is_empty.sum()
@@ -193,8 +194,7 @@ def main(args):
     map_ax.add_feature(land,
                        zorder=1)
 
-    cbar = mpl.colormaps['rainbow'].resampled(deployments.shape[0])
-    i = 0
+    tracks = []
     for deployment_name, row in deployments.iterrows():
 
         if deployment_name in exclude_ids:
@@ -203,31 +203,35 @@ def main(args):
 
         logging.info('Fetching {:} track'.format(deployment_name))
 
-        gps = fetch_track_to_df(deployment_name)
+        gps = fetch_track_to_df(deployment_name, recovered=not pd.isna(row.end_date), store=store)
         if gps.empty:
             logging.warning('No GPS track found for {:}'.format(deployment_name))
             continue
 
         track = gps.sort_values('time', ascending=True)
 
-        # Plot the track
-        l_color = cbar(i)
-        if track_color:
-            l_color = track_color
+        if interval:
+            track = resample_track(track, interval=interval, how=aggregation)
+
+        if tolerance:
+            track = simplify_track(track, tolerance, units=simplify_units)
 
-        map_ax.plot(track.longitude, track.latitude,
-                    marker=marker,
-                    markersize=marker_size,
-                    linestyle=linestyle,
-                    linewidth=linewidth,
-                    color=l_color,
-                    transform=ccrs.PlateCarree())
+        tracks.append(track)
 
-        i += 1
+    # Plot all tracks at once
+    cbar = mpl.colormaps['rainbow'].resampled(deployments.shape[0])
+    colors = track_color or cbar(np.arange(len(tracks)))
+    logging.info('Plotting {:} tracks'.format(len(tracks)))
+    plot_tracks(map_ax, tracks, colors,
+                linewidth=linewidth,
+                linestyle=linestyle,
+                transform=ccrs.PlateCarree(),
+                decimate=decimate,
+                dpi=dpi if img_name else None)
 
     if img_name:
         logging.info('Writing image: {:}'.format(img_name))
-        plt.savefig(img_name, dpi=300)
+        plt.savefig(img_name, dpi=dpi)
     else:
         logging.info('Displaying image')
         plt.show()
@@ -297,6 +301,16 @@ if __name__ == '__main__':
                             help='Return data sets with glider call signs starting with the specified string',
                             type=str)
 
+    arg_parser.add_argument('--exact',
+                            help='The glider name is a complete name',
+                            action='store_true')
+
+    arg_parser.add_argument('--pushdown',
+                            help='Push the search down to the API with the undocumented glider, project and year '
+                                 'query parameters instead of filtering all deployments locally. Glider and project '
+                                 'names are only pushed down with --exact',
+                            action='store_true')
+
     arg_parser.add_argument('--color',
                             dest='track_color',
                             help='Specify a single color for all tracks')
@@ -306,6 +320,10 @@ if __name__ == '__main__':
                             type=float,
                             default=2.)
 
+    arg_parser.add_argument('--full_resolution',
+                            help='Draw every GPS fix instead of decimating the tracks to the image resolution',
+                            action='store_true')
+
     arg_parser.add_argument('--global',
                             dest='global_map',
                             help='Set map bounds to global',
@@ -336,6 +354,34 @@ if __name__ == '__main__':
                             help='Debug mode. No operations performed',
                             action='store_true')
 
+    arg_parser.add_argument('--interval',
+                            help='Resample each track to one point per interval (i.e.: 1h, 6h, 1D, 7D)',
+                            type=str)
+
+    arg_parser.add_argument('--aggregation',
+                            help='Resampled position in each interval',
+                            choices=['mean', 'median', 'first', 'last'],
+                            default='mean')
+
+    arg_parser.add_argument('--simplify',
+                            dest='tolerance',
+                            help='Simplify each track, keeping the GPS fixes needed to stay within this distance of '
+                                 'the original track',
+                            type=float)
+
+    arg_parser.add_argument('--simplify_units',
+                            help='Track simplification tolerance units',
+                            choices=['m', 'degrees'],
+                            default='m')
+
+    arg_parser.add_argument('--intersect_tracks',
+                            help='Select deployments whose GPS track, rather than track bounding box, intersects the '
+                                 'search bounding box. Fetches the track of each deployment in the bounding box',
+                            action='store_true')
+
+    add_client_arguments(arg_parser)
+    add_track_store_argument(arg_parser)
+
     arg_parser.add_argument('-l', '--loglevel',
                             help='Verbosity level',
                             type=str,
@@ -6,10 +6,12 @@ import sys
 import tabulate
 import pandas as pd
 import datetime
-import math
+import numpy as np
 from dateutil import parser
-from rug.api import get_active_deployments, get_all_deployments, df2geodf
+from rug.api import search_deployments, df2geodf, add_client_arguments, client_from_args
+from rug.api.query import DeploymentQuery
 from rug.geo import locate_datasets
+from rug.db import DeploymentCatalog, DEFAULT_CATALOG_FILE
 
 
 def main(args):
@@ -19,12 +21,20 @@ def main(args):
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
     logging.basicConfig(format=log_format, level=log_level)
 
+    client_from_args(args)
+
     debug = args.debug
     glider = args.glider
+    workers = args.workers
+    intersect_tracks = args.intersect_tracks
     project_name = args.project_name
     start_date = args.start_date
     end_date = args.end_date
     active = args.active
+    catalog_file = args.catalog_file
+    exact = args.exact
+    pushdown = args.pushdown
+    sync = args.sync
     add_geometries = False
     north = args.north
     south = args.south
@@ -60,36 +70,48 @@ def main(args):
             logging.error('Error parsing end date: {:}'.format(end_date))
             return 1
 
-    if active:
-        logging.info('Selecting active deployments')
-        deployments = get_active_deployments()
-    else:
-        logging.info('Selecting all deployments')
-        deployments = get_all_deployments()
-
-    # Further filter the results
-    if glider:
-        logging.info('Finding deployments matching glider: {:}'.format(glider))
-        deployments = deployments[deployments.glider.str.match(glider)]
+    query = DeploymentQuery(glider=glider,
+                            project_name=project_name,
+                            start_date=dt0,
+                            end_date=dt1,
+                            active=active,
+                            exact=exact)
 
-    if project_name:
-        logging.info('Finding deployments with project name: {:}'.format(project_name))
-        deployments = deployments[deployments.project_name.str.contains(project_name, case=False)]
-
-    if dt0:
-        logging.info('Finding deployments starting on or after {:}'.format(dt0))
-        deployments = deployments[deployments.start_date >= dt0]
+    no_track_count = 0
+    if catalog_file:
+        catalog = DeploymentCatalog(catalog_file)
+        if sync or not len(catalog):
+            logging.info('Syncing deployment catalog {:}'.format(catalog_file))
+            catalog.sync(max_workers=workers)
+        if not len(catalog):
+            logging.error('Deployment catalog is empty: {:}'.format(catalog_file))
+            return 1
+        logging.info('Searching catalog {:}: {:}'.format(catalog_file, query))
+        # The catalog evaluates the indexed predicates and the bounding box. filter() applies the exact name matches
+        # and the glider and project name patterns
+        predicates = query.catalog_predicates()
+        if add_geometries:
+            no_track = query.filter(catalog.deployments(has_track=False, geometry=True, **predicates))
+            no_track_count = no_track.shape[0]
+        if add_geometries and missing:
+            deployments = no_track
+        else:
+            deployments = query.filter(catalog.deployments(north=north, south=south, east=east, west=west,
+                                                           geometry=add_geometries, **predicates))
+    else:
+        logging.info('Searching deployments: {:}'.format(query))
+        deployments = search_deployments(query, pushdown=pushdown)
 
-    if dt1:
-        logging.info('Finding deployments ending on or before {:}'.format(dt1))
-        deployments = deployments[deployments.start_date <= dt1]
+    if deployments.empty:
+        logging.warning('No deployments found for the specified search criteria')
+        return 0
 
     # After filtering, add the geometries
-    no_track_count = 0
     if add_geometries:
-        logging.info('Adding geometries to filtered deployments for bounding box search...')
-        deployments = df2geodf(deployments)
-        no_track_count = deployments[deployments.geometry.is_empty].shape[0]
+        if not catalog_file:
+            logging.info('Adding geometries to filtered deployments for bounding box search...')
+            deployments = df2geodf(deployments, max_workers=workers)
+            no_track_count = deployments[deployments.geometry.is_empty].shape[0]
 
         if missing:
             logging.info('Finding deployments with missing GPS tracks')
@@ -107,22 +129,17 @@ def main(args):
 
             logging.info('Searching bounding box {}N, {}S, {}E, {}W'.format(north, south, east, west))
             # Find the data sets that are within the specified bounding box
-            deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west)
+            deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west,
+                                          exact=intersect_tracks, max_workers=workers)
 
     # Add the days deployed
     now = pd.to_datetime(datetime.datetime.utcnow())
     # Create a tmp_end_date column that has today's date if the deployment(s) are active and do not have an end_date.
     # We'll use this to calculate the number of days deployed.
-    tmp_end_dates = []
-    for id, row in deployments.iterrows():
-        if pd.isnull(row.end_date):
-            tmp_end_dates.append(now)
-        else:
-            tmp_end_dates.append(row.end_date)
-
-    deployments['tmp_end_date'] = tmp_end_dates
+    deployments['tmp_end_date'] = deployments.end_date.fillna(now)
 
-    deployments['days'] = [math.ceil((row.tmp_end_date - row.start_date).total_seconds() / (60*60*24)) for id, row in deployments.iterrows()]
+    deployments['days'] = np.ceil(
+        (deployments.tmp_end_date - deployments.start_date).dt.total_seconds() / (60*60*24)).astype('int64')
     print_columns = ['start_date',
                      'end_date',
                      'days',
@@ -166,6 +183,16 @@ if __name__ == '__main__':
                             help='Search data sets for the specified project name',
                             dest='project_name')
 
+    arg_parser.add_argument('--exact',
+                            help='Glider and project names are complete names',
+                            action='store_true')
+
+    arg_parser.add_argument('--pushdown',
+                            help='Push the search down to the API with the undocumented glider, project and year '
+                                 'query parameters instead of filtering all deployments locally. Glider and project '
+                                 'names are only pushed down with --exact',
+                            action='store_true')
+
     arg_parser.add_argument('-n', '--north',
                             help='Maximum search latitude (-90 to 90)',
                             type=float)
@@ -208,6 +235,23 @@ if __name__ == '__main__':
                             help='Debug mode. No operations performed',
                             action='store_true')
 
+    arg_parser.add_argument('--intersect_tracks',
+                            help='Select deployments whose GPS track, rather than track bounding box, intersects the '
+                                 'search bounding box. Fetches the track of each deployment in the bounding box',
+                            action='store_true')
+
+    arg_parser.add_argument('--catalog',
+                            dest='catalog_file',
+                            help='Search the specified local deployment catalog instead of the API',
+                            nargs='?',
+                            const=DEFAULT_CATALOG_FILE)
+
+    arg_parser.add_argument('--sync',
+                            help='Sync the local deployment catalog (--catalog) with the API before searching',
+                            action='store_true')
+
+    add_client_arguments(arg_parser)
+
     arg_parser.add_argument('-l', '--loglevel',
                             help='Verbosity level',
                             type=str,
@@ -7,11 +7,14 @@ import os
 import tabulate
 import pandas as pd
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import json
 from jinja2 import Template
 from dateutil import parser
 from rug.api import get_active_deployments, get_all_deployments, df2geodf
-from rug.geo import locate_datasets, fetch_track_to_df, average_daily_track_gps, latlon_to_geojson_track
+from rug.api import add_client_arguments, client_from_args
+from rug.db import add_track_store_argument, track_store_from_args
+from rug.geo import locate_datasets, fetch_track_to_df, resample_track, simplify_track, iter_geojson_tracks
 
 
 def main(args):
@@ -22,9 +25,17 @@ def main(args):
     log_format = '%(asctime)s:%(module)s:%(levelname)s:%(message)s [line %(lineno)d]'
     logging.basicConfig(format=log_format, level=log_level)
 
+    client_from_args(args)
+    store = track_store_from_args(args)
+
     debug = args.debug
     glider = args.glider
-    daily = args.daily
+    workers = args.workers
+    intersect_tracks = args.intersect_tracks
+    tolerance = args.tolerance
+    simplify_units = args.simplify_units
+    interval = args.interval or ('1D' if args.daily else None)
+    aggregation = args.aggregation
     start_date = args.start_date
     end_date = args.end_date
     north = args.north
@@ -89,7 +100,7 @@ def main(args):
 
     # After filtering, add the geometries
     logging.info('Adding geometries to filtered deployments...')
-    deployments = df2geodf(deployments)
+    deployments = df2geodf(deployments, max_workers=workers)
 
     no_gps = deployments[deployments.geometry.is_empty]
     logging.warning('Skipping KML creation for {} deployments missing GPS/tracks'.format(no_gps.shape[0]))
@@ -98,7 +109,8 @@ def main(args):
         return 0
 
     # Find the data sets that are within the specified bounding box
-    deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west)
+    deployments = locate_datasets(deployments, north=north, south=south, east=east, west=west,
+                                  exact=intersect_tracks, max_workers=workers, store=store)
 
     # If debug (-x), print the selected deployments but do not write the kml
     if debug:
@@ -126,26 +138,36 @@ def main(args):
         return 1
 
     logging.info('Preparing {:} tracks for kml...'.format(deployments.shape[0]))
-    if daily:
-        logging.info('Creating daily averaged GPS positions for all tracks')
+    if interval:
+        logging.info('Resampling all tracks to {:} {:} GPS positions'.format(interval, aggregation))
+    if tolerance:
+        logging.info('Simplifying all tracks to within {:} {:}'.format(tolerance, simplify_units))
 
-    # Create the geojson feature collections and write the kml
-    tracks = []
-    for deployment_name, row in deployments.iterrows():
+    # Fetch the tracks concurrently
+    def fetch(deployment):
+        deployment_name, end_date = deployment
+        return fetch_track_to_df(deployment_name, recovered=not pd.isna(end_date), store=store)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        gps_tracks = list(executor.map(fetch, zip(deployments.index, deployments.end_date)))
+
+    gps_frames = []
+    properties = {}
+    for (deployment_name, row), gps in zip(deployments.iterrows(), gps_tracks):
 
-        gps = fetch_track_to_df(deployment_name)
         if gps.empty:
             logging.warning('No GPS track found for {:}'.format(deployment_name))
+            continue
 
-        gps.sort_values('time', inplace=True, ascending=True)
+        gps = gps.sort_values('time', ascending=True)
 
-        if daily:
-            gps = average_daily_track_gps(gps)
+        if interval:
+            gps = resample_track(gps, interval=interval, how=aggregation)
 
-        track = latlon_to_geojson_track(gps.latitude, gps.longitude, gps.time, include_points=False)
-        if not track:
-            logging.warning('Error creating track FeatureCollection: {:}'.format(deployment_name))
-            continue
+        if tolerance:
+            gps = simplify_track(gps, tolerance, units=simplify_units)
+
+        gps_frames.append(gps.assign(deployment_name=deployment_name))
 
         # Calculate the number of days and deployment status
         t_delta = datetime.datetime.now() - row.start_date
@@ -156,18 +178,20 @@ def main(args):
             status = 'Recovered'
             dt1 = row.end_date
 
-        deployment_props = {'deployment': deployment_name,
-                            'status': status,
-                            'glider': row.glider,
-                            'project': row.project_name,
-                            'start_date': row.start_date,
-                            'end_date': dt1,
-                            'distance': '{:} km'.format(row.distance_flown_km),
-                            'days': t_delta.days}
+        properties[deployment_name] = {'deployment': deployment_name,
+                                       'status': status,
+                                       'glider': row.glider,
+                                       'project': row.project_name,
+                                       'start_date': row.start_date,
+                                       'end_date': dt1,
+                                       'distance': '{:} km'.format(row.distance_flown_km),
+                                       'days': t_delta.days}
 
-        track['features'][0]['properties'] = deployment_props
-
-        tracks.append(track)
+    # Create the geojson feature collections for all tracks at once and write the kml
+    tracks = []
+    if gps_frames:
+        tracks = [track for deployment_name, track in iter_geojson_tracks(pd.concat(gps_frames, ignore_index=True),
+                                                                          properties=properties)]
 
     if not tracks:
         logging.error('There are no tracks for kml creation')
@@ -198,9 +222,18 @@ if __name__ == '__main__':
                             default='RUCOOL Glider Deployments')
 
     arg_parser.add_argument('-d', '--daily',
-                            help='Average fixes for one point per day',
+                            help='Average fixes for one point per day. Same as --interval 1D',
                             action='store_true')
 
+    arg_parser.add_argument('--interval',
+                            help='Resample each track to one point per interval (i.e.: 1h, 6h, 1D, 7D)',
+                            type=str)
+
+    arg_parser.add_argument('--aggregation',
+                            help='Resampled position in each interval',
+                            choices=['mean', 'median', 'first', 'last'],
+                            default='mean')
+
     arg_parser.add_argument('-g', '--glider',
                             help='Search data sets for the specified glider',
                             type=str)
@@ -245,6 +278,25 @@ if __name__ == '__main__':
                             help='Debug mode. No operations performed',
                             action='store_true')
 
+    arg_parser.add_argument('--simplify',
+                            dest='tolerance',
+                            help='Simplify each track, keeping the GPS fixes needed to stay within this distance of '
+                                 'the original track',
+                            type=float)
+
+    arg_parser.add_argument('--simplify_units',
+                            help='Track simplification tolerance units',
+                            choices=['m', 'degrees'],
+                            default='m')
+
+    arg_parser.add_argument('--intersect_tracks',
+                            help='Select deployments whose GPS track, rather than track bounding box, intersects the '
+                                 'search bounding box. Fetches the track of each deployment in the bounding box',
+                            action='store_true')
+
+    add_client_arguments(arg_parser)
+    add_track_store_argument(arg_parser)
+
     arg_parser.add_argument('-l', '--loglevel',
                             help='Verbosity level',
                             type=str,
@@ -2,11 +2,10 @@
 
 import argparse
 import pandas as pd
-import requests
 import logging
 import sys
-import io
-from rug.api.urls import end_points
+from rug.api import get_client
+from rug.api.decoders import decode_json
 
 
 def main(args):
@@ -18,17 +17,17 @@ def main(args):
     logging.basicConfig(format=log_format, level=log_level)
 
     project_name = args.project_name
-    base_url = end_points['DEPLOYMENTS'].url
 
-    url = '{}/?type=projects&project={}'.format(base_url, project_name)
+    client = get_client()
+    url = '{}/'.format(client.url('DEPLOYMENTS'))
 
-    r = requests.get(url)
+    r = client.get(url, params={'type': 'projects', 'project': project_name})
     if r.status_code != 200:
         logging.error('Request failed: {} ({})'.format(r.status_code, r.reason))
         return 1
 
     # Fetch the response and keep on 'data'
-    response = r.json()['data']
+    response = decode_json(r)['data']
     if not response:
         logging.warning('No deployments found for project {}'.format(project_name))
         return 1
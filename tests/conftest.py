@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import threading
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+
+# The rug package is not installed. Run the tests from a checkout
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+EndPoint = namedtuple('end_point', ['url', 'description', 'args'])
+
+# Bounding box [west, south, east, north] returned for deployments without an entry in FakeApi.tracks
+DEFAULT_BBOX = [-74., 38., -72., 40.]
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    Minimal RU-COOL gliders API serving the deployments, active deployments and track bounding boxes of the server
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(self.path)
+
+        if url.path.rstrip('/') == '/deployments':
+            records = self.server.deployments
+            query = parse_qs(url.query)
+            if 'active' in url.query:
+                records = [r for r in records if r.get('end_date_epoch') is None]
+            elif 'type' in query and not self.server.pushdown:
+                pass
+            elif query.get('type') == ['gliders']:
+                records = [r for r in records if r.get('glider_name') in query.get('glider', [])]
+            return self._send_json({'data': records})
+
+        if url.path.rstrip('/') == '/tracks':
+            deployment = parse_qs(url.query).get('deployment', [''])[0]
+            if deployment in self.server.failing:
+                self.send_response(500)
+                self.end_headers()
+                return
+            return self._send_json({'bbox': self.server.tracks.get(deployment, DEFAULT_BBOX),
+                                    'features': self.server.features.get(deployment, [])})
+
+        self.send_response(404)
+        self.end_headers()
+
+    def _send_json(self, response):
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_api():
+    """
+    Local fake API server. Set server.deployments (deployment records), server.tracks (deployment name to bounding
+    box, [] for no track), server.features (deployment name to track features), server.failing (deployment names
+    whose track requests return 500) and server.pushdown (False to ignore the deployment type query parameters and
+    answer with all deployments)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+    server.deployments = []
+    server.tracks = {}
+    server.features = {}
+    server.failing = set()
+    server.pushdown = True
+    server.requests = []
+    base_url = 'http://127.0.0.1:{:}'.format(server.server_address[1])
+    server.end_points = {'DEPLOYMENTS': EndPoint('{:}/deployments'.format(base_url), 'Deployments', {}),
+                         'ACTIVE_DEPLOYMENTS': EndPoint('{:}/deployments/?active'.format(base_url), 'Active', {}),
+                         'TRACKS': EndPoint('{:}/tracks'.format(base_url), 'Tracks', ['deployment'])}
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,80 @@
+import pytest
+from rug.api.client import RugApiClient
+from rug.api.query import DeploymentQuery
+from rug.api.throttle import RetryPolicy
+from rug.db import DeploymentCatalog
+
+
+def deployment_record(deployment_id, end_date_epoch=1580515200):
+    return {'deployment_name': 'ru{:02d}-20200101T0000'.format(deployment_id),
+            'deployment_id': deployment_id,
+            'glider_id': deployment_id,
+            'glider_name': 'ru{:02d}'.format(deployment_id),
+            'project_id': 1,
+            'project_name': 'Test',
+            'start_date_epoch': 1577836800,
+            'end_date_epoch': end_date_epoch}
+
+
+@pytest.fixture
+def catalog(fake_api, tmp_path):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    client = RugApiClient(urls=fake_api.end_points, retry=RetryPolicy(total=0))
+
+    with DeploymentCatalog(str(tmp_path / 'catalog.sqlite'), client=client) as catalog:
+        yield catalog
+
+    client.close()
+
+
+def test_failed_bbox_is_fetched_again(fake_api, catalog):
+    failing = fake_api.deployments[2]['deployment_name']
+    fake_api.failing = {failing}
+
+    summary = catalog.sync(full=True)
+
+    assert summary['bboxes'] == 4
+    assert failing not in catalog.deployments(has_track=True).index
+
+    # The API recovers: an incremental sync stores the missing bounding box
+    fake_api.failing = set()
+    summary = catalog.sync()
+
+    assert summary['mode'] == 'incremental'
+    assert summary['bboxes'] == 1
+    assert failing in catalog.deployments(north=40., south=38., east=-72., west=-74.).index
+
+
+def test_no_track_is_stored_and_refreshed_on_full_sync(fake_api, catalog):
+    no_track = fake_api.deployments[1]['deployment_name']
+    fake_api.tracks = {no_track: []}
+
+    catalog.sync(full=True)
+
+    assert catalog.deployments(has_track=False).index.tolist() == [no_track]
+    assert catalog.sync()['bboxes'] == 0
+
+    fake_api.tracks = {}
+    catalog.sync(full=True)
+
+    assert catalog.deployments(has_track=False).empty
+    assert no_track in catalog.deployments(has_track=True).index
+
+
+def test_query_predicates(catalog):
+    catalog.sync(full=True)
+
+    query = DeploymentQuery(glider='ru03', exact=True)
+    assert query.catalog_predicates()['glider'] == 'ru03'
+    assert query.filter(catalog.deployments(**query.catalog_predicates())).index.tolist() == ['ru03-20200101T0000']
+
+    # Patterns are matched by filter() only
+    query = DeploymentQuery(glider='ru0[13]', project_name='te')
+    predicates = query.catalog_predicates()
+    assert 'glider' not in predicates
+    assert predicates['project_name'] == 'te'
+    assert query.filter(catalog.deployments(**predicates)).index.tolist() == ['ru01-20200101T0000',
+                                                                              'ru03-20200101T0000']
+
+    query = DeploymentQuery(start_date='2020-01-02')
+    assert catalog.deployments(**query.catalog_predicates()).empty
@@ -0,0 +1,53 @@
+import argparse
+import pytest
+from rug.api import add_client_arguments, client_from_args, get_client, set_client
+from rug.api.cache import DEFAULT_CACHE_DIR
+from rug.db import TrackStore, DEFAULT_TRACK_DIR, add_track_store_argument, track_store_from_args
+
+
+@pytest.fixture
+def arg_parser():
+    return add_client_arguments(argparse.ArgumentParser())
+
+
+@pytest.fixture
+def shared_client():
+    previous = get_client()
+    yield
+    get_client().close()
+    set_client(previous)
+
+
+def test_defaults(arg_parser):
+    args = arg_parser.parse_args([])
+
+    assert args.workers == 8
+    assert args.max_rate is None
+    assert args.cache_dir is None
+
+
+def test_default_cache_directory(arg_parser):
+    assert arg_parser.parse_args(['--cache']).cache_dir == DEFAULT_CACHE_DIR
+
+
+def test_client_from_args(arg_parser, shared_client, tmp_path):
+    args = arg_parser.parse_args(['--workers', '2', '--max_rate', '5', '--cache', str(tmp_path / 'cache')])
+
+    client = client_from_args(args)
+
+    assert get_client() is client
+    assert client.cache is not None
+    assert client.rate_limiter is not None
+    assert args.workers == 2
+
+
+def test_track_store_from_args(tmp_path):
+    arg_parser = add_track_store_argument(argparse.ArgumentParser())
+
+    assert track_store_from_args(arg_parser.parse_args([])) is None
+    assert arg_parser.parse_args(['--tracks']).track_dir == DEFAULT_TRACK_DIR
+
+    store = track_store_from_args(arg_parser.parse_args(['--tracks', str(tmp_path / 'tracks')]))
+
+    assert isinstance(store, TrackStore)
+    assert (tmp_path / 'tracks').is_dir()
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+from rug.api import df2geodf
+from rug.api.client import RugApiClient
+from rug.api.throttle import CircuitBreaker, CircuitOpenError, RetryPolicy
+from conftest import EndPoint
+
+
+def create_client(server, **kwargs):
+    return RugApiClient(urls=server.end_points, retry=RetryPolicy(total=3, backoff_factor=0.), **kwargs)
+
+
+def test_failing_tracks_do_not_open_the_circuit(fake_api):
+    deployment_names = ['ru{:02d}-20200101T0000'.format(i) for i in range(20)]
+    fake_api.failing = set(deployment_names[3:5])
+    deployments = pd.DataFrame({'end_date': pd.Timestamp('2020-02-01')}, index=deployment_names)
+
+    with create_client(fake_api) as client:
+        geo_df = df2geodf(deployments, client=client)
+
+        assert client.circuit_breaker.state == 'closed'
+
+    assert geo_df.geometry.is_empty.sum() == 2
+    assert geo_df.geometry.is_empty[deployment_names[3:5]].all()
+    # Each failing track is retried 3 times
+    assert len(fake_api.requests) == 18 + 2 * 4
+
+
+def test_one_failure_per_request(fake_api):
+    fake_api.failing = {'broken'}
+    breaker = CircuitBreaker(failure_threshold=2)
+
+    with create_client(fake_api, circuit_breaker=breaker) as client:
+        r = client.get('{:}/?deployment=broken'.format(client.url('TRACKS')))
+
+    assert r.status_code == 500
+    assert len(fake_api.requests) == 4
+    assert breaker.failures == 1
+    assert breaker.state == 'closed'
+
+
+def test_repeated_resource_failures_count_once():
+    breaker = CircuitBreaker(failure_threshold=2)
+    for _ in range(5):
+        breaker.record_failure('http://host/tracks/?deployment=broken')
+
+    assert breaker.failures == 1
+    assert breaker.state == 'closed'
+
+
+def test_different_resource_failures_open_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.)
+    breaker.record_failure('a')
+    breaker.record_failure('b')
+    breaker.record_success()
+    breaker.record_failure('c')
+    breaker.record_failure('d')
+
+    assert breaker.state == 'closed'
+
+    breaker.record_failure('e')
+
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_unreachable_host_opens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60.)
+    end_points = {'TRACKS': EndPoint('http://127.0.0.1:9/tracks', 'Closed port', ['deployment'])}
+
+    with RugApiClient(urls=end_points, retry=RetryPolicy(total=0), circuit_breaker=breaker, timeout=1) as client:
+        for deployment in ['a', 'b', 'c']:
+            with pytest.raises(Exception):
+                client.get('{:}/?deployment={:}'.format(client.url('TRACKS'), deployment))
+
+        with pytest.raises(CircuitOpenError):
+            client.get('{:}/?deployment=d'.format(client.url('TRACKS')))
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from geopandas import GeoDataFrame
+from shapely.geometry import Point, Polygon
+from rug.api import df2geodf, bbox_to_polygon
+from rug.api.client import RugApiClient
+from rug.api.throttle import RetryPolicy
+from rug.db import TrackStore
+from rug.geo import locate_datasets, DatasetIndex, _bounding_box, _intersect_tracks
+
+# Deployment name to [west, south, east, north] track bounding box and the (longitude, latitude) GPS fixes of a track
+# running along its diagonal
+TRACKS = {'ru01-20200101T0000': [-74., 38., -72., 40.],
+          'ru02-20200101T0000': [-70., 30., -60., 40.],
+          'ru03-20200101T0000': [-65., 35., -64., 36.]}
+
+
+def track_features(bbox, n=11):
+    west, south, east, north = bbox
+    return [{'type': 'Feature',
+             'geometry': {'type': 'Point',
+                          'coordinates': [west + (east - west) * i / (n - 1), south + (north - south) * i / (n - 1)]},
+             'properties': {'gps_epoch': 1577836800 + 3600 * i}} for i in range(n)]
+
+
+@pytest.fixture
+def client(fake_api):
+    fake_api.tracks = dict(TRACKS)
+    fake_api.features = {d: track_features(bbox) for d, bbox in TRACKS.items()}
+
+    with RugApiClient(urls=fake_api.end_points, retry=RetryPolicy(total=0)) as client:
+        yield client
+
+
+@pytest.fixture
+def datasets(client):
+    deployments = pd.DataFrame({'end_date': pd.Timestamp('2020-02-01')}, index=list(TRACKS))
+
+    return df2geodf(deployments, client=client)
+
+
+def track_requests(server):
+    return [r for r in server.requests if r.startswith('/tracks')]
+
+
+def test_locate_datasets(datasets, client):
+    # The box overlaps the ru02 bounding box but not its diagonal track
+    bbox = dict(north=40., south=37., east=-66., west=-69.)
+
+    assert locate_datasets(datasets, **bbox).index.tolist() == ['ru02-20200101T0000']
+    assert locate_datasets(datasets, exact=True, client=client, **bbox).empty
+
+
+def test_exact_locate_datasets_reads_the_track_store(fake_api, datasets, client, tmp_path):
+    # The box overlaps the ru01 and ru02 bounding boxes but only the ru01 track
+    bbox = dict(north=40., south=37., east=-66., west=-73.)
+    store = TrackStore(str(tmp_path / 'tracks'), client=client)
+
+    found = locate_datasets(datasets, exact=True, store=store, **bbox)
+    assert found.index.tolist() == ['ru01-20200101T0000']
+    assert len(track_requests(fake_api)) == 3 + 2
+
+    # Recovered tracks are complete in the store and are not downloaded again
+    found = locate_datasets(datasets, exact=True, store=store, max_workers=2, **bbox)
+    assert found.index.tolist() == ['ru01-20200101T0000']
+    assert len(track_requests(fake_api)) == 3 + 2
+
+
+def random_datasets(n=500, seed=0):
+    """
+    Deployments with random track bounding boxes, some of them empty, and random walk tracks inside them
+    """
+    rng = np.random.default_rng(seed)
+    names = ['ru{:04d}-20200101T0000'.format(i) for i in range(n)]
+    west = rng.uniform(-180., 170., n)
+    south = rng.uniform(-80., 70., n)
+    width = rng.uniform(.1, 10., (n, 2))
+    polygons = [bbox_to_polygon([w, s, w + dx, s + dy]) for w, s, (dx, dy) in zip(west, south, width)]
+    polygons[::17] = [Polygon()] * len(polygons[::17])
+
+    tracks = {}
+    for name, w, s, (dx, dy) in zip(names, west, south, width):
+        steps = rng.normal(0., .05, (200, 2)) * (dx, dy)
+        xy = np.clip((w + dx / 2, s + dy / 2) + np.cumsum(steps, axis=0), (w, s), (w + dx, s + dy))
+        tracks[name] = pd.DataFrame({'latitude': xy[:, 1], 'longitude': xy[:, 0]})
+
+    return GeoDataFrame({'end_date': pd.Timestamp('2020-02-01')}, geometry=polygons, index=names), tracks
+
+
+BBOXES = [dict(north=90., south=-90., east=180., west=-180.),
+          dict(north=45., south=35., east=-60., west=-80.),
+          dict(north=0., south=-20., east=30., west=10.),
+          dict(north=1., south=.9, east=1., west=.9)]
+
+
+@pytest.mark.parametrize('bbox', BBOXES)
+def test_index_matches_locate_datasets(bbox):
+    datasets, tracks = random_datasets()
+    index = DatasetIndex(datasets)
+
+    expected = locate_datasets(datasets, **bbox).index.tolist()
+
+    assert index.bbox(**bbox).index.tolist() == expected
+    assert locate_datasets(index, **bbox).index.tolist() == expected
+
+
+@pytest.mark.parametrize('bbox', BBOXES)
+def test_track_index_matches_intersect_tracks(bbox):
+    datasets, tracks = random_datasets()
+    # Index the track lines, in the (lat, lon) axis order of the df2geodf geometries
+    lines = GeoDataFrame(datasets[['end_date']],
+                         geometry=[shapely.linestrings(tracks[d][['latitude', 'longitude']].to_numpy())
+                                   for d in datasets.index])
+
+    expected = _intersect_tracks(datasets, _bounding_box(**bbox), tracks=tracks).index.tolist()
+
+    assert DatasetIndex(lines).bbox(**bbox).index.tolist() == expected
+
+
+def test_index_polygon_and_point_queries():
+    datasets, tracks = random_datasets()
+    index = DatasetIndex(datasets)
+
+    # (lon, lat) polygon
+    polygon = Polygon([(-80., 30.), (-60., 30.), (-70., 45.)])
+    latlon = shapely.transform(polygon, lambda coords: coords[:, ::-1])
+    assert index.intersects(polygon).index.tolist() == datasets[datasets.intersects(latlon)].index.tolist()
+    assert index.intersects(latlon, latlon=True).index.tolist() == index.intersects(polygon).index.tolist()
+
+    # The radius is in degrees
+    for latitude, longitude, radius in [(40., -70., 2.), (0., 0., 10.), (60., 100., .5)]:
+        distance = datasets.distance(Point(latitude, longitude))
+        expected = datasets[~datasets.is_empty & (distance <= radius)].index.tolist()
+        assert index.point(latitude, longitude, radius).index.tolist() == expected
@@ -0,0 +1,77 @@
+import json
+import numpy as np
+import pytest
+from rug.geo import iter_geojson_features, stream_track_to_df, features_to_track_df
+
+
+def track_json(n=200):
+    rng = np.random.default_rng(0)
+    coordinates = rng.uniform(-80., -60., (n, 2)).round(6).tolist()
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'LineString', 'coordinates': coordinates},
+                 'properties': {'deployment': 'ru01', 'note': 'a "features": [] string'}}]
+    features += [{'type': 'Feature',
+                  'geometry': {'type': 'Point', 'coordinates': c},
+                  'properties': {'gps_epoch': 1577836800 + 60 * i}} for i, c in enumerate(coordinates)]
+    features.append({'type': 'Feature',
+                     'geometry': {'type': 'Point', 'coordinates': [-70., 40.]},
+                     'properties': {'waypoint': True}})
+
+    return {'type': 'FeatureCollection', 'description': 'features', 'bbox': [-80., 30., -60., 45.],
+            'features': features}
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 4096, 10 ** 6])
+def test_features_in_any_chunking(size):
+    collection = track_json()
+    body = json.dumps(collection, indent=1).encode()
+
+    assert list(iter_geojson_features(chunked(body, size))) == collection['features']
+
+
+def test_multibyte_characters_split_across_chunks():
+    collection = {'type': 'FeatureCollection',
+                  'features': [{'type': 'Feature', 'geometry': None, 'properties': {'name': 'Café °N'}}]}
+    body = json.dumps(collection, ensure_ascii=False).encode()
+
+    assert list(iter_geojson_features(chunked(body, 1))) == collection['features']
+
+
+def test_no_features():
+    assert list(iter_geojson_features([b'{"type": "FeatureCollection", "bbox": []}'])) == []
+    assert list(iter_geojson_features([b'{}'])) == []
+
+
+def test_truncated():
+    body = json.dumps(track_json(20)).encode()
+
+    with pytest.raises(ValueError):
+        list(iter_geojson_features(chunked(body[:len(body) // 2], 100)))
+
+
+def test_stream_track_to_df():
+    collection = track_json()
+    body = json.dumps(collection).encode()
+
+    track_df = stream_track_to_df(chunked(body, 1000), size=16)
+
+    assert track_df.equals(features_to_track_df(collection['features']))
+    assert track_df.shape[0] == 200
+
+
+def test_null_values():
+    collection = track_json(5)
+    collection['features'][1]['properties']['gps_epoch'] = None
+    collection['features'][2]['geometry']['coordinates'] = [None, None]
+    body = json.dumps(collection).encode()
+
+    track_df = features_to_track_df(collection['features'])
+
+    assert track_df.shape[0] == 5
+    assert track_df.time.isna().tolist() == [True, False, False, False, False]
+    assert track_df.latitude.isna().tolist() == [False, True, False, False, False]
+    assert stream_track_to_df(chunked(body, 100)).equals(track_df)
@@ -0,0 +1,77 @@
+from decimal import Decimal, ROUND_HALF_DOWN
+import numpy as np
+import pytest
+from rug.geo import quantize
+
+PRECISIONS = ['1E-15', '1E-12', '1E-9', '0.000001', '0.00001', '0.0001', '0.001', '0.01', '0.1', '1', '1E+1']
+
+
+def decimal_quantize(values, precision):
+    return np.array([float(Decimal(v).quantize(Decimal(precision), rounding=ROUND_HALF_DOWN)) for v in values])
+
+
+def assert_identical(values, precision):
+    expected = decimal_quantize(values, precision)
+    quantized = quantize(values, precision)
+
+    assert quantized.dtype == np.float64
+    np.testing.assert_array_equal(quantized, expected)
+    # assert_array_equal treats 0.0 and -0.0 as equal
+    np.testing.assert_array_equal(np.signbit(quantized), np.signbit(expected))
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_random_positions(precision):
+    rng = np.random.default_rng(11)
+    values = np.concatenate((rng.uniform(-180., 180., 5000), rng.uniform(-90., 90., 5000)))
+
+    assert_identical(values, precision)
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_random_magnitudes(precision):
+    rng = np.random.default_rng(12)
+    values = rng.choice([-1., 1.], 5000) * 10. ** rng.uniform(-8., 3., 5000)
+
+    assert_identical(values, precision)
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_exact_binary_ties(precision):
+    # Odd multiples of 2 ** -(digits + 1) are exactly half way between two multiples of the precision
+    rng = np.random.default_rng(13)
+    digits = -Decimal(precision).as_tuple().exponent
+    unit = 2. ** -(digits + 1) if digits >= 0 else 5. * 10. ** (-digits - 1)
+    values = (2. * rng.integers(0, min(2 ** 20, int(1e3 / unit / 2.)), 2000) + 1.) * unit
+
+    assert_identical(np.concatenate((values, -values)), precision)
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_near_ties(precision):
+    # Values one ulp either side of the decimal half way points
+    digits = -Decimal(precision).as_tuple().exponent
+    halves = (np.arange(-500, 500) + .5) * 10. ** -digits
+    values = np.concatenate((np.nextafter(halves, -np.inf), halves, np.nextafter(halves, np.inf)))
+
+    assert_identical(values, precision)
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_signed_zeros(precision):
+    assert_identical(np.array([0., -0., 1e-20, -1e-20]), precision)
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_nan(precision):
+    quantized = quantize([np.nan, 1.5, np.nan], precision)
+
+    assert np.isnan(quantized[[0, 2]]).all()
+    assert quantized[1] == decimal_quantize([1.5], precision)[0]
+
+
+def test_shape_is_kept():
+    values = np.arange(12.).reshape(3, 4) / 7.
+
+    assert quantize(values).shape == (3, 4)
+    assert quantize(values, '1E+1').shape == (3, 4)
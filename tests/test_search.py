@@ -0,0 +1,53 @@
+from rug.api import search_deployments
+from rug.api.client import RugApiClient
+from rug.api.query import DeploymentQuery
+from rug.api.throttle import RetryPolicy
+from test_catalog import deployment_record
+
+
+def create_client(server):
+    return RugApiClient(urls=server.end_points, retry=RetryPolicy(total=0))
+
+
+def test_local_filtering_by_default(fake_api):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    with create_client(fake_api) as client:
+        deployments = search_deployments(DeploymentQuery(glider='ru03', exact=True), client=client)
+
+    assert deployments.index.tolist() == ['ru03-20200101T0000']
+    assert not [r for r in fake_api.requests if 'type=' in r]
+
+
+def test_pushdown(fake_api):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    with create_client(fake_api) as client:
+        deployments = search_deployments(DeploymentQuery(glider='ru03', exact=True), client=client, pushdown=True)
+
+    assert deployments.index.tolist() == ['ru03-20200101T0000']
+    assert not [r for r in fake_api.requests if r.rstrip('/') == '/deployments']
+
+
+def test_ignored_pushdown_is_filtered_locally(fake_api):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    fake_api.pushdown = False
+    with create_client(fake_api) as client:
+        deployments = search_deployments(DeploymentQuery(glider='ru03', exact=True), client=client, pushdown=True)
+
+    assert deployments.index.tolist() == ['ru03-20200101T0000']
+
+
+def test_empty_pushdown_does_not_download_all_deployments(fake_api):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    with create_client(fake_api) as client:
+        deployments = search_deployments(DeploymentQuery(glider='ru99', exact=True), client=client, pushdown=True)
+
+    assert deployments.empty
+    assert len(fake_api.requests) == 1
+
+
+def test_no_matches(fake_api):
+    fake_api.deployments = [deployment_record(i) for i in range(5)]
+    with create_client(fake_api) as client:
+        deployments = search_deployments(DeploymentQuery(glider='ru99', exact=True), client=client)
+
+    assert deployments.empty